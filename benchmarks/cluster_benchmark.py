@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Benchmark the cluster integration against the local grid engine
+emulator, see :py:mod:`jip.emulator`. The benchmark measures
+
+ * the submission rate in jobs per second
+ * the cost of a single call to list the active jobs, with all the
+   submitted jobs in the queue
+ * the end-to-end latency of a single tool job, from submission until
+   the result is loaded
+
+Results are printed as JSON. Example::
+
+    python benchmarks/cluster_benchmark.py --jobs 200 --latency 0.01
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from jip.tools import Tool
+from jip.cluster import Slurm, SunGrid
+from jip.emulator import install
+
+
+class Add(Tool):
+    name = "add"
+
+    def call(self, args):
+        return args["a"] + args["b"]
+
+
+def create_cluster(flavor, commands):
+    """Create the cluster instance for the emulated commands"""
+    if flavor == "slurm":
+        return Slurm(sbatch=commands["sbatch"], squeue=commands["squeue"],
+                     scontrol=commands["scontrol"], sacct=commands["sacct"],
+                     scancel=commands["scancel"])
+    os.environ.setdefault("USER", "jip")
+    return SunGrid(qsub=commands["qsub"], qstat=commands["qstat"],
+                   qrls=commands["qrls"], qacct=commands["qacct"],
+                   qdel=commands["qdel"])
+
+
+def run(flavor="slurm", jobs=100, latency=0.0, polls=10):
+    """Run the benchmark and return a dictionary with the results"""
+    directory = tempfile.mkdtemp(prefix="jip-benchmark-")
+    try:
+        commands = install(os.path.join(directory, "bin"), latency=latency)
+        cluster = create_cluster(flavor, commands)
+        logdir = os.path.join(directory, "logs")
+        os.makedirs(logdir)
+
+        # submit held jobs so the queue is filled when polling
+        tool = Add()
+        tool.job.logdir = logdir
+        tool.job.name = "add"
+        start = time.time()
+        features = [cluster.submit(tool, {"a": i, "b": 1}, hold=True)
+                    for i in range(jobs)]
+        submit_time = time.time() - start
+
+        start = time.time()
+        for i in range(polls):
+            active = cluster.list()
+        poll_time = (time.time() - start) / polls
+        assert len(active) == jobs
+
+        cluster.cancel([f.jobid for f in features])
+
+        start = time.time()
+        feature = cluster.submit(tool, {"a": 1, "b": 1})
+        result = feature.get(cluster, check_interval=0.05)
+        latency_time = time.time() - start
+        assert result == 2
+
+        return {"flavor": flavor,
+                "jobs": jobs,
+                "command_latency": latency,
+                "submit_seconds": submit_time,
+                "submit_rate": jobs / submit_time,
+                "poll_seconds": poll_time,
+                "end_to_end_seconds": latency_time}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--flavor", choices=["slurm", "sge"],
+                        default="slurm", help="the emulated grid engine")
+    parser.add_argument("--jobs", type=int, default=100,
+                        help="number of submitted jobs")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="emulated latency of each command in seconds")
+    parser.add_argument("--polls", type=int, default=10,
+                        help="number of list calls")
+    args = parser.parse_args()
+    # make the tool importable by the jobs
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__))] +
+        [p for p in [os.getenv("PYTHONPATH")] if p])
+    print json.dumps(run(args.flavor, args.jobs, args.latency, args.polls),
+                     indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    # import the module under its name, so the tool can be un-pickled by
+    # the jobs
+    import cluster_benchmark
+    cluster_benchmark.main()
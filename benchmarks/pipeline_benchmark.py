@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Benchmark pipeline construction and resolution on synthetic DAGs.
+The following graph shapes are generated:
+
+ * chain      -- a linear chain of steps
+ * fanout     -- a single source step with all other steps depending on it
+ * diamond    -- a lattice of steps where each step depends on the two
+                 neighbouring steps of the previous row
+ * replicated -- a small per-sample subgraph, a step that forks into two
+                 steps that are merged again, replicated for many samples
+
+For each shape and size, the time to build the pipeline (adding steps and
+wiring parameters, including the circle checks done on every assignment),
+a circle detection from every source step, which covers all steps,
+sorting, resolving all configurations and validation is measured,
+together with the peak memory used. Every case runs in a separate
+process so the memory measurements do not interfere.
+Cases that do not finish within the timeout are reported as timed out.
+
+Results are printed as JSON or written to the output file. Example::
+
+    python benchmarks/pipeline_benchmark.py --sizes 10,100,1000 -o out.json
+"""
+import argparse
+import json
+import math
+import resource
+import sys
+import time
+from multiprocessing import Process, Queue
+
+from jip.tools import Tool
+from jip.pipelines import Pipeline
+
+SHAPES = ["chain", "fanout", "diamond", "replicated"]
+
+
+class Merge(Tool):
+    command = "cat ${a} ${b} > ${output}"
+    inputs = {"a": None, "b": None}
+    outputs = {"output": None}
+
+
+def _add(pipeline, name, a="input.txt", b="input.txt"):
+    """Add a step to the pipeline"""
+    step = pipeline.add(Merge(), name)
+    step.a = a
+    step.b = b
+    step.output = "%s.out" % name
+    return step
+
+
+def build(shape, size):
+    """Build a pipeline of the given shape with roughly size steps"""
+    p = Pipeline()
+    if shape == "chain":
+        step = _add(p, "s0")
+        for i in range(1, size):
+            step = _add(p, "s%d" % i, step.output)
+    elif shape == "fanout":
+        source = _add(p, "source")
+        for i in range(1, size):
+            _add(p, "s%d" % i, source.output)
+    elif shape == "diamond":
+        width = max(1, int(math.sqrt(size)))
+        row = [_add(p, "s0_%d" % i) for i in range(width)]
+        for r in range(1, max(1, size // width)):
+            row = [_add(p, "s%d_%d" % (r, i), row[i].output,
+                        row[(i + 1) % width].output)
+                   for i in range(width)]
+    elif shape == "replicated":
+        for sample in range(max(1, size // 4)):
+            prefix = "sample%d" % sample
+            source = _add(p, "%s_source" % prefix)
+            left = _add(p, "%s_left" % prefix, source.output)
+            right = _add(p, "%s_right" % prefix, source.output)
+            _add(p, "%s_merge" % prefix, left.output, right.output)
+    else:
+        raise ValueError("Unknown shape %s" % shape)
+    return p
+
+
+def _peak_rss():
+    """Return the peak resident set size of the process in kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(shape, size):
+    """Run a single benchmark case and return the result dictionary"""
+    rss = _peak_rss()
+    timings = {}
+
+    start = time.time()
+    p = build(shape, size)
+    timings["build"] = time.time() - start
+
+    steps = p.tools.values()
+    sources = [s for s in steps if len(s._in_edges) == 0]
+    start = time.time()
+    for source in sources:
+        p._detect_circles(source)
+    timings["circles"] = time.time() - start
+
+    start = time.time()
+    sorted_steps = p.get_sorted_tools()
+    timings["sort"] = time.time() - start
+
+    start = time.time()
+    for step in sorted_steps:
+        p.get_configuration(step)
+    timings["resolve"] = time.time() - start
+
+    start = time.time()
+    p.validate()
+    timings["validate"] = time.time() - start
+
+    return {"shape": shape,
+            "steps": len(steps),
+            "seconds": timings,
+            "total_seconds": sum(timings.values()),
+            "peak_rss_kb": _peak_rss() - rss}
+
+
+def _run_case(queue, shape, size):
+    try:
+        queue.put(measure(shape, size))
+    except Exception, e:
+        queue.put({"shape": shape, "steps": size, "error": str(e)})
+
+
+def run(shapes=SHAPES, sizes=(10, 100, 1000), timeout=60):
+    """Run all benchmark cases, each in its own process, and return the
+    list of results. Larger sizes of a shape are skipped once a case of
+    the shape timed out.
+    """
+    import Queue as queues
+    results = []
+    for shape in shapes:
+        for size in sorted(sizes):
+            queue = Queue()
+            process = Process(target=_run_case, args=(queue, shape, size))
+            process.start()
+            try:
+                result = queue.get(True, timeout)
+            except queues.Empty:
+                process.terminate()
+                result = {"shape": shape, "steps": size,
+                          "error": "timeout after %ds" % timeout}
+            process.join()
+            sys.stderr.write("%-10s %7d steps %s\n" % (
+                shape, result["steps"],
+                "%8.3fs" % result["total_seconds"]
+                if "total_seconds" in result else result["error"]))
+            results.append(result)
+            if "error" in result:
+                break
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--shapes", default=",".join(SHAPES),
+                        help="comma separated list of graph shapes")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="comma separated list of pipeline sizes")
+    parser.add_argument("--timeout", type=int, default=60,
+                        help="timeout in seconds for a single case")
+    parser.add_argument("-o", "--output", help="write the results to "
+                        "the given JSON file instead of stdout")
+    args = parser.parse_args()
+    results = run(args.shapes.split(","),
+                  [int(s) for s in args.sizes.split(",")], args.timeout)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+    else:
+        print json.dumps(results, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
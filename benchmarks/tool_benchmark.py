@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Benchmark the fixed per-step cost of running tools. The benchmark
+runs many no-op tools through the different execution paths and reports
+steps per second and the p50 and p99 overhead per step:
+
+ * python   -- a tool that overrides call(), run with Tool.run
+ * bash     -- an interpreted no-op bash tool, run with Tool.run
+ * pipeline -- the bash tool as a pipeline step, including the
+               configuration resolution and the is_done check
+ * remote   -- the python tool run through the remote bootstrap that is
+               used on cluster nodes, i.e. `python -m jip.remote`
+
+In addition, the phases of a bash tool run are timed individually:
+signal handler setup, listener dispatch, up-to-date check, template
+rendering, writing the temporary script and spawning the interpreter.
+The phases are measured by executing the same operations Tool.run and
+Tool.call perform, so their sum is close to, but not exactly, the total.
+
+Results are printed as JSON. Example::
+
+    python benchmarks/tool_benchmark.py --steps 1000 --listeners 4
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from jip.tools import Tool
+from jip.pipelines import Pipeline
+
+
+class Noop(Tool):
+    name = "noop"
+
+    def call(self, args):
+        return None
+
+
+class BashNoop(Tool):
+    name = "bash-noop"
+    command = "true ${output}"
+    inputs = {"input": None}
+    outputs = {"output": None}
+
+
+def _listener(tool, args):
+    pass
+
+
+def _tool(cls, listeners):
+    """Create a tool with the given number of listeners per event"""
+    tool = cls()
+    tool.handle_signals = True
+    tool.job.verbose = False
+    for event in [tool.on_start, tool.on_success, tool.on_finish]:
+        event.extend([_listener] * listeners)
+    return tool
+
+
+def _summary(samples):
+    """Summarize a list of per-step timings in seconds"""
+    samples = sorted(samples)
+    total = sum(samples)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    return {"steps": len(samples),
+            "steps_per_second": len(samples) / total if total > 0 else None,
+            "mean_ms": total * 1000.0 / len(samples),
+            "p50_ms": percentile(0.5) * 1000.0,
+            "p99_ms": percentile(0.99) * 1000.0}
+
+
+def _timed(function, steps):
+    """Call the function steps times and return the timings"""
+    samples = []
+    for i in range(steps):
+        start = time.time()
+        function(i)
+        samples.append(time.time() - start)
+    return samples
+
+
+def bench_paths(steps, listeners, directory):
+    """Time the execution paths"""
+    from jip.remote import _encode_payload, _ToolWrapper
+    results = {}
+    python_tool = _tool(Noop, listeners)
+    results["python"] = _summary(_timed(lambda i: python_tool.run({}),
+                                        steps))
+
+    bash_tool = _tool(BashNoop, listeners)
+    args = {"input": "in", "output": os.path.join(directory, "out")}
+    results["bash"] = _summary(_timed(lambda i: bash_tool.run(dict(args)),
+                                      steps))
+
+    p = Pipeline()
+    step = p.add(_tool(BashNoop, listeners), "step")
+    step.input = "in"
+    step.output = os.path.join(directory, "missing", "out")
+
+    def run_step(i):
+        if not step.is_done():
+            step.run()
+    results["pipeline"] = _summary(_timed(run_step, steps))
+
+    payload = os.path.join(directory, "payload")
+    with open(payload, 'wb') as out:
+        out.write(_encode_payload(_ToolWrapper(python_tool, {})))
+    result = os.path.join(directory, "result")
+    remote_steps = max(1, steps // 10)
+    results["remote"] = _summary(_timed(lambda i: subprocess.check_call(
+        [sys.executable, "-m", "jip.remote", "--result", result, payload],
+        stderr=open(os.devnull, 'w')), remote_steps))
+    return results
+
+
+def bench_phases(steps, listeners, directory):
+    """Time the individual phases of a bash tool run"""
+    from tempfile import NamedTemporaryFile
+    tool = _tool(BashNoop, listeners)
+    args = {"input": "in", "output": os.path.join(directory, "out")}
+    handler = lambda signum, frame: None
+    devnull = open(os.devnull, 'w')
+
+    def signals(i):
+        for sig in [signal.SIGHUP, signal.SIGTERM, signal.SIGINT]:
+            signal.signal(sig, handler)
+
+    def listeners_dispatch(i):
+        tool._on_start(args)
+        tool._on_success(args)
+        tool._on_finish(args)
+
+    script = tool.get_command(dict(args))
+
+    def temp_file(i):
+        script_file = NamedTemporaryFile()
+        script_file.write(script)
+        script_file.flush()
+        script_file.close()
+
+    script_path = os.path.join(directory, "script.sh")
+    with open(script_path, 'w') as out:
+        out.write(script)
+
+    phases = {
+        "signals": signals,
+        "listeners": listeners_dispatch,
+        "is_done": lambda i: tool.is_done(args),
+        "render": lambda i: tool.get_command(dict(args)),
+        "temp_file": temp_file,
+        "spawn": lambda i: subprocess.Popen(["bash", script_path],
+                                            stdout=devnull,
+                                            stderr=devnull).wait(),
+    }
+    try:
+        return dict((name, _summary(_timed(function, steps)))
+                    for name, function in phases.items())
+    finally:
+        for sig in [signal.SIGHUP, signal.SIGTERM, signal.SIGINT]:
+            signal.signal(sig, signal.SIG_DFL)
+        devnull.close()
+
+
+def run(steps=1000, listeners=0):
+    """Run the benchmark and return the results"""
+    directory = tempfile.mkdtemp(prefix="jip-benchmark-")
+    try:
+        return {"steps": steps,
+                "listeners": listeners,
+                "paths": bench_paths(steps, listeners, directory),
+                "phases": bench_phases(steps, listeners, directory)}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--steps", type=int, default=1000,
+                        help="number of steps per measurement. The remote "
+                        "path runs a tenth of the steps")
+    parser.add_argument("--listeners", type=int, default=0,
+                        help="number of listeners per event")
+    parser.add_argument("-o", "--output", help="write the results to "
+                        "the given JSON file instead of stdout")
+    args = parser.parse_args()
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__))] + sys.path)
+    results = run(args.steps, args.listeners)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+    else:
+        print json.dumps(results, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    # import the module under its name, so the tools can be un-pickled
+    # by the remote bootstrap
+    import tool_benchmark
+    tool_benchmark.main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
-from another.cluster import Slurm, Feature
-from another.tools import Tool
+from jip.cluster import Slurm, Feature
+from jip.tools import Tool
+from jip.emulator import install
 
 
 class MyTool(Tool):
@@ -63,3 +64,54 @@ def test_slurm_load_result_exception():
 
 def test_load_results():
     assert Feature(1)._load_results("test_data/result_4.out") == 4
+
+
+class AddTool(Tool):
+    name = "AddTool"
+
+    def call(self, args):
+        if args.get("fail"):
+            raise ValueError("Something went wrong!")
+        return args["a"] + args["b"]
+
+
+def _emulated_slurm(tmpdir):
+    """Create a Slurm cluster backed by the local grid engine emulator"""
+    commands = install(str(tmpdir.join("emulator")))
+    return Slurm(sbatch=commands["sbatch"], squeue=commands["squeue"],
+                 scontrol=commands["scontrol"], sacct=commands["sacct"],
+                 scancel=commands["scancel"])
+
+
+def _emulated_tool(tmpdir):
+    tool = AddTool()
+    tool.job.logdir = str(tmpdir.join("logs"))
+    tool.job.max_time = "00:01:00"
+    return tool
+
+
+def test_emulated_slurm_submission(tmpdir):
+    slurm = _emulated_slurm(tmpdir)
+    feature = slurm.submit(_emulated_tool(tmpdir), {"a": 1, "b": 3})
+    assert feature is not None
+    assert feature.jobid is not None
+    assert feature.stdout[0] == "/"
+    assert feature.stderr[0] == "/"
+
+
+def test_emulated_slurm_get_result_from_feature(tmpdir):
+    slurm = _emulated_slurm(tmpdir)
+    feature = slurm.submit(_emulated_tool(tmpdir), {"a": 1, "b": 3})
+    assert feature.get(slurm, check_interval=0.1) == 4
+    assert feature.get_accounting(slurm).state == "COMPLETED"
+
+
+def test_emulated_slurm_get_result_exception(tmpdir):
+    slurm = _emulated_slurm(tmpdir)
+    feature = slurm.submit(_emulated_tool(tmpdir), {"a": 1, "b": 3, "fail": True})
+    try:
+        feature.get(slurm, check_interval=0.1)
+        assert False
+    except Exception, e:
+        assert "Something went wrong!" in str(e), str(e)
+
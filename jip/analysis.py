@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""The analysis module computes the critical path of a finished pipeline
+run from the recorded start and end times of the steps and the
+dependencies between them. The report tells which steps determine the
+total runtime and where optimizing a tool or giving it more threads
+pays off::
+
+    pipeline.run()
+    print analyze(pipeline)
+
+The analysis assumes unlimited parallelism, i.e. every step could start
+as soon as its dependencies finished. The critical path is the chain of
+dependent steps with the longest total duration. The slack of a step is
+the time the step could be delayed without extending the critical path.
+Steps that were not executed, for example because they were done
+already, are ignored.
+"""
+
+
+class PathAnalysis(object):
+    """The result of the critical path analysis. Times are in seconds.
+
+    *critical_path* -- the names of the steps on the critical path in
+    execution order
+
+    *length* -- the total duration of the steps on the critical path
+
+    *makespan* -- the wall clock time from the start of the first step to
+    the end of the last step
+
+    *work* -- the total duration of all steps
+
+    *achieved_parallelism* -- the work divided by the makespan
+
+    *available_parallelism* -- the work divided by the length of the
+    critical path, i.e. the average parallelism of an ideal schedule
+
+    *durations* -- dictionary from the step names to their durations
+
+    *slack* -- dictionary from the step names to their slack
+
+    *candidates* -- list of tuples of a step name and the time the
+    critical path would shrink if the step took no time, sorted by the
+    gain in descending order
+    """
+
+    def __init__(self):
+        self.critical_path = []
+        self.length = 0
+        self.makespan = 0
+        self.work = 0
+        self.achieved_parallelism = None
+        self.available_parallelism = None
+        self.durations = {}
+        self.slack = {}
+        self.candidates = []
+
+    def __str__(self):
+        lines = ["Critical path: %s (%.1fs)" % (
+            " -> ".join(self.critical_path), self.length),
+            "Makespan: %.1fs, work: %.1fs" % (self.makespan, self.work)]
+        if self.achieved_parallelism is not None:
+            lines.append("Parallelism: achieved %.2f, available %.2f" % (
+                self.achieved_parallelism, self.available_parallelism))
+        if len(self.candidates) > 0:
+            lines.append("Speed-up candidates:")
+            for name, gain in self.candidates:
+                lines.append("\t%s\t%.1fs of %.1fs" % (
+                    name, gain, self.durations[name]))
+        if len(self.slack) > 0:
+            lines.append("Slack:")
+            for name, slack in sorted(self.slack.items(),
+                                      key=lambda x: (x[1], x[0])):
+                lines.append("\t%s\t%.1fs" % (name, slack))
+        return "\n".join(lines)
+
+
+def analyze(pipeline, timings=None, candidates=5):
+    """Analyze the recorded run of the given pipeline and return a
+    :py:class:`PathAnalysis`. By default, the timings recorded by
+    :py:meth:`jip.pipelines.Pipeline.run` or
+    :py:meth:`jip.pipelines.Pipeline.collect` are used.
+
+    :param pipeline: the :py:class:`jip.pipelines.Pipeline`
+    :param timings: optional dictionary from the step names to tuples of
+                    the start and end time of the step
+    :param candidates: maximum number of speed-up candidates reported
+    """
+    if timings is None:
+        timings = pipeline.timings
+    analysis = PathAnalysis()
+    if len(timings) == 0:
+        return analysis
+    order = [s for s in pipeline.get_sorted_tools() if s._name in timings]
+    if len(order) == 0:
+        return analysis
+    parents = {}
+    children = dict((s._name, []) for s in order)
+    for step in order:
+        parents[step._name] = [d._name for d in step.get_dependencies()
+                               if d._name in timings]
+        for parent in parents[step._name]:
+            children[parent].append(step._name)
+    order = [s._name for s in order]
+    durations = dict((name, max(0, timings[name][1] - timings[name][0]))
+                     for name in order)
+
+    finish, previous = _longest_paths(order, parents, durations)
+    last = max(order, key=lambda name: finish[name])
+    length = finish[last]
+    path = []
+    while last is not None:
+        path.insert(0, last)
+        last = previous[last]
+
+    # the latest time each step could finish without delaying the end
+    latest = {}
+    for name in reversed(order):
+        latest[name] = min([latest[c] - durations[c]
+                            for c in children[name]] + [length])
+
+    gains = []
+    for name in path:
+        changed = dict(durations)
+        changed[name] = 0
+        shortened = max(_longest_paths(order, parents, changed)[0].values())
+        gains.append((name, length - shortened))
+    gains.sort(key=lambda x: -x[1])
+
+    analysis.critical_path = path
+    analysis.length = length
+    analysis.makespan = max(timings[name][1] for name in order) - \
+        min(timings[name][0] for name in order)
+    analysis.work = sum(durations.values())
+    if analysis.makespan > 0 and length > 0:
+        analysis.achieved_parallelism = float(analysis.work) / \
+            analysis.makespan
+        analysis.available_parallelism = float(analysis.work) / length
+    analysis.durations = durations
+    analysis.slack = dict((name, latest[name] - finish[name])
+                          for name in order)
+    analysis.candidates = [g for g in gains if g[1] > 0][:candidates]
+    return analysis
+
+
+def _longest_paths(order, parents, durations):
+    """Compute the earliest finish time of every step if all steps start
+    as soon as their parents finished. Returns a tuple of the dictionary
+    of finish times and the dictionary of the parent that finished last
+    for each step.
+    """
+    finish = {}
+    previous = {}
+    for name in order:
+        begin = 0
+        previous[name] = None
+        for parent in parents[name]:
+            if finish[parent] > begin:
+                begin = finish[parent]
+                previous[name] = parent
+        finish[name] = begin + durations[name]
+    return finish, previous
@@ -4,35 +4,52 @@ tool instances to a remote execution cluster. All the methods to implement
 the cluster integration are contained in this module.
 
 HPC cluster integration works in a rather simple way. The tool instance is
-pickled and base64 encoded before it it wrapped in in a bash script. The
-script is then submitted to the HPC grid. When the job starts executing,
-the script will start a python interpreter, unpickle the tool instance and
-run it.
+pickled, compressed and base64 encoded before it it wrapped in in a bash
+script. The payload carries a small versioned header so the remote side
+knows how to decode it. The script is then submitted to the HPC grid. When
+the job starts executing, the script runs the :py:mod:`jip.remote`
+bootstrap module, which unpickles the tool instance and runs it.
 
 If an exception is thrown during execution of the tool, the cluster job exits
 with a non-zero exit code, which indicates the failure.
 
-Results of a tool run can be loaded. Their result is pickled to stdout and
-the cluster module provided the ability to load results from the log file. In
+Results of a tool run can be loaded. The bootstrap writes the pickled
+result to a separate result file next to the jobs log files, which is
+loaded with a single read. For clusters that do not provide a result
+file, and for older jobs, the result is pickled to stdout and the cluster
+module provided the ability to load results from the log file. In
 case an exception was raised, the exception is loaded and re-raised.
 Otherwise the jobs return values is returned. This functionality
 is provided
 by the :py:class:jip.cluster.Feature class. An instance of a feture is
 returned at job submission.
 """
+import collections
+import hashlib
 import logging
+import mmap
+import pipes
 import subprocess
 import os
-import sys
 import time
-from mako.template import Template
-from jip.tools import Tool
+from jip import instrumentation
+from jip.tools import Tool, Job, _parse_minutes, _template, \
+    _GROUP_JOB_ATTRIBUTES
 from jip.pipelines import PipelineTool
-import cPickle
+from jip.remote import _SEP_RESULT, _SEP_RESULT_END, _ENV_START, \
+    _encode_payload, _decode_payload, _ToolWrapper
 
-# result separator
-_SEP_RESULT = "-------------------RESULT-------------------"
-_SEP_RESULT_END = "-------------------END-RESULT-------------------"
+# maximum number of job ids passed to a single release call
+_RELEASE_CHUNK = 1000
+
+# failure classes reported by JobAccounting.classify()
+FAILURE_OOM = "OOM"
+FAILURE_TIMEOUT = "TIMEOUT"
+FAILURE_NODE = "NODE_FAIL"
+
+# job states reported by the accounting that can still change
+_ACCOUNTING_ACTIVE = ["PENDING", "RUNNING", "REQUEUED", "RESIZING",
+                      "SUSPENDED", "CONFIGURING", "COMPLETING"]
 
 # the default job template
 DEFAULT_TEMPLATE = """#!/bin/bash
@@ -52,33 +69,89 @@ class ClusterException(Exception):
     pass
 
 
-class _ToolWrapper(object):
-    """Internal class that wraps the tool and its arguments and is pickled
-    and send to the cluster. The instance is then un-pickled and runs the
-    tool when the job is executed on the cluster.
+class PayloadStore(object):
+    """Content addressed payload directory on shared storage. Payloads are
+    stored by their sha1 hash, so identical payloads are written only
+    once and shared by all jobs that reference them.
+
+    The store keeps track of the references handed out by this instance.
+    A payload file is removed when its last reference is released, which
+    usually happens when the results of the referencing
+    :py:class:`Feature` are collected. Files left behind by other
+    submitters can be removed with :py:meth:`clean`.
     """
+    def __init__(self, directory):
+        """Initialize the payload store.
+
+        :param directory: the store directory. This has to be on storage
+                          shared between the submitting host and the
+                          compute nodes
+        """
+        self.directory = os.path.abspath(directory)
+        self._references = {}
 
-    def __init__(self, tool, args):
-        """Initialize the wrapper with the tool and its arguments
+    def put(self, payload, references=1):
+        """Add references to the given payload and return the absolute
+        path to the payload file. The file is only written if no payload
+        with the same content exists in the store.
 
-        :param tool: the tool instance
-        :param args: the tool arguments
+        :param payload: the encoded payload string
+        :param references: the number of references to add
         """
-        self.tool = tool
-        self.args = args
+        digest = hashlib.sha1(payload).hexdigest()
+        target_dir = os.path.join(self.directory, digest[:2])
+        path = os.path.join(target_dir, digest)
+        if not os.path.exists(path):
+            if not os.path.exists(target_dir):
+                try:
+                    os.makedirs(target_dir)
+                except OSError:
+                    if not os.path.isdir(target_dir):
+                        raise
+            # write to a temporary file and move it in place so
+            # that jobs never see partially written payloads
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, 'wb') as payload_file:
+                payload_file.write(payload)
+            os.rename(tmp, path)
+        self._references[path] = self._references.get(path, 0) + references
+        return path
+
+    def release(self, path, references=1):
+        """Release references to the given payload file and remove the
+        file if it is no longer referenced.
+
+        :param path: the payload file
+        :param references: the number of references to release
+        """
+        count = self._references.get(path, 0) - references
+        if count > 0:
+            self._references[path] = count
+            return
+        self._references.pop(path, None)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def clean(self, max_age=None):
+        """Remove all payload files that are not referenced by this store
+        instance and, if max_age is specified, are older than max_age
+        seconds. Returns the number of removed files.
 
-    def run(self):
-        """Run the tool and catch any exception raised by the tool
-        execution. If an exception is raised, it is logged and then
-        returned as results. This allows the :py:class:Feature to pick
-        up any exceptions raised in remote execution.
+        :param max_age: minimum age of a payload file in seconds
         """
-        try:
-            result = self.tool.run(self.args)
-            return result
-        except Exception, e:
-            sys.stderr.write("Error while executing job: %s\n" % str(e))
-            return e
+        removed = 0
+        now = time.time()
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if path in self._references:
+                    continue
+                if max_age is not None and \
+                        now - os.path.getmtime(path) < max_age:
+                    continue
+                os.remove(path)
+                removed += 1
+        return removed
 
 
 class Feature(object):
@@ -88,52 +161,157 @@ class Feature(object):
     It provides the ability to wait for a job as well as to fetch the jobs
     results.
     """
-    def __init__(self, jobid, stdout=None, stderr=None):
+    def __init__(self, jobid, stdout=None, stderr=None, result=None,
+                 index=None):
         """Initialize a new Feature instance.
 
         :param jobid: the job id on the cluster
         :param stdout: the jobs stdout file
         :param stderr: the jobs stderr file
+        :param result: the jobs result file
+        :param index: index of the tool result if the job runs multiple
+                      tools and returns a list of results
         """
         self.jobid = jobid
         self.stdout = stdout
         self.stderr = stderr
+        self.result = result
+        self.index = index
+        self.payload = None
+        # runtime information reported by the remote bootstrap,
+        # available after the results were loaded from the result file
+        self.info = None
+        # submission time and the submitted tool, used to attribute
+        # timings, see jip.instrumentation
+        self.submitted = None
+        self.tool = None
 
     def get(self, cluster, check_interval=360):
         """Wait until the job is finished and returns the result of the job.
+        If the job payload was written to the clusters payload store, the
+        payload is released once the results are loaded.
 
         :param cluster: the cluster instance
         :param check_interval: the interval in which the job status is polled
         """
         self.wait(cluster, check_interval=check_interval)
-        # try to load the result from stdout file
-        result = self._load_results(self.stdout)
+        result = self.load()
+        self.release(cluster)
         if isinstance(result, Exception):
             raise result
         return result
 
+    def load(self):
+        """Load and return the job results without waiting for the job.
+        Results are loaded from the result file if it exists. Otherwise
+        the results are searched in the jobs stdout log.
+        """
+        started = instrumentation.start()
+        if self.result is not None and os.path.exists(self.result):
+            result = self._load_result_file(self.result)
+        else:
+            # try to load the result from stdout file
+            result = self._load_results(self.stdout)
+        if self.index is not None and not isinstance(result, Exception):
+            result = result[self.index]
+        if started is not None:
+            instrumentation.stop(instrumentation.PHASE_LOAD, self.tool,
+                                 started)
+            self._record_timings()
+        return result
+
+    def get_run_info(self):
+        """Return the runtime information of the tool of this feature
+        as reported by the remote bootstrap, a dictionary with the `host`
+        and the `pid` of the process that ran the tool and the `start` and
+        `end` time stamps. For features of jobs that run multiple tools,
+        the information of the tool within the job is returned. Returns
+        None if no information was loaded or the tool was not executed.
+        """
+        info = self.info
+        if info is None or info.get("end") is None:
+            return None
+        if self.index is not None:
+            steps = info.get("steps")
+            if steps is None or self.index >= len(steps):
+                return None
+            return steps[self.index]
+        return info
+
+    def _record_timings(self):
+        """Record the queue wait of the job and the run time of the tool
+        reported by the remote bootstrap
+        """
+        info = self.info
+        if info is None or info.get("end") is None:
+            return
+        # the start time is taken after the payload was loaded, go back
+        # to the start of the job script
+        begin = info["start"] - (info.get("load") or 0) - \
+            (info.get("startup") or 0)
+        if self.submitted is not None:
+            instrumentation.record(instrumentation.PHASE_QUEUE, self.tool,
+                                   max(0, begin - self.submitted))
+        run = self.get_run_info()
+        if run is not None:
+            instrumentation.record(instrumentation.PHASE_EXECUTE, self.tool,
+                                   run["end"] - run["start"])
+
+    def _load_result_file(self, path):
+        """Internal method to load the results and the runtime information
+        from a result file written by the remote bootstrap
+        """
+        try:
+            with open(path, 'rb') as result_file:
+                result, self.info = _decode_payload(result_file.read())
+            return result
+        except Exception, e:
+            log = logging.getLogger("%s.%s" % (self.__module__,
+                                                    self.__class__.__name__))
+            log.error("Unable to load results from feature: %s", str(e))
+            raise e
+
     def _load_results(self, results):
         """Internal method to load the results
-        from the given results file and return them
+        from the given log file and return them. The log is memory mapped
+        and searched backwards for the last result separator, so only the
+        end of the log is touched.
         """
         try:
-            with open(results, 'r') as result_file:
-                lines = None
-                # get lines after separator line
-                for line in result_file:
-                    if lines is not None:
-                        if line == _SEP_RESULT_END:
-                            break
-                        lines.append(line)
-                    elif line.strip() == _SEP_RESULT:
-                        lines = []
-                return cPickle.loads("".join(lines).decode('base64'))
+            with open(results, 'rb') as result_file:
+                size = os.fstat(result_file.fileno()).st_size
+                if size == 0:
+                    raise ValueError("No results found in %s" % results)
+                data = mmap.mmap(result_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+                try:
+                    start = data.rfind(_SEP_RESULT)
+                    if start < 0:
+                        raise ValueError("No results found in %s" % results)
+                    start += len(_SEP_RESULT)
+                    end = data.find(_SEP_RESULT_END, start)
+                    if end < 0:
+                        end = size
+                    encoded = data[start:end]
+                finally:
+                    data.close()
+            return _decode_payload(encoded.decode('base64'))
         except Exception, e:
             log = logging.getLogger("%s.%s" % (self.__module__,
                                                     self.__class__.__name__))
             log.error("Unable to load results from feature: %s", str(e))
             raise e
 
+    def release(self, cluster):
+        """Release the jobs payload file from the clusters payload store.
+        Nothing is done if the payload was inlined in the job script.
+
+        :param cluster: the cluster instance
+        """
+        if self.payload is not None and cluster.payload_store is not None:
+            cluster.payload_store.release(self.payload)
+        self.payload = None
+
     def wait(self, cluster, check_interval=360):
         """Blocks until the jobs disappears from the cluster. No checks
         are made for success or failure state.
@@ -144,12 +322,21 @@ class Feature(object):
         # wait for the job to disappear from the list
         cluster.wait(self.jobid, check_interval=check_interval)
 
+    def get_accounting(self, cluster):
+        """Return the :py:class:`JobAccounting` of the job or None if the
+        cluster has no accounting information for the job. See
+        :py:meth:`Cluster.accounting`.
+
+        :param cluster: the cluster instance
+        """
+        return cluster.accounting([self.jobid]).get(str(self.jobid))
+
     def cancel(self, cluster):
         """Cancel the job based on the jobid
 
         :param cluster: the cluster instance
         """
-        pass
+        cluster.cancel([self.jobid])
 
     def get_status(self, cluster):
         """Check the state of the job on the given remote cluster
@@ -159,6 +346,179 @@ class Feature(object):
         pass
 
 
+class JobAccounting(object):
+    """Post-run accounting information of a cluster job as reported by
+    the grid engine. Times are in seconds and memory is in bytes. Values
+    that are not reported are None.
+
+    The following attributes are available:
+
+     * jobid     -- the job id
+     * state     -- the final job state, i.e. COMPLETED, FAILED, TIMEOUT,
+                    OUT_OF_MEMORY, NODE_FAIL or CANCELLED
+     * exit_code -- the exit code of the job
+     * signal    -- the signal that terminated the job or 0
+     * elapsed   -- wall clock time
+     * cpu_time  -- total cpu time
+     * max_rss   -- maximum resident set size
+     * start     -- start time as reported by the grid engine
+     * end       -- end time as reported by the grid engine
+    """
+    def __init__(self, jobid, state=None, exit_code=None, signal=0,
+                 elapsed=None, cpu_time=None, max_rss=None, start=None,
+                 end=None):
+        self.jobid = jobid
+        self.state = state
+        self.exit_code = exit_code
+        self.signal = signal
+        self.elapsed = elapsed
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+        self.start = start
+        self.end = end
+
+    def is_finished(self):
+        """Returns true if the job state can not change anymore"""
+        return self.state is not None and \
+            self.state not in _ACCOUNTING_ACTIVE
+
+    def classify(self):
+        """Classify the failure of the job and return one of
+        FAILURE_OOM, FAILURE_TIMEOUT or FAILURE_NODE if the job was
+        killed because it exceeded its memory or time limit or because of
+        a node failure. Returns None for successful jobs and for other
+        failures. Note that SGE only reports failed jobs, without the
+        reason, so SGE failures are not classified.
+        """
+        if self.state == "OUT_OF_MEMORY":
+            return FAILURE_OOM
+        if self.state in ["TIMEOUT", "DEADLINE"]:
+            return FAILURE_TIMEOUT
+        if self.state in ["NODE_FAIL", "BOOT_FAIL"]:
+            return FAILURE_NODE
+        return None
+
+    def __repr__(self):
+        return "JobAccounting(%s, %s, exit=%s, elapsed=%s, cpu=%s, " \
+               "max_rss=%s)" % (self.jobid, self.state, self.exit_code,
+                                self.elapsed, self.cpu_time, self.max_rss)
+
+
+def _parse_duration(value):
+    """Parse a duration in the format [D-][[HH:]MM:]SS[.sss] and return
+    the number of seconds or None if the value is empty
+    """
+    value = value.strip()
+    if not value:
+        return None
+    days = 0
+    if "-" in value:
+        days, value = value.split("-", 1)
+        days = int(days)
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return days * 86400 + seconds
+
+
+def _parse_size(value):
+    """Parse a memory size with an optional K, M, G or T suffix and
+    return the number of bytes or None if the value is empty
+    """
+    value = value.strip()
+    if not value:
+        return None
+    units = "KMGT"
+    factor = 1
+    if value[-1].upper() in units:
+        factor = 1024 ** (units.index(value[-1].upper()) + 1)
+        value = value[:-1]
+    return int(float(value) * factor)
+
+
+def _peak_threads(threads, dependencies):
+    """Return the maximum number of threads of steps that can run
+    concurrently, i.e. the total threads of the heaviest set of steps
+    where no step depends on another, directly or indirectly. By
+    Dilworth's theorem, this is the total number of threads minus the
+    maximum flow through the network that links every step to all the
+    steps that depend on it.
+
+    Parameter
+    ---------
+    threads -- list of the number of threads of each step
+    dependencies -- list of the indexes of the steps each step depends
+                    on. The steps have to be in topological order
+    """
+    ancestors = []
+    for deps in dependencies:
+        reach = set(deps)
+        for d in deps:
+            reach |= ancestors[d]
+        ancestors.append(reach)
+    total = sum(threads)
+    # node 0 is the source, node 1 the sink and the nodes 2i + 2 and
+    # 2i + 3 are the outgoing and incoming side of step i
+    capacity = {0: {}, 1: {}}
+    for i, count in enumerate(threads):
+        capacity[2 * i + 2] = {}
+        capacity[2 * i + 3] = {1: count}
+        capacity[0][2 * i + 2] = count
+    for i, reach in enumerate(ancestors):
+        for a in reach:
+            capacity[2 * a + 2][2 * i + 3] = total
+    return total - _max_flow(capacity, 0, 1)
+
+
+def _max_flow(capacity, source, sink):
+    """Compute the maximum flow from source to sink using shortest
+    augmenting paths. The capacity dictionary from nodes to dictionaries
+    from nodes to edge capacities is modified to the residual network.
+    """
+    for u in capacity.keys():
+        for v in capacity[u].keys():
+            capacity.setdefault(v, {}).setdefault(u, 0)
+    flow = 0
+    while True:
+        parents = {source: None}
+        queue = collections.deque([source])
+        while queue and sink not in parents:
+            u = queue.popleft()
+            for v, free in capacity[u].items():
+                if free > 0 and v not in parents:
+                    parents[v] = u
+                    queue.append(v)
+        if sink not in parents:
+            return flow
+        path = []
+        v = sink
+        while parents[v] is not None:
+            path.append((parents[v], v))
+            v = parents[v]
+        amount = min(capacity[u][v] for u, v in path)
+        for u, v in path:
+            capacity[u][v] -= amount
+            capacity[v][u] += amount
+        flow += amount
+
+
+def _report_states(pending, active):
+    """Report the number of queued and running steps of the given
+    pending features to the instrumentation
+
+    :param pending: dictionary from job ids to lists of features
+    :param active: dictionary from the active job ids to the job states
+    """
+    states = {}
+    for jobid, features in pending.items():
+        state = active.get(jobid)
+        states[state] = states.get(state, 0) + len(features)
+    instrumentation.gauge(instrumentation.GAUGE_QUEUED,
+                          states.get(Cluster.STATE_QUEUED, 0))
+    instrumentation.gauge(instrumentation.GAUGE_RUNNING,
+                          states.get(Cluster.STATE_RUNNING, 0))
+
+
 class Cluster(object):
     """The abstract base class for cluster implementation consists of a single
     method that is able to submit a tool to a compute cluster. The
@@ -184,13 +544,19 @@ class Cluster(object):
     STATE_DONE = "Done"
     STATE_FAILED = "Failed"
 
+    # cache of accounting information of finished jobs
+    _accounting_cache = None
+
+    # optional PayloadStore. If set, payloads are written to the store
+    # instead of being inlined in the job scripts
+    payload_store = None
 
     def list(self):
         """A map of all active jobs on the cluster from the job id to the state
         """
         pass
 
-    def submit(self, tool, args=None):
+    def submit(self, tool, args=None, hold=False, dependencies=None):
         """Submit the tool by wrapping it into the template
         and sending it to the cluster. If the tool is a string, given args
         are ignored and the script string is added as is into the template.
@@ -205,61 +571,338 @@ class Cluster(object):
         tool -- the Tool or PipelineTool instance to submit
         args -- tuple of *args and **kwargs that are passed to the tool dump
                 in case the tool has to be converted to a script
+        hold -- submit the job in held state. Held jobs are not
+                scheduled before they are released with :py:meth:`release`
+        dependencies -- optional list of job ids the job depends on. If
+                        specified, the dependencies of the tool are ignored
         """
-        template = tool.job.template
-        if template is None:
-            template = DEFAULT_TEMPLATE
-
         # collect dependencies
         # dependencies are resolved if the tool is
         # of class Tool or PipelineTool.
         deps = None
         tool_script = tool
+        payload_file = None
+        result_file = self._result_file(tool.job.logdir)
 
         if isinstance(tool, Tool):
             # if a tool list passed, make it
             # an executable script
-            tool_script = self._dump_tool(tool, args)
+            tool_script, payload_file = self._dump_tool(tool, args,
+                                                        result_file)
             deps = tool.job.dependencies
         elif isinstance(tool, PipelineTool):
-            tool_script = self._dump_tool(tool._tool, args)
+            tool_script, payload_file = self._dump_tool(tool._tool, args,
+                                                        result_file)
             # update dependencies
             deps = [str(d.job.jobid)
                     for d in filter(lambda t: t.job.jobid is not None,
                                     tool.get_dependencies())]
+        if dependencies is not None:
+            deps = [str(d) for d in dependencies]
+        if deps is not None and len(deps) == 0:
+            deps = None
+
+        feature = self._submit_job(tool_script, tool.job, deps, hold=hold,
+                                   payload_file=payload_file, subject=tool)
+        # set the tools jobid
+        tool.job.jobid = feature.jobid
+        return feature
+
+    def submit_packed(self, tools, args=None, slots=1, hold=False,
+                      dependencies=None):
+        """Submit a list of independent tools as a single job. The job
+        runs the tools in parallel using up to `slots` cpu slots. Each
+        tool occupies as many slots as its job requests threads.
+
+        The job settings of the packed job are taken from the first tool.
+        The maximum memory is the maximum over all tools and the maximum
+        wall clock time is computed from the tools maximum wall clock
+        times and the number of tools that can run in parallel.
+
+        Returns one :py:class:`Feature` per tool, in the order of the
+        given tools. All features reference the same job and load the
+        results of their tool.
+
+        Parameter
+        ---------
+        tools -- list of Tool or PipelineTool instances. The tools must
+                 not depend on each other
+        args  -- optional list of arguments, one per tool. If not
+                 specified, PipelineTools are submitted with their
+                 configuration and Tools with no arguments
+        slots -- number of cpu slots requested for the packed job
+        hold  -- submit the job in held state
+        dependencies -- optional list of job ids the job depends on. If
+                        specified, the dependencies of the tools are ignored
+        """
+        from jip.remote import _ToolPack
+        wrappers, deps = self._wrap_tools(tools, args, dependencies)
+        return self._submit_group(_ToolPack(wrappers, slots=slots), tools,
+                                  self._pack_job(tools, slots), deps, hold)
+
+    def submit_chain(self, tools, args=None, hold=False, dependencies=None):
+        """Submit a linear chain of tools as a single job. The job runs
+        the tools one after another and stops at the first failing tool.
+        Tools after a failed tool are not executed and report a
+        :py:class:`jip.tools.ToolException` as their result. Listeners
+        and cleanup are called for every executed tool as if the tool
+        would run in its own job.
+
+        The job settings of the chain are taken from the first tool. The
+        maximum wall clock time is the sum and the maximum memory and
+        threads are the maximum of the tools settings.
+
+        Returns one :py:class:`Feature` per tool, in the order of the
+        given tools.
+
+        Parameter
+        ---------
+        tools -- list of Tool or PipelineTool instances in execution order
+        args  -- optional list of arguments, one per tool. If not
+                 specified, PipelineTools are submitted with their
+                 configuration and Tools with no arguments
+        hold  -- submit the job in held state
+        dependencies -- optional list of job ids the job depends on. If
+                        specified, the dependencies of the tools are ignored
+        """
+        from jip.remote import _ToolChain
+        wrappers, deps = self._wrap_tools(tools, args, dependencies)
+        return self._submit_group(_ToolChain(wrappers), tools,
+                                  self._chain_job(tools), deps, hold)
+
+    def _wrap_tools(self, tools, args=None, dependencies=None):
+        """Wrap the given tools for a group submission and return a
+        tuple of the list of wrappers and the list of job ids the tools
+        depend on, excluding dependencies within the group. If
+        dependencies are specified, they replace the tools dependencies.
+        """
+        if args is None:
+            args = [t.get_configuration() if isinstance(t, PipelineTool)
+                    else None for t in tools]
+        wrappers = []
+        deps = []
+        for tool, tool_args in zip(tools, args):
+            if isinstance(tool, PipelineTool):
+                wrappers.append(_ToolWrapper(tool._tool, tool_args))
+                deps.extend([str(d.job.jobid)
+                             for d in tool.get_dependencies()
+                             if d.job.jobid is not None and
+                             d not in tools])
+            else:
+                wrappers.append(_ToolWrapper(tool, tool_args))
+                deps.extend([str(d) for d in tool.job.dependencies])
+        if dependencies is not None:
+            deps = [str(d) for d in dependencies]
+        deps = sorted(set(deps))
         if len(deps) == 0:
             deps = None
+        return wrappers, deps
 
+    def _submit_group(self, group, tools, job, deps, hold=False):
+        """Submit a group payload that runs the given tools and return
+        one feature per tool
+        """
+        tool_script, payload_file = self._dump_payload(
+            group, self._result_file(job.logdir), references=len(tools))
+        feature = self._submit_job(tool_script, job, deps, hold=hold,
+                                   payload_file=payload_file, subject=tools,
+                                   references=len(tools))
+        features = []
+        for i, tool in enumerate(tools):
+            tool.job.jobid = feature.jobid
+            f = Feature(feature.jobid, stdout=feature.stdout,
+                        stderr=feature.stderr, result=feature.result,
+                        index=i)
+            f.payload = payload_file
+            f.submitted = feature.submitted
+            f.tool = tool
+            features.append(f)
+        return features
+
+    def _group_job(self, tools):
+        """Create a job for a group of tools that copies the
+        settings of the first tool
+        """
+        first = tools[0].job
+        job = Job()
+        for attr in _GROUP_JOB_ATTRIBUTES:
+            setattr(job, attr, getattr(first, attr))
+        job.name = "%s+%d" % (first.name or tools[0].name, len(tools) - 1)
+        mems = [t.job.max_mem for t in tools if t.job.max_mem is not None]
+        if len(mems) > 0:
+            job.max_mem = max(mems)
+        return job
+
+    def _chain_job(self, tools):
+        """Create the job for a chain of tools"""
+        job = self._group_job(tools)
+        job.threads = max([t.job.threads or 1 for t in tools])
+        times = [_parse_minutes(t.job.max_time) for t in tools]
+        if None not in times:
+            job.max_time = sum(times)
+        return job
+
+    def _pack_job(self, tools, slots):
+        """Create the job for a list of packed tools"""
+        job = self._group_job(tools)
+        job.threads = slots
+        threads = max([t.job.threads or 1 for t in tools])
+        parallel = max(1, slots // threads)
+        times = [_parse_minutes(t.job.max_time) for t in tools]
+        if None not in times:
+            waves = (len(tools) + parallel - 1) // parallel
+            job.max_time = waves * max(times)
+        return job
+
+    def _submit_job(self, tool_script, job, deps, hold=False,
+                    payload_file=None, subject=None, references=1):
+        """Render the job template with the given tool script and submit
+        it using the settings of the given job. Returns the feature.
+
+        Parameter
+        ---------
+        tool_script -- the script that runs the tool
+        job -- the :py:class:`jip.tools.Job`
+        deps -- list of job ids the job depends on or None
+        hold -- submit the job in held state
+        payload_file -- the payload file referenced by the script. The
+                        file is released if the submission fails
+        subject -- the submitted tool or list of tools, used to attribute
+                   the submission time
+        references -- the number of references to the payload file that
+                      are released if the submission fails
+        """
+        template = job.template
+        if template is None:
+            template = DEFAULT_TEMPLATE
         # check and create log directory
-        if tool.job.logdir is not None and not os.path.exists(tool.job.logdir):
-            os.makedirs(tool.job.logdir)
+        if job.logdir is not None and not os.path.exists(job.logdir):
+            os.makedirs(job.logdir)
         # render the job script
-        rendered_template = Template(template).render(script=tool_script,
-                                                      max_time=tool.job.max_time,
-                                                      max_mem=tool.job.max_mem,
-                                                      threads=tool.job.threads,
-                                                      tasks=tool.job.tasks,
-                                                      queue=tool.job.queue,
-                                                      header=tool.job.header,
-                                                      priority=tool.job.priority)
+        rendered_template = _template(template).render(script=tool_script,
+                                                       max_time=job.max_time,
+                                                       max_mem=job.max_mem,
+                                                       threads=job.threads,
+                                                       tasks=job.tasks,
+                                                       queue=job.queue,
+                                                       header=job.header,
+                                                       priority=job.priority)
+        self.log().info("Submitting %s: job script size %d bytes",
+                        job.name, len(rendered_template))
         # submit
-        feature = self._submit(rendered_template,
-                               name=tool.job.name,
-                               max_time=tool.job.max_time,
-                               max_mem=tool.job.max_mem,
-                               threads=tool.job.threads,
-                               tasks=tool.job.tasks,
-                               queue=tool.job.queue,
-                               priority=tool.job.priority,
-                               dependencies=deps,
-                               working_dir=tool.job.working_dir,
-                               extra=tool.job.extra,
-                               logdir=tool.job.logdir)
-
-        # set the tools jobid
-        tool.job.jobid = feature.jobid
+        started = instrumentation.start()
+        submitted = time.time()
+        try:
+            feature = self._submit(rendered_template,
+                                   name=job.name,
+                                   max_time=job.max_time,
+                                   max_mem=job.max_mem,
+                                   threads=job.threads,
+                                   tasks=job.tasks,
+                                   queue=job.queue,
+                                   priority=job.priority,
+                                   dependencies=deps,
+                                   working_dir=job.working_dir,
+                                   extra=job.extra,
+                                   logdir=job.logdir,
+                                   hold=hold)
+        except Exception:
+            if payload_file is not None:
+                self.payload_store.release(payload_file, references)
+            raise
+        instrumentation.stop(instrumentation.PHASE_SUBMIT, subject, started)
+        instrumentation.count(instrumentation.EVENT_SUBMITTED, subject,
+                              len(subject) if isinstance(subject, list)
+                              else 1)
+        feature.payload = payload_file
+        feature.submitted = submitted
+        feature.tool = subject
         return feature
 
+    def collect(self, features, check_interval=360, threads=8):
+        """Wait for all the given features and yield tuples of the feature
+        and its result in the order in which the jobs finish.
+
+        The job states of all features are checked with a single call to
+        :py:meth:`list` per check interval. Results of finished jobs are
+        loaded concurrently using a pool of threads. Payloads are released
+        from the payload store once the results are loaded.
+
+        Failures do not stop the collection. Once all features are
+        collected, a ClusterException is raised if any job failed or its
+        results could not be loaded. The exceptions `failures` attribute
+        is a dictionary from the failed features to the exceptions.
+
+        Parameter
+        ---------
+        features -- list of features
+        check_interval -- interval in seconds in which the job states are
+                          checked
+        threads -- number of threads used to load results
+        """
+        from multiprocessing.pool import ThreadPool
+        import Queue
+
+        pending = {}
+        for feature in features:
+            pending.setdefault(str(feature.jobid), []).append(feature)
+        total = sum(len(f) for f in pending.values())
+        done = Queue.Queue()
+
+        def load(feature):
+            try:
+                done.put((feature, feature.load(), None))
+            except Exception, e:
+                done.put((feature, None, e))
+
+        failures = {}
+        outstanding = 0
+        next_check = 0
+        pool = ThreadPool(threads)
+        try:
+            while pending or outstanding > 0:
+                if pending and time.time() >= next_check:
+                    started = instrumentation.start()
+                    active = self.list() or {}
+                    if started is not None:
+                        instrumentation.stop(instrumentation.PHASE_POLL,
+                                             None, started)
+                        _report_states(pending, active)
+                    for jobid in [j for j in pending if j not in active]:
+                        for feature in pending.pop(jobid):
+                            pool.apply_async(load, (feature,))
+                            outstanding += 1
+                    next_check = time.time() + check_interval
+                try:
+                    timeout = check_interval
+                    if pending:
+                        timeout = max(0, next_check - time.time())
+                    feature, result, error = done.get(True, timeout)
+                except Queue.Empty:
+                    continue
+                outstanding -= 1
+                feature.release(self)
+                if error is None and isinstance(result, Exception):
+                    error = result
+                if error is not None:
+                    failures[feature] = error
+                    instrumentation.count(instrumentation.EVENT_FAILED,
+                                          feature.tool)
+                    continue
+                instrumentation.count(instrumentation.EVENT_COMPLETED,
+                                      feature.tool)
+                yield feature, result
+        finally:
+            pool.terminate()
+
+        if len(failures) > 0:
+            msg = "%d of %d jobs failed:\n" % (len(failures), total)
+            for feature, error in failures.items():
+                msg += "\t%s\t: %s\n" % (feature.jobid, str(error))
+            e = ClusterException(msg)
+            e.failures = failures
+            raise e
+
     def wait(self, jobid, check_interval=360):
         """Block until the job is no longer in any of the cluster queues.
 
@@ -274,7 +917,7 @@ class Cluster(object):
         """
         raise ClusterException("Wait is not implemented!")
 
-    def dump(self, tool, args):
+    def dump(self, tool, args, result_file=None):
         """Save the given tool instance and the arguments and returns a string
         that is a valid bash script that will load and execute the tool.
 
@@ -286,6 +929,8 @@ class Cluster(object):
 
         tool -- the tool that will be prepared for execution
         args -- tool arguments
+        result_file -- optional result file. If not specified, the results
+                       are printed to the jobs stdout
 
         Returns
         -------
@@ -293,37 +938,83 @@ class Cluster(object):
         script -- a string that is a valid bash script and will load and
                 run the tool
         """
-        template = """
-python -c '
-import sys;
-import cPickle;
-source="".join([l for l in sys.stdin]).decode("base64");
-result = cPickle.loads(source).run();
-# pickel the result and print it to stdout
-result_string = cPickle.dumps(result).encode("base64");
-print "%s"
-print result_string
-print "%s"
-if isinstance(result, Exception):
-    sys.exit(1)
-'<< __EOF__
-%s__EOF__
+        return self._dump_payload(_ToolWrapper(tool, args), result_file,
+                                  inline=True)[0]
 
-"""
-        wrapper = _ToolWrapper(tool, args)
-        return template % (_SEP_RESULT, _SEP_RESULT_END,
-                           cPickle.dumps(wrapper).encode("base64"))
+    def _bootstrap_script(self, source, result_file=None):
+        """Create the bash script that starts the :py:mod:`jip.remote`
+        bootstrap module. The source is a bash input redirection that
+        provides the payload, either a here document with the base64 encoded
+        payload or a redirection from a payload file. If a result file is
+        given, the bootstrap writes the results to that file instead of
+        printing them to stdout.
+
+        Parameter
+        ---------
+        source -- the bash input redirection that provides the payload
+        result_file -- optional path to the result file. The path is
+                       rendered into the script with double quotes, so
+                       it might reference environment variables
+        """
+        result = ""
+        if result_file is not None:
+            result = ' --result "%s"' % result_file
+        return "\nexport %s=$(date +%%s.%%N)\npython -m jip.remote%s %s\n" % (
+            _ENV_START, result, source)
 
-    def _dump_tool(self, tool, args):
+    def _dump_tool(self, tool, args, result_file=None):
         """Dump a tool instance to an executable script
-        using the args and kwargs in the args paramters)
+        using the args and kwargs in the args paramters).
+
+        If a payload store is configured, the payload is written to the
+        store and the script references the payload file instead of
+        inlining it. Returns a tuple of the script and the payload file,
+        which is None if the payload is inlined.
+        """
+        if self.payload_store is None:
+            #dump the tool with arguments
+            return self.dump(tool, args, result_file), None
+        return self._dump_payload(_ToolWrapper(tool, args), result_file)
+
+    def _dump_payload(self, payload, result_file=None, references=1,
+                      inline=False):
+        """Encode the payload and return a tuple of the script that runs
+        the payload and the payload file. If no payload store is
+        configured or inline is True, the payload is inlined in the script
+        and the payload file is None. Otherwise the payload is added to
+        the payload store with the given number of references.
         """
-        #dump the tool with arguments
-        return self.dump(tool, args)
+        data = _encode_payload(payload)
+        if inline or self.payload_store is None:
+            encoded = data.encode("base64")
+            self.log().debug("Encoded payload: %d bytes, %d bytes in "
+                             "script", len(data), len(encoded))
+            return (self._bootstrap_script("<< __EOF__\n%s__EOF__\n" %
+                                           encoded, result_file), None)
+        payload_file = self.payload_store.put(data, references=references)
+        self.log().debug("Stored payload: %d bytes in %s", len(data),
+                         payload_file)
+        return (self._bootstrap_script("< %s" % pipes.quote(payload_file),
+                                       result_file),
+                payload_file)
+
+    def _result_file(self, logdir, jobid=None):
+        """Return the path to the result file of a job or None if
+        results should be printed to the jobs stdout. If the jobid is None,
+        the path is used in the job script and has to reference the
+        job id through the environment variable set by the grid engine.
+
+        Parameter
+        ---------
+        logdir -- the jobs log directory
+        jobid  -- the job id or None
+        """
+        return None
 
     def _submit(self, script, max_time=0, name=None,
                 max_mem=0, threads=1, queue=None, priority=None, tasks=1,
-                dependencies=None, working_dir=None, extra=None, logdir=None):
+                dependencies=None, working_dir=None, extra=None, logdir=None,
+                hold=False):
         """This method must be implemented by the subclass and
         submit the given script to the cluster. Please note that
         the script is passed as a string. It depends on the implementation
@@ -343,9 +1034,65 @@ if isinstance(result, Exception):
         dependencies -- list or string of job ids that this job depends on
         extra    -- list of any extra parameters that should be considered
         logdir   -- base log directory
+        hold     -- submit the job in held state
         """
         pass
 
+    def release(self, jobids):
+        """Release the given held jobs. Implementations should release
+        all jobs with as few calls to the grid engine as possible.
+
+        Paramter
+        --------
+        jobids -- list of job ids
+        """
+        raise ClusterException("Release is not implemented!")
+
+    def cancel(self, jobids):
+        """Cancel the given jobs. Implementations should cancel all jobs
+        with as few calls to the grid engine as possible.
+
+        Paramter
+        --------
+        jobids -- list of job ids
+        """
+        raise ClusterException("Cancel is not implemented!")
+
+    def accounting(self, jobids):
+        """Return a dictionary from the job ids to the
+        :py:class:`JobAccounting` of the given jobs. Jobs unknown to the
+        accounting are not included. The information of finished jobs is
+        cached, so only jobs that were not seen finished before are
+        queried, using as few calls to the grid engine as possible.
+
+        Paramter
+        --------
+        jobids -- list of job ids
+        """
+        if self._accounting_cache is None:
+            self._accounting_cache = {}
+        cache = self._accounting_cache
+        jobids = [str(j) for j in jobids]
+        missing = sorted(set([j for j in jobids if j not in cache]))
+        result = dict((j, cache[j]) for j in jobids if j in cache)
+        if len(missing) > 0:
+            for jobid, accounting in self._accounting(missing).items():
+                if accounting.is_finished():
+                    cache[jobid] = accounting
+                result[jobid] = accounting
+        return result
+
+    def _accounting(self, jobids):
+        """This method must be implemented by the subclass and return
+        a dictionary from the job ids to the :py:class:`JobAccounting`
+        of the given jobs.
+
+        Paramter
+        --------
+        jobids -- list of job ids as strings
+        """
+        raise ClusterException("Accounting is not implemented!")
+
     def _add_parameter(self, params, name=None, value=None, exclude_if=None,
                        to_list=None, prefix=None):
         """This is a helper function to create paramter arrays that are passed
@@ -398,6 +1145,24 @@ if isinstance(result, Exception):
             value = to_list.join(value)
         return value
 
+    def _call(self, params, action):
+        """Run the given grid engine command and return its output. A
+        ClusterException is raised if the command fails.
+
+        Paramter
+        --------
+        params -- the command and its arguments
+        action -- description of the action used in the error message
+        """
+        process = subprocess.Popen(params,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   shell=False)
+        (out, err) = process.communicate()
+        if process.wait() != 0:
+            raise ClusterException("Error while %s:\n%s" % (action, err))
+        return out
+
     def log(self):
         """Get the tool logger"""
         return logging.getLogger("%s.%s" % (self.__module__,
@@ -415,17 +1180,30 @@ class Slurm(Cluster):
 
     """
 
-    def __init__(self, sbatch="sbatch", squeue="squeue", list_args=None):
+    def __init__(self, sbatch="sbatch", squeue="squeue", list_args=None,
+                 payload_store=None, scontrol="scontrol", srun="srun",
+                 sacct="sacct", scancel="scancel"):
         """Initialize the slurm cluster.
 
         Paramter
         --------
         sbatch -- path to the sbatch command. Defaults to 'sbatch'
         squeue -- path to the squeue command. Defaults to 'squeue'
+        payload_store -- optional PayloadStore used to store job payloads
+        scontrol -- path to the scontrol command. Defaults to 'scontrol'
+        srun -- path to the srun command used to start job steps within
+                an allocation. Defaults to 'srun'
+        sacct -- path to the sacct command. Defaults to 'sacct'
+        scancel -- path to the scancel command. Defaults to 'scancel'
         """
         self.sbatch = sbatch
         self.squeue = squeue
+        self.scontrol = scontrol
+        self.srun = srun
+        self.sacct = sacct
+        self.scancel = scancel
         self.list_args = list_args
+        self.payload_store = payload_store
 
     def list(self):
         jobs = {}
@@ -450,7 +1228,8 @@ class Slurm(Cluster):
 
     def _submit(self, script, max_time=None, name=None,
                 max_mem=None, threads=1, queue=None, priority=None, tasks=1,
-                dependencies=None, working_dir=None, extra=None, logdir=None):
+                dependencies=None, working_dir=None, extra=None, logdir=None,
+                hold=False):
         params = [self.sbatch]
 
         if logdir is None:
@@ -463,11 +1242,13 @@ class Slurm(Cluster):
 
 
         self._add_parameter(params, "-t", max_time,
-                            lambda x: x is None or int(x) <= 0)
+                            lambda x: x is None or _parse_minutes(x) <= 0)
         self._add_parameter(params, "-p", queue)
         self._add_parameter(params, "--qos", priority)
         self._add_parameter(params, "-c", threads,
                             lambda x: x is None or int(x) <= 0)
+        self._add_parameter(params, "-n", tasks,
+                            lambda x: x is None or int(x) <= 1)
         self._add_parameter(params, "--mem-per-cpu", max_mem,
                             lambda x: x is None or int(x) <= 0)
         self._add_parameter(params, "-D", working_dir)
@@ -476,6 +1257,7 @@ class Slurm(Cluster):
         self._add_parameter(params, "-d", dependencies, prefix="afterok:",
                             to_list=":")
         self._add_parameter(params, "-J", name)
+        self._add_parameter(params, value="-H", exclude_if=lambda x: not hold)
         self._add_parameter(params, "-e", stderr_file)
         self._add_parameter(params, "-o", stdout_file)
         self._add_parameter(params, value=extra)
@@ -498,9 +1280,125 @@ class Slurm(Cluster):
         stdout_file = os.path.join(logdir, "slurm-%s.out" % job_id)
         stderr_file = os.path.join(logdir, "slurm-%s.err" % job_id)
 
-        feature = Feature(jobid=job_id, stdout=stdout_file, stderr=stderr_file)
+        feature = Feature(jobid=job_id, stdout=stdout_file, stderr=stderr_file,
+                          result=self._result_file(logdir, job_id))
         return feature
 
+    def submit_allocation(self, pipeline, hold=False):
+        """Submit all steps of the pipeline that are not done as a single
+        allocation. Within the allocation, a driver starts each step as a
+        separate job step using `srun` as soon as the steps dependencies
+        finished, so the pipeline waits only once in the queue.
+
+        Each task of the allocation gets as many cpus as the step with
+        the most threads, so every step fits into a single task on one
+        node. The allocation requests enough tasks to cover the peak
+        number of threads of steps that can run concurrently, i.e. of
+        any set of steps that do not depend on each other, and the
+        maximum memory per cpu of all steps. The wall clock time is the
+        longest path through the pipeline using the steps max_time. The
+        other job settings are taken from the first step.
+
+        Returns one :py:class:`Feature` per step, in execution order.
+
+        Parameter
+        ---------
+        pipeline -- the :py:class:`jip.pipelines.Pipeline`
+        hold -- submit the allocation in held state
+        """
+        from jip.remote import _StepDriver
+        steps = [s for level in pipeline._topological_sort()
+                 for s in level if not s.is_done()]
+        if len(steps) == 0:
+            return []
+        index = dict((s, i) for i, s in enumerate(steps))
+        dependencies = [[index[d] for d in s.get_dependencies()
+                         if d in index] for s in steps]
+
+        job = self._group_job(steps)
+        job.name = pipeline.name or job.name
+        threads = [s.job.threads or 1 for s in steps]
+        job.threads = max(threads)
+        peak = _peak_threads(threads, dependencies)
+        job.tasks = (peak + job.threads - 1) // job.threads
+        # longest path through the pipeline
+        finish = {}
+        for s, deps in zip(steps, dependencies):
+            minutes = _parse_minutes(s.job.max_time)
+            if minutes is None:
+                finish = None
+                break
+            finish[index[s]] = max([finish[d] for d in deps] + [0]) + \
+                minutes
+        if finish is not None:
+            job.max_time = max(finish.values())
+
+        logdir = job.logdir if job.logdir is not None else os.getcwd()
+        wrappers, deps = self._wrap_tools(steps)
+        driver = _StepDriver(wrappers, [s._name for s in steps],
+                             dependencies, os.path.abspath(logdir),
+                             srun=self.srun)
+        return self._submit_group(driver, steps, job, deps, hold)
+
+    def release(self, jobids):
+        jobids = [str(j) for j in jobids]
+        # release in chunks to keep the command line short
+        for i in range(0, len(jobids), _RELEASE_CHUNK):
+            self._call([self.scontrol, "release",
+                        ",".join(jobids[i:i + _RELEASE_CHUNK])],
+                       "releasing jobs")
+
+    def cancel(self, jobids):
+        jobids = [str(j) for j in jobids]
+        for i in range(0, len(jobids), _RELEASE_CHUNK):
+            self._call([self.scancel] + jobids[i:i + _RELEASE_CHUNK],
+                       "cancelling jobs")
+
+    def _accounting(self, jobids):
+        """Query the accounting with a single sacct call per chunk of job
+        ids. The job steps are merged into the job record, using the
+        maximum resident set size over all steps.
+        """
+        jobs = {}
+        for i in range(0, len(jobids), _RELEASE_CHUNK):
+            out = self._call([self.sacct, "-n", "-P", "-j",
+                              ",".join(jobids[i:i + _RELEASE_CHUNK]), "-o",
+                              "JobID,State,ExitCode,Elapsed,TotalCPU,MaxRSS,"
+                              "Start,End"], "querying accounting")
+            steps = []
+            for line in out.splitlines():
+                fields = line.strip().split("|")
+                if len(fields) < 8:
+                    continue
+                jobid = fields[0]
+                if "." in jobid:
+                    steps.append((jobid.split(".")[0], fields))
+                    continue
+                exit_code, signal = (fields[2].split(":") + ["0"])[:2]
+                jobs[jobid] = JobAccounting(
+                    jobid,
+                    state=fields[1].split(" ")[0],
+                    exit_code=int(exit_code),
+                    signal=int(signal),
+                    elapsed=_parse_duration(fields[3]),
+                    cpu_time=_parse_duration(fields[4]),
+                    max_rss=_parse_size(fields[5]),
+                    start=fields[6],
+                    end=fields[7])
+            for jobid, fields in steps:
+                job = jobs.get(jobid)
+                rss = _parse_size(fields[5])
+                if job is not None and rss is not None:
+                    job.max_rss = max(job.max_rss, rss)
+        return jobs
+
+    def _result_file(self, logdir, jobid=None):
+        if logdir is None:
+            logdir = os.getcwd()
+        if jobid is None:
+            jobid = "${SLURM_JOB_ID}"
+        return os.path.join(os.path.abspath(logdir), "slurm-%s.result" % jobid)
+
     def wait(self, jobid, check_interval=360):
         if jobid is None:
             raise ClusterException("No job id specified! Unable to check"
@@ -524,17 +1422,27 @@ class SunGrid(Cluster):
     to `qsub` as they are. Note that:
     """
 
-    def __init__(self, qsub="qsub", qstat="qstat", list_args=None):
+    def __init__(self, qsub="qsub", qstat="qstat", list_args=None,
+                 payload_store=None, qrls="qrls", qacct="qacct",
+                 qdel="qdel"):
         """Initialize the SGE cluster.
 
         Parameter
         --------
         qsub -- path to the qsub command. Defaults to 'qsub'
         qstat -- path to the qstat command. Defaults to 'qstat'
+        payload_store -- optional PayloadStore used to store job payloads
+        qrls -- path to the qrls command. Defaults to 'qrls'
+        qacct -- path to the qacct command. Defaults to 'qacct'
+        qdel -- path to the qdel command. Defaults to 'qdel'
         """
         self.qsub = qsub
         self.qstat = qstat
+        self.qrls = qrls
+        self.qacct = qacct
+        self.qdel = qdel
         self.list_args = list_args
+        self.payload_store = payload_store
 
     def list(self):
         jobs = {}
@@ -559,7 +1467,8 @@ class SunGrid(Cluster):
 
     def _submit(self, script, max_time=None, name=None,
                 max_mem=None, threads=1, queue=None, priority=None, tasks=1,
-                dependencies=None, working_dir=None, extra=None, logdir=None):
+                dependencies=None, working_dir=None, extra=None, logdir=None,
+                hold=False):
         params = [self.qsub]
 
         if logdir is None:
@@ -582,6 +1491,7 @@ class SunGrid(Cluster):
                             lambda x: not os.path.exists(str(x)))
         self._add_parameter(params, "-hold_jid", dependencies,
                             to_list=",")
+        self._add_parameter(params, value="-h", exclude_if=lambda x: not hold)
         self._add_parameter(params, "-e", logdir)
         self._add_parameter(params, "-o", logdir)
         self._add_parameter(params, value=extra)
@@ -607,9 +1517,70 @@ class SunGrid(Cluster):
         stdout_file = os.path.join(logdir, "%s.o%s" % (name, job_id))
         stderr_file = os.path.join(logdir, "%s.e%s" % (name, job_id))
 
-        feature = Feature(jobid=job_id, stdout=stdout_file, stderr=stderr_file)
+        feature = Feature(jobid=job_id, stdout=stdout_file, stderr=stderr_file,
+                          result=self._result_file(logdir, job_id))
         return feature
 
+    def release(self, jobids):
+        jobids = [str(j) for j in jobids]
+        # release in chunks to keep the command line short
+        for i in range(0, len(jobids), _RELEASE_CHUNK):
+            self._call([self.qrls] + jobids[i:i + _RELEASE_CHUNK],
+                       "releasing jobs")
+
+    def cancel(self, jobids):
+        jobids = [str(j) for j in jobids]
+        for i in range(0, len(jobids), _RELEASE_CHUNK):
+            self._call([self.qdel] + jobids[i:i + _RELEASE_CHUNK],
+                       "cancelling jobs")
+
+    def _accounting(self, jobids):
+        """Query the accounting information. Note that qacct does not
+        support querying multiple jobs by id, so one call per job is
+        made. Jobs that are not yet in the accounting file are skipped.
+        SGE does not report the resident set size, the maximum virtual
+        memory is reported as max_rss instead.
+        """
+        jobs = {}
+        for jobid in jobids:
+            try:
+                out = self._call([self.qacct, "-j", jobid],
+                                 "querying accounting")
+            except ClusterException:
+                continue
+            values = {}
+            for line in out.splitlines():
+                fields = line.strip().split(None, 1)
+                if len(fields) == 2:
+                    values[fields[0]] = fields[1].strip()
+            exit_code = int(values.get("exit_status", "0").split()[0])
+            failed = values.get("failed", "0").split()[0]
+            state = "COMPLETED"
+            if failed != "0" or exit_code != 0:
+                state = "FAILED"
+            signal = 0
+            if exit_code > 128:
+                signal = exit_code - 128
+            jobs[jobid] = JobAccounting(
+                jobid,
+                state=state,
+                exit_code=exit_code,
+                signal=signal,
+                elapsed=_parse_duration(values.get("ru_wallclock", "")
+                                        .rstrip("s")),
+                cpu_time=_parse_duration(values.get("cpu", "").rstrip("s")),
+                max_rss=_parse_size(values.get("maxvmem", "")),
+                start=values.get("start_time"),
+                end=values.get("end_time"))
+        return jobs
+
+    def _result_file(self, logdir, jobid=None):
+        if logdir is None:
+            logdir = os.getcwd()
+        if jobid is None:
+            jobid = "${JOB_ID}"
+        return os.path.join(os.path.abspath(logdir), "jip-%s.result" % jobid)
+
     def wait(self, jobid, check_interval=360):
         if jobid is None:
             raise ClusterException("No job id specified! Unable to check"
@@ -628,6 +1599,9 @@ class SunGrid(Cluster):
     def _parse_time(self, time):
         if time is None:
             return time
+        if isinstance(time, (int, long)):
+            # job times computed by jip are minutes, h_rt takes seconds
+            return time * 60
         t = map(lambda x: x or '0', time.split(':'))
         if len(t) is 1:
             return time
@@ -0,0 +1,659 @@
+#!/usr/bin/env python
+"""The emulator module implements a small local grid engine that can be
+used to test and benchmark the cluster integration without access to a
+real cluster. It provides drop-in replacements for the Slurm commands
+`sbatch`, `squeue`, `scontrol`, `scancel` and `sacct` and the SGE commands
+`qsub`, `qstat`, `qrls`, `qdel` and `qacct`. Jobs are executed as local
+sub-processes and all job information is kept in a state directory.
+
+The commands are installed as small wrapper scripts using
+:py:func:`install`, which returns the paths to the commands. They can be
+passed to the cluster constructors::
+
+    commands = install("/tmp/emulator")
+    slurm = Slurm(sbatch=commands["sbatch"], squeue=commands["squeue"],
+                  scontrol=commands["scontrol"], sacct=commands["sacct"],
+                  scancel=commands["scancel"])
+
+There is no scheduler daemon. Every command invocation first updates the
+state of the running jobs and starts pending jobs whose dependencies are
+satisfied, so jobs progress as long as somebody polls the queue, which is
+what clients waiting for jobs do anyway. Slurm dependencies are `afterok`
+dependencies and jobs whose dependencies failed are cancelled. SGE jobs
+start once their dependencies finished, regardless of the outcome. Jobs
+that exceed their wall clock limit are killed.
+
+The emulator is configured through environment variables, which are set
+by the wrapper scripts:
+
+ * JIP_EMULATOR_STATE   -- the state directory
+ * JIP_EMULATOR_LATENCY -- seconds every command sleeps before it is
+                           executed, to emulate the latency of the grid
+                           engine. Defaults to 0
+ * JIP_EMULATOR_SLOTS   -- maximum number of jobs running at the same
+                           time. Defaults to 0, which means no limit
+
+Jobs run with the environment of the submitting process. The wrappers put
+their directory first on the PATH, and a `python` wrapper for the
+interpreter that installed the emulator is created, so job scripts that
+call `python` use the same interpreter as the client.
+"""
+import fcntl
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# environment variables
+_ENV_STATE = "JIP_EMULATOR_STATE"
+_ENV_LATENCY = "JIP_EMULATOR_LATENCY"
+_ENV_SLOTS = "JIP_EMULATOR_SLOTS"
+
+# job states
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+TIMEOUT = "TIMEOUT"
+
+_FINISHED = [COMPLETED, FAILED, CANCELLED, TIMEOUT]
+
+# the emulated commands
+SLURM_COMMANDS = ["sbatch", "squeue", "scontrol", "scancel", "sacct"]
+SGE_COMMANDS = ["qsub", "qstat", "qrls", "qdel", "qacct"]
+
+_WRAPPER = """#!/bin/sh
+export %s=%s
+export %s=%s
+export %s=%s
+export PATH=%s:$PATH
+export PYTHONPATH=%s${PYTHONPATH:+:$PYTHONPATH}
+exec %s -m jip.emulator %s "$@"
+"""
+
+_PYTHON_WRAPPER = """#!/bin/sh
+exec %s "$@"
+"""
+
+
+def install(directory, state=None, latency=0.0, slots=0):
+    """Create the emulator commands in the given directory and return
+    a dictionary from the command names to the paths of the commands.
+
+    :param directory: the directory for the command wrappers
+    :param state: the state directory. Defaults to a `state` folder in
+                  the command directory
+    :param latency: seconds each command sleeps before it is executed
+    :param slots: maximum number of jobs running at the same time or 0
+                  for no limit
+    """
+    directory = os.path.abspath(directory)
+    if state is None:
+        state = os.path.join(directory, "state")
+    state = os.path.abspath(state)
+    for path in [directory, os.path.join(state, "jobs")]:
+        if not os.path.exists(path):
+            os.makedirs(path)
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    commands = {}
+    for command in SLURM_COMMANDS + SGE_COMMANDS:
+        commands[command] = _write_script(
+            os.path.join(directory, command),
+            _WRAPPER % (_ENV_STATE, _quote(state),
+                        _ENV_LATENCY, _quote(str(latency)),
+                        _ENV_SLOTS, _quote(str(slots)),
+                        _quote(directory), _quote(package),
+                        _quote(sys.executable), command))
+    commands["python"] = _write_script(os.path.join(directory, "python"),
+                                       _PYTHON_WRAPPER %
+                                       _quote(sys.executable))
+    return commands
+
+
+def _write_script(path, content):
+    """Write an executable script and return its path"""
+    with open(path, 'w') as script:
+        script.write(content)
+    os.chmod(path, 0755)
+    return path
+
+
+def _quote(value):
+    """Quote a value for the shell"""
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+class _State(object):
+    """The emulator state directory. Each job is stored as a JSON file in
+    the jobs folder. All modifications are done while holding the lock on
+    the state directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.jobs_dir = os.path.join(directory, "jobs")
+        if not os.path.exists(self.jobs_dir):
+            os.makedirs(self.jobs_dir)
+        self._lock = None
+
+    def __enter__(self):
+        self._lock = open(os.path.join(self.directory, "lock"), 'a')
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self._lock, fcntl.LOCK_UN)
+        self._lock.close()
+        self._lock = None
+
+    def next_id(self):
+        """Return the next job id"""
+        path = os.path.join(self.directory, "counter")
+        jobid = 1
+        if os.path.exists(path):
+            with open(path) as counter:
+                jobid = int(counter.read().strip() or 0) + 1
+        with open(path, 'w') as counter:
+            counter.write(str(jobid))
+        return str(jobid)
+
+    def path(self, jobid, extension="json"):
+        """Return the path to a job file"""
+        return os.path.join(self.jobs_dir, "%s.%s" % (jobid, extension))
+
+    def get(self, jobid):
+        """Load a job or return None if the job does not exist"""
+        try:
+            with open(self.path(jobid)) as job_file:
+                return json.load(job_file)
+        except (IOError, ValueError):
+            return None
+
+    def jobs(self):
+        """Load all jobs ordered by job id"""
+        ids = [int(f[:-5]) for f in os.listdir(self.jobs_dir)
+               if f.endswith(".json")]
+        return [j for j in (self.get(str(i)) for i in sorted(ids))
+                if j is not None]
+
+    def save(self, job):
+        """Write a job"""
+        tmp = self.path(job["id"], "tmp")
+        with open(tmp, 'w') as job_file:
+            json.dump(job, job_file)
+        os.rename(tmp, self.path(job["id"]))
+
+    def submit(self, job, script):
+        """Store a new job and its script and return the job id"""
+        job["id"] = self.next_id()
+        job["script"] = self.path(job["id"], "sh")
+        job["state"] = PENDING
+        job["submit"] = time.time()
+        for key in ["start", "end", "exit_code", "signal", "cpu",
+                    "max_rss", "pid"]:
+            job.setdefault(key, None)
+        for key in ["stdout", "stderr"]:
+            job[key] = job[key].replace("%j", job["id"])
+        with open(job["script"], 'w') as script_file:
+            script_file.write(script)
+        self.save(job)
+        return job["id"]
+
+    def schedule(self):
+        """Update the running jobs and start the pending jobs that can be
+        started. Returns the list of all jobs.
+        """
+        jobs = self.jobs()
+        by_id = dict((j["id"], j) for j in jobs)
+        now = time.time()
+        running = 0
+        for job in jobs:
+            if job["state"] != RUNNING:
+                continue
+            exit_file = self.path(job["id"], "exit")
+            if os.path.exists(exit_file):
+                with open(exit_file) as exit_data:
+                    result = json.load(exit_data)
+                job.update(result)
+                job["state"] = COMPLETED if job["exit_code"] == 0 \
+                    else FAILED
+                self.save(job)
+            elif job["max_time"] and now - job["start"] > job["max_time"]:
+                self._kill(job)
+                job["state"] = TIMEOUT
+                job["end"] = now
+                self.save(job)
+            else:
+                running += 1
+
+        slots = int(os.getenv(_ENV_SLOTS, "0") or 0)
+        for job in jobs:
+            if job["state"] != PENDING or job["held"]:
+                continue
+            deps = [by_id[d] for d in job["dependencies"] if d in by_id]
+            if job["flavor"] == "slurm" and \
+                    any(d["state"] in _FINISHED and d["state"] != COMPLETED
+                        for d in deps):
+                job["state"] = CANCELLED
+                job["end"] = now
+                self.save(job)
+                continue
+            if any(d["state"] not in _FINISHED for d in deps):
+                continue
+            if slots > 0 and running >= slots:
+                break
+            self._start(job)
+            running += 1
+        return jobs
+
+    def _start(self, job):
+        """Start the runner process for the given job"""
+        job["state"] = RUNNING
+        job["start"] = time.time()
+        devnull = open(os.devnull, 'r+')
+        process = subprocess.Popen([sys.executable, "-m", "jip.emulator",
+                                    "_run", job["id"]],
+                                   stdin=devnull, stdout=devnull,
+                                   stderr=devnull, env=job["env"],
+                                   preexec_fn=os.setsid, close_fds=True)
+        devnull.close()
+        job["pid"] = process.pid
+        self.save(job)
+
+    def _kill(self, job):
+        """Kill the process group of a running job"""
+        try:
+            os.killpg(job["pid"], signal.SIGKILL)
+        except OSError:
+            pass
+
+    def cancel(self, jobid):
+        """Cancel a pending or running job"""
+        job = self.get(jobid)
+        if job is None:
+            return False
+        if job["state"] == RUNNING:
+            self._kill(job)
+        if job["state"] in [PENDING, RUNNING]:
+            job["state"] = CANCELLED
+            job["end"] = time.time()
+            self.save(job)
+        return True
+
+    def release(self, jobid):
+        """Release a held job"""
+        job = self.get(jobid)
+        if job is None:
+            return False
+        job["held"] = False
+        self.save(job)
+        return True
+
+
+def _run(state, jobid):
+    """Execute the job script and write the exit file with the exit
+    code and the resource usage of the job
+    """
+    job = state.get(jobid)
+    out = open(job["stdout"], 'a')
+    err = out
+    if job["stderr"] != job["stdout"]:
+        err = open(job["stderr"], 'a')
+    process = subprocess.Popen(["/bin/bash", job["script"]],
+                               cwd=job["workdir"], stdout=out, stderr=err,
+                               stdin=open(os.devnull))
+    pid, status, usage = os.wait4(process.pid, 0)
+    result = {"exit_code": os.WEXITSTATUS(status), "signal": 0,
+              "end": time.time(), "cpu": usage.ru_utime + usage.ru_stime,
+              "max_rss": usage.ru_maxrss * 1024}
+    if os.WIFSIGNALED(status):
+        result["signal"] = os.WTERMSIG(status)
+        result["exit_code"] = 128 + result["signal"]
+    tmp = state.path(jobid, "exit.tmp")
+    with open(tmp, 'w') as exit_file:
+        json.dump(result, exit_file)
+    os.rename(tmp, state.path(jobid, "exit"))
+
+
+def _parse_options(args, values, flags=()):
+    """Parse command line options. Options in values take the number of
+    values given in the dictionary, options in flags take no value.
+    Unknown options take a value if the next argument is not an option.
+    Returns a tuple of the dictionary of options, each a list of values,
+    and the list of positional arguments.
+    """
+    options = {}
+    positional = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if not arg.startswith("-"):
+            positional.append(arg)
+            continue
+        if arg.startswith("--") and "=" in arg:
+            arg, value = arg.split("=", 1)
+            options.setdefault(arg, []).append(value)
+        elif arg in flags:
+            options.setdefault(arg, []).append(True)
+        elif arg in values:
+            count = values[arg]
+            value = args[:count]
+            del args[:count]
+            options.setdefault(arg, []).append(value[0] if count == 1
+                                               else value)
+        elif args and not args[0].startswith("-"):
+            options.setdefault(arg, []).append(args.pop(0))
+        else:
+            options.setdefault(arg, []).append(True)
+    return options, positional
+
+
+def _last(options, name, default=None):
+    """Return the last value of an option"""
+    return options.get(name, [default])[-1]
+
+
+def _read_script(positional):
+    """Read the job script from the file argument or stdin"""
+    if positional:
+        with open(positional[0]) as script:
+            return script.read()
+    return sys.stdin.read()
+
+
+def _format_duration(seconds):
+    """Format a duration as [D-]HH:MM:SS"""
+    seconds = int(seconds or 0)
+    days, seconds = divmod(seconds, 86400)
+    value = "%02d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60,
+                                seconds % 60)
+    return "%d-%s" % (days, value) if days else value
+
+
+def _format_time(timestamp):
+    """Format a time stamp as reported by the accounting"""
+    if timestamp is None:
+        return "Unknown"
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp))
+
+
+def _job_env(job, variables):
+    """Add the job environment variables to the jobs environment"""
+    for name, value in variables.items():
+        job["env"][name] = str(value)
+
+
+def sbatch(state, args):
+    from jip.tools import _parse_minutes
+    options, positional = _parse_options(
+        args, {"-t": 1, "-p": 1, "--qos": 1, "-c": 1, "-n": 1,
+               "--mem-per-cpu": 1, "-D": 1, "-d": 1, "-J": 1, "-e": 1,
+               "-o": 1}, flags=["-H"])
+    workdir = os.path.abspath(_last(options, "-D", os.getcwd()))
+    stdout = os.path.join(workdir, _last(options, "-o", "slurm-%j.out"))
+    deps = []
+    for dependency in options.get("-d", []):
+        for d in dependency.split(",")[0].split(":")[1:]:
+            if d not in deps:
+                deps.append(d)
+    max_time = _last(options, "-t")
+    job = {"flavor": "slurm",
+           "name": _last(options, "-J", "sbatch"),
+           "held": "-H" in options,
+           "dependencies": deps,
+           "workdir": workdir,
+           "stdout": stdout,
+           "stderr": os.path.join(workdir, _last(options, "-e", stdout)),
+           "max_time": _parse_minutes(max_time) * 60 if max_time else None,
+           "threads": int(_last(options, "-c", 1)),
+           "env": dict(os.environ)}
+    script = _read_script(positional)
+    jobid = state.submit(job, script)
+    job = state.get(jobid)
+    _job_env(job, {"SLURM_JOB_ID": jobid, "SLURM_JOBID": jobid,
+                   "SLURM_JOB_NAME": job["name"],
+                   "SLURM_CPUS_PER_TASK": job["threads"]})
+    state.save(job)
+    state.schedule()
+    print "Submitted batch job %s" % jobid
+    return 0
+
+
+def squeue(state, args):
+    options, positional = _parse_options(args, {"-o": 1, "-j": 1, "-u": 1},
+                                         flags=["-h"])
+    ids = None
+    if "-j" in options:
+        ids = set(",".join(options["-j"]).split(","))
+    fmt = _last(options, "-o", "%i %j %t")
+    if "-h" not in options:
+        print fmt.replace("%i", "JOBID").replace("%j", "NAME") \
+            .replace("%t", "ST").replace("%T", "STATE")
+    for job in state.schedule():
+        if job["state"] not in [PENDING, RUNNING]:
+            continue
+        if ids is not None and job["id"] not in ids:
+            continue
+        print fmt.replace("%i", job["id"]).replace("%j", job["name"]) \
+            .replace("%t", "R" if job["state"] == RUNNING else "PD") \
+            .replace("%T", job["state"])
+    return 0
+
+
+def scontrol(state, args):
+    if len(args) < 2 or args[0] != "release":
+        sys.stderr.write("scontrol: only 'release <jobids>' is supported\n")
+        return 1
+    status = 0
+    for jobid in args[1].split(","):
+        if not state.release(jobid):
+            sys.stderr.write("Invalid job id specified: %s\n" % jobid)
+            status = 1
+    state.schedule()
+    return status
+
+
+def scancel(state, args):
+    status = 0
+    for jobid in ",".join(args).split(","):
+        if jobid and not state.cancel(jobid):
+            sys.stderr.write("scancel: error: Invalid job id %s\n" % jobid)
+            status = 1
+    state.schedule()
+    return status
+
+
+def sacct(state, args):
+    options, positional = _parse_options(args, {"-j": 1, "-o": 1},
+                                         flags=["-n", "-P"])
+    ids = set(",".join(options.get("-j", [])).split(","))
+    fields = _last(options, "-o", "JobID,JobName,State,ExitCode").split(",")
+    if "-n" not in options:
+        print "|".join(fields)
+    for job in state.schedule():
+        if job["id"] not in ids:
+            continue
+        end = job["end"] or time.time()
+        values = {"JobID": job["id"],
+                  "JobName": job["name"],
+                  "State": job["state"],
+                  "ExitCode": "%d:%d" % (job["exit_code"] or 0,
+                                         job["signal"] or 0),
+                  "Elapsed": _format_duration(end - job["start"]
+                                              if job["start"] else 0),
+                  "TotalCPU": "%02d:%06.3f" % divmod(job["cpu"] or 0, 60),
+                  "MaxRSS": "",
+                  "Start": _format_time(job["start"]),
+                  "End": _format_time(job["end"])}
+        print "|".join(values.get(f, "") for f in fields)
+        if job["max_rss"] is not None:
+            # the batch step reports the memory usage
+            values["JobID"] = "%s.batch" % job["id"]
+            values["JobName"] = "batch"
+            values["MaxRSS"] = "%dK" % (job["max_rss"] // 1024)
+            print "|".join(values.get(f, "") for f in fields)
+    return 0
+
+
+def qsub(state, args):
+    options, positional = _parse_options(
+        args, {"-q": 1, "-pe": 2, "-N": 1, "-l": 1, "-wd": 1,
+               "-hold_jid": 1, "-e": 1, "-o": 1}, flags=["-V", "-h"])
+    workdir = os.path.abspath(_last(options, "-wd", os.getcwd()))
+    name = _last(options, "-N", "STDIN")
+    resources = {}
+    for resource in options.get("-l", []):
+        for r in resource.split(","):
+            key, _, value = r.partition("=")
+            resources[key] = value
+    deps = []
+    for dependency in options.get("-hold_jid", []):
+        deps.extend([d for d in dependency.split(",") if d])
+    threads = 1
+    if "-pe" in options:
+        threads = int(_last(options, "-pe")[1])
+    max_time = resources.get("h_rt")
+    job = {"flavor": "sge",
+           "name": name,
+           "held": "-h" in options,
+           "dependencies": deps,
+           "workdir": workdir,
+           "stdout": _last(options, "-o", workdir),
+           "stderr": _last(options, "-e", workdir),
+           "max_time": int(max_time) if max_time else None,
+           "threads": threads,
+           "env": dict(os.environ)}
+    script = _read_script(positional)
+    jobid = state.submit(job, script)
+    job = state.get(jobid)
+    for key, suffix in [("stdout", "o"), ("stderr", "e")]:
+        if os.path.isdir(job[key]):
+            job[key] = os.path.join(job[key], "%s.%s%s" % (name, suffix,
+                                                           jobid))
+    _job_env(job, {"JOB_ID": jobid, "JOB_NAME": name,
+                   "NSLOTS": threads})
+    state.save(job)
+    state.schedule()
+    print 'Your job %s ("%s") has been submitted' % (jobid, name)
+    return 0
+
+
+def qstat(state, args):
+    options, positional = _parse_options(args, {"-u": 1, "-j": 1})
+    jobs = [j for j in state.schedule() if j["state"] in [PENDING, RUNNING]]
+    if "-j" in options:
+        ids = set(",".join(options["-j"]).split(","))
+        jobs = [j for j in jobs if j["id"] in ids]
+        if len(jobs) == 0:
+            sys.stderr.write("Following jobs do not exist:\n%s\n" %
+                             ",".join(sorted(ids)))
+            return 1
+        for job in jobs:
+            print "job_number:                 %s" % job["id"]
+            print "job_name:                   %s" % job["name"]
+        return 0
+    user = os.getenv("USER", "user")
+    for job in jobs:
+        code = "r"
+        if job["state"] == PENDING:
+            code = "hqw" if job["held"] else "qw"
+        print "%7s 0.50000 %-10s %-12s %-5s %s %s %d" % (
+            job["id"], job["name"][:10], user[:12], code,
+            time.strftime("%m/%d/%Y %H:%M:%S",
+                          time.localtime(job["submit"])),
+            "all.q@localhost" if code == "r" else "", job["threads"])
+    return 0
+
+
+def qrls(state, args):
+    status = 0
+    for jobid in ",".join(args).split(","):
+        if jobid and not state.release(jobid):
+            sys.stderr.write("denied: job \"%s\" does not exist\n" % jobid)
+            status = 1
+    state.schedule()
+    return status
+
+
+def qdel(state, args):
+    status = 0
+    for jobid in ",".join(args).split(","):
+        if not jobid:
+            continue
+        if state.cancel(jobid):
+            print "%s has deleted job %s" % (os.getenv("USER", "user"),
+                                             jobid)
+        else:
+            sys.stderr.write("denied: job \"%s\" does not exist\n" % jobid)
+            status = 1
+    state.schedule()
+    return status
+
+
+def qacct(state, args):
+    options, positional = _parse_options(args, {"-j": 1})
+    jobid = _last(options, "-j")
+    state.schedule()
+    job = state.get(jobid) if jobid else None
+    if job is None or job["state"] not in _FINISHED:
+        sys.stderr.write("error: job id %s not found\n" % jobid)
+        return 1
+    failed = "0"
+    if job["state"] == TIMEOUT:
+        failed = "37  : qmaster enforced h_rt, h_cpu, or h_vmem limit"
+    elif job["state"] == CANCELLED:
+        failed = "100 : assumedly after job"
+    start = job["start"] or job["end"]
+    print "=" * 62
+    for key, value in [("qname", "all.q"),
+                       ("hostname", "localhost"),
+                       ("jobname", job["name"]),
+                       ("jobnumber", job["id"]),
+                       ("failed", failed),
+                       ("exit_status", job["exit_code"] or 0),
+                       ("ru_wallclock", "%ds" % (job["end"] - start)),
+                       ("cpu", "%.3fs" % (job["cpu"] or 0)),
+                       ("maxvmem", "%.3fM" % ((job["max_rss"] or 0) /
+                                              (1024.0 * 1024.0))),
+                       ("start_time", time.ctime(start)),
+                       ("end_time", time.ctime(job["end"]))]:
+        print "%-13s%s" % (key, value)
+    return 0
+
+
+_HANDLERS = {"sbatch": sbatch, "squeue": squeue, "scontrol": scontrol,
+             "scancel": scancel, "sacct": sacct, "qsub": qsub,
+             "qstat": qstat, "qrls": qrls, "qdel": qdel, "qacct": qacct}
+
+
+def main(argv=None):
+    """Run an emulator command. The first argument is the command name,
+    followed by the command arguments. Returns the exit code.
+
+    :param argv: the command line arguments without the program name
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    directory = os.getenv(_ENV_STATE)
+    if directory is None:
+        sys.stderr.write("%s is not set\n" % _ENV_STATE)
+        return 1
+    if len(argv) == 0 or (argv[0] not in _HANDLERS and argv[0] != "_run"):
+        sys.stderr.write("Usage: python -m jip.emulator <command> [args]\n")
+        return 1
+    state = _State(directory)
+    if argv[0] == "_run":
+        _run(state, argv[1])
+        return 0
+    latency = float(os.getenv(_ENV_LATENCY, "0") or 0)
+    if latency > 0:
+        time.sleep(latency)
+    with state:
+        return _HANDLERS[argv[0]](state, argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
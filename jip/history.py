@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""The history module keeps track of the resources that pipeline steps
+actually used on the cluster, so that the resource requests of future
+submissions can be adjusted to the observed usage.
+
+The :py:class:`ResourceHistory` is stored as a JSON file. Usage samples
+are taken from the job accounting, see
+:py:meth:`jip.cluster.Cluster.accounting`, and grouped by the tool name,
+the tool version and the size band of the step input files. The size band
+is the binary logarithm of the total input size, so runs on inputs of
+similar size share their history. Only inputs that exist before the
+pipeline runs are counted, so that the band is the same at submission
+time and after the run. Steps that only read the outputs of upstream
+steps take the size of their largest upstream step.
+
+A typical round trip looks like this::
+
+    history = ResourceHistory("resources.json", headroom=1.2)
+    pipeline.submit(cluster, history=history)
+    ...
+    history.update(pipeline, cluster)
+    history.save()
+"""
+import json
+import math
+import os
+
+
+class ResourceHistory(object):
+    """Historical resource usage of tools. The estimates are the maximum
+    over the recorded samples multiplied by the headroom factor.
+    """
+
+    def __init__(self, path, headroom=1.2, samples=20):
+        """Load the history from the given file if it exists
+
+        :param path: the history file
+        :param headroom: factor applied to the observed memory and time
+        :param samples: maximum number of samples kept per key
+        """
+        self.path = path
+        self.headroom = headroom
+        self.samples = samples
+        self.usage = {}
+        if os.path.exists(path):
+            with open(path) as history:
+                self.usage = json.load(history)
+
+    def save(self):
+        """Write the history file"""
+        tmp = "%s.tmp" % self.path
+        with open(tmp, 'w') as history:
+            json.dump(self.usage, history, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def key(self, step, sizes=None):
+        """Return the history key of the given pipeline step
+
+        :param step: the :py:class:`jip.pipelines.PipelineTool`
+        :param sizes: optional dictionary that caches the input sizes
+                      of the steps of the pipeline
+        """
+        tool = step._tool
+        size = _input_size(step, {} if sizes is None else sizes)
+        band = int(math.log(size, 2)) if size > 0 else 0
+        return "%s|%s|%d" % (tool.name, tool.version, band)
+
+    def update(self, pipeline, grid):
+        """Record the resource usage of all successfully completed steps
+        of the given pipeline. Steps that were packed or fused with other
+        steps into a single job are skipped, as the job accounting does not
+        tell the steps apart.
+
+        :param pipeline: the submitted :py:class:`jip.pipelines.Pipeline`
+        :param grid: the :py:class:`jip.cluster.Cluster`
+        """
+        accounting = pipeline.get_accounting(grid)
+        shared = {}
+        sizes = {}
+        for job in accounting.values():
+            shared[job.jobid] = shared.get(job.jobid, 0) + 1
+        for step in pipeline.get_sorted_tools():
+            job = accounting.get(step._name)
+            if job is None or job.state != "COMPLETED" or \
+                    shared[job.jobid] > 1 or job.elapsed is None:
+                continue
+            records = self.usage.setdefault(self.key(step, sizes), [])
+            records.append([job.elapsed, job.cpu_time, job.max_rss])
+            del records[:-self.samples]
+
+    def estimate(self, step, sizes=None):
+        """Return a dictionary with the estimated total max_mem of the job
+        in MB, max_time in minutes and threads of the given step or None if
+        there is no history for the step. Values that can not be estimated
+        are None.
+
+        :param step: the :py:class:`jip.pipelines.PipelineTool`
+        :param sizes: optional dictionary that caches the input sizes
+                      of the steps of the pipeline
+        """
+        records = self.usage.get(self.key(step, sizes))
+        if not records:
+            return None
+        elapsed = max(r[0] for r in records)
+        estimate = {"max_time": max(1, int(math.ceil(
+            elapsed * self.headroom / 60.0))),
+            "max_mem": None, "threads": None}
+        rss = [r[2] for r in records if r[2] is not None]
+        if len(rss) > 0:
+            estimate["max_mem"] = max(1, int(math.ceil(
+                max(rss) * self.headroom / (1024.0 * 1024.0))))
+        usage = [r[1] / r[0] for r in records
+                 if r[1] is not None and r[0] > 0]
+        if len(usage) > 0:
+            estimate["threads"] = max(1, int(math.ceil(max(usage))))
+        return estimate
+
+    def apply(self, step, sizes=None):
+        """Adjust the job of the given step to the estimated resource
+        usage. The number of threads is only ever reduced, as tools might
+        not scale beyond the threads they request. The job max_mem is
+        requested per cpu, so the estimated total memory is divided by
+        the number of threads. Returns True if the job was adjusted.
+
+        :param step: the :py:class:`jip.pipelines.PipelineTool`
+        :param sizes: optional dictionary that caches the input sizes
+                      of the steps of the pipeline
+        """
+        estimate = self.estimate(step, sizes)
+        if estimate is None:
+            return False
+        job = step.job
+        job.max_time = estimate["max_time"]
+        if estimate["threads"] is not None and job.threads is not None:
+            job.threads = min(job.threads, estimate["threads"])
+        if estimate["max_mem"] is not None:
+            job.max_mem = int(math.ceil(estimate["max_mem"] /
+                                        float(job.threads or 1)))
+        return True
+
+
+def _input_size(step, sizes):
+    """Return the input size in bytes of the given step. This is the size
+    of the inputs that exist before the pipeline runs or, if the step only
+    reads the outputs of upstream steps, the largest size of its upstream
+    steps. Sizes are cached by step in the given dictionary.
+    """
+    pending = [step]
+    own = {}
+    while pending:
+        current = pending.pop()
+        if current in sizes:
+            continue
+        if current not in own:
+            own[current] = _pipeline_input_size(current)
+        upstream = [s for s in current._in_edges if s not in sizes]
+        if own[current] > 0 or len(upstream) == 0:
+            sizes[current] = own[current] or max(
+                [sizes[s] for s in current._in_edges] or [0])
+        else:
+            pending.append(current)
+            pending.extend(upstream)
+    return sizes[step]
+
+
+def _pipeline_input_size(step):
+    """Return the total size in bytes of the existing input files of
+    the given step that are not produced by upstream steps
+    """
+    config = step.get_configuration()
+    size = 0
+    for name in step._tool.inputs:
+        param = step._kwargs.get(name)
+        if param is not None and param.pipeline_tool != step:
+            continue
+        values = config.get(name)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        for value in values:
+            if isinstance(value, basestring) and os.path.isfile(value):
+                size += os.path.getsize(value)
+    return size
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""The instrumentation module records wall clock timings of the phases
+of tool execution and pipeline submission. Timings are passed to the
+installed collector. By default no collector is installed and the hooks
+reduce to a check of a module variable.
+
+The following phases are recorded:
+
+ * resolve  -- resolving the configuration of a pipeline step
+ * render   -- rendering the command template of a tool
+ * is_done  -- checking whether the outputs of a tool exist
+ * execute  -- running a tool locally, or the run time of a job on the
+               cluster as reported by the remote bootstrap
+ * submit   -- submitting a job to the cluster
+ * queue    -- time from the submission of a job until the job started
+ * load     -- loading the results of a job
+ * poll     -- checking the states of the active jobs on the cluster
+
+In addition, the following events are counted:
+
+ * submitted      -- steps submitted to the cluster
+ * completed      -- steps that finished successfully
+ * failed         -- steps that failed
+ * cached         -- steps that were skipped because their outputs exist
+ * template_hit   -- templates taken from the compiled template cache
+ * template_miss  -- templates that had to be compiled
+
+and the number of steps of active jobs is reported as the `running` and
+`queued` gauges whenever the job states are checked.
+
+A :py:class:`Collector` aggregates the timings per tool class::
+
+    collector = instrumentation.install(Collector())
+    pipeline.run()
+    instrumentation.uninstall()
+    print collector.summary()
+
+Custom collectors implement the `record(phase, subject, seconds)`
+method or extend :py:class:`Collector`. Collectors that are interested in
+events and gauges also implement `count(event, subject, value)` and
+`gauge(name, value)`. Events and gauges are not passed to collectors
+without these methods. The subject is the :py:class:`jip.tools.Tool` or
+:py:class:`jip.pipelines.PipelineTool` the timing belongs to, a list of
+them if a single job runs multiple tools, or None.
+"""
+import threading
+import time
+
+PHASE_RESOLVE = "resolve"
+PHASE_RENDER = "render"
+PHASE_IS_DONE = "is_done"
+PHASE_EXECUTE = "execute"
+PHASE_SUBMIT = "submit"
+PHASE_QUEUE = "queue"
+PHASE_LOAD = "load"
+PHASE_POLL = "poll"
+
+EVENT_SUBMITTED = "submitted"
+EVENT_COMPLETED = "completed"
+EVENT_FAILED = "failed"
+EVENT_CACHED = "cached"
+EVENT_TEMPLATE_HIT = "template_hit"
+EVENT_TEMPLATE_MISS = "template_miss"
+
+GAUGE_RUNNING = "running"
+GAUGE_QUEUED = "queued"
+
+# the installed collector or None
+_collector = None
+
+
+def install(collector=None):
+    """Install the given collector and return it. If no collector is
+    given, a new :py:class:`Collector` is installed.
+
+    :param collector: the collector
+    """
+    global _collector
+    if collector is None:
+        collector = Collector()
+    _collector = collector
+    return collector
+
+
+def uninstall():
+    """Remove the installed collector and return it"""
+    global _collector
+    collector = _collector
+    _collector = None
+    return collector
+
+
+def get_collector():
+    """Return the installed collector or None"""
+    return _collector
+
+
+def start():
+    """Return the current time if a collector is installed, otherwise
+    None. Pass the value to :py:func:`stop` at the end of the phase.
+    """
+    if _collector is None:
+        return None
+    return time.time()
+
+
+def stop(phase, subject, started):
+    """Record the time since `started` for the given phase and subject.
+    Nothing is recorded if started is None.
+
+    :param phase: the phase
+    :param subject: the tool the timing belongs to
+    :param started: the value returned by :py:func:`start`
+    """
+    if started is None or _collector is None:
+        return
+    _collector.record(phase, subject, time.time() - started)
+
+
+def record(phase, subject, seconds):
+    """Pass a timing to the installed collector
+
+    :param phase: the phase
+    :param subject: the tool the timing belongs to
+    :param seconds: the duration of the phase in seconds
+    """
+    if _collector is not None:
+        _collector.record(phase, subject, seconds)
+
+
+def count(event, subject=None, value=1):
+    """Pass an event count to the installed collector. Nothing is
+    passed if the collector does not count events.
+
+    :param event: the event
+    :param subject: the tool the event belongs to
+    :param value: the number of events
+    """
+    if _collector is not None:
+        counter = getattr(_collector, "count", None)
+        if counter is not None:
+            counter(event, subject, value)
+
+
+def gauge(name, value):
+    """Pass the current value of a gauge to the installed collector.
+    Nothing is passed if the collector does not support gauges.
+
+    :param name: the gauge name
+    :param value: the current value
+    """
+    if _collector is not None:
+        setter = getattr(_collector, "gauge", None)
+        if setter is not None:
+            setter(name, value)
+
+
+def subject_key(subject):
+    """Return the name of the tool class of the given subject. Lists of
+    tools are named by their distinct class names joined with '+'.
+
+    :param subject: a tool, a pipeline tool or a list of them
+    """
+    if isinstance(subject, (list, tuple)):
+        names = []
+        for s in subject:
+            name = subject_key(s)
+            if name not in names:
+                names.append(name)
+        return "+".join(names)
+    # unwrap pipeline tools
+    subject = getattr(subject, "_tool", subject)
+    if subject is None:
+        return None
+    if isinstance(subject, basestring):
+        return subject
+    cls = subject if isinstance(subject, type) else subject.__class__
+    return "%s.%s" % (cls.__module__, cls.__name__)
+
+
+class Collector(object):
+    """Thread safe collector that aggregates the number of calls, the
+    total and the maximum time per tool class and phase, the event counts
+    per tool class and the last value of the gauges
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, subject, seconds):
+        """Add a timing
+
+        :param phase: the phase
+        :param subject: the tool the timing belongs to
+        :param seconds: the duration in seconds
+        """
+        key = (subject_key(subject), phase)
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def count(self, event, subject, value=1):
+        """Add to an event count
+
+        :param event: the event
+        :param subject: the tool the event belongs to
+        :param value: the number of events
+        """
+        key = (subject_key(subject), event)
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def gauge(self, name, value):
+        """Set the value of a gauge
+
+        :param name: the gauge name
+        :param value: the current value
+        """
+        with self._lock:
+            self.gauges[name] = value
+
+    def reset(self):
+        """Remove all recorded timings, counts and gauges"""
+        with self._lock:
+            self.timings = {}
+            self.counts = {}
+            self.gauges = {}
+
+    def summary(self):
+        """Return a dictionary from the tool class names to dictionaries
+        from the phases to the `count`, `total`, `mean` and `max` time
+        in seconds
+        """
+        summary = {}
+        with self._lock:
+            for (name, phase), (count, total, longest) in \
+                    self.timings.items():
+                summary.setdefault(name, {})[phase] = {
+                    "count": count,
+                    "total": total,
+                    "mean": total / count,
+                    "max": longest}
+        return summary
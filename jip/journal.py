@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""The journal module records pipeline submissions, so that a submission
+that was interrupted can be restarted without submitting the steps again
+that are still queued or running on the cluster.
+
+The :py:class:`SubmissionJournal` is an append-only file with one JSON
+record per line. Each record maps the identity of a pipeline step to the
+job it was submitted with. The identity is a hash over the tool class,
+the tool version, the step name and the resolved step configuration, so
+a step that changed its configuration is not considered the same step.
+Later records for the same identity replace earlier ones.
+
+On restart, the journal is reconciled with the active jobs of the cluster
+and steps whose jobs are still active are adopted.
+"""
+import hashlib
+import json
+import os
+
+
+def step_identity(step):
+    """Return the identity hash of the given pipeline step. The hash
+    covers the tool class, the tool version, the step name and the resolved
+    configuration without the job settings.
+
+    :param step: the :py:class:`jip.pipelines.PipelineTool`
+    """
+    tool = step._tool
+    config = step.get_configuration()
+    config.pop("job", None)
+    identity = [tool.__class__.__module__, tool.__class__.__name__,
+                tool.version, step._name, _canonical(config)]
+    return hashlib.sha1(repr(identity)).hexdigest()
+
+
+def _canonical(value):
+    """Convert the value into a representation that does not depend on
+    dictionary ordering
+    """
+    if isinstance(value, dict):
+        return sorted((repr(k), _canonical(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return repr(value)
+
+
+class SubmissionJournal(object):
+    """Append-only journal of submitted pipeline steps. Each record
+    holds the step identity, the step name, the job id and the paths
+    needed to restore the :py:class:`jip.cluster.Feature` of the step.
+    """
+
+    def __init__(self, path):
+        """Open the journal at the given path. Existing records are loaded.
+
+        :param path: the journal file
+        """
+        self.path = path
+        self.records = {}
+        self.live = {}
+        self.queued = set([])
+        if os.path.exists(path):
+            with open(path) as journal:
+                for line in journal:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # partially written record of an interrupted run
+                        continue
+                    self.records[record["id"]] = record
+
+    def record(self, steps, features):
+        """Append records for the given steps and their features
+
+        :param steps: list of :py:class:`jip.pipelines.PipelineTool`
+        :param features: list of the :py:class:`jip.cluster.Feature`
+                         instances returned by the submission, one per step
+        """
+        lines = []
+        for step, feature in zip(steps, features):
+            record = {"id": step_identity(step),
+                      "name": step._name,
+                      "jobid": str(feature.jobid),
+                      "stdout": feature.stdout,
+                      "stderr": feature.stderr,
+                      "result": feature.result,
+                      "index": feature.index}
+            self.records[record["id"]] = record
+            lines.append(json.dumps(record) + "\n")
+        with open(self.path, 'a') as journal:
+            journal.write("".join(lines))
+
+    def reconcile(self, grid):
+        """Check the recorded jobs against the active jobs of the given
+        cluster and return a dictionary from the step identities to the
+        records of jobs that are still queued or running. The result is
+        also stored in the `live` attribute and the ids of the jobs that
+        are still queued are stored in the `queued` attribute.
+
+        :param grid: the :py:class:`jip.cluster.Cluster`
+        """
+        from jip.cluster import Cluster
+        self.live = {}
+        self.queued = set([])
+        if len(self.records) == 0:
+            return self.live
+        jobs = grid.list() or {}
+        for identity, record in self.records.items():
+            state = jobs.get(record["jobid"])
+            if state is not None:
+                self.live[identity] = record
+                if state == Cluster.STATE_QUEUED:
+                    self.queued.add(record["jobid"])
+        return self.live
+
+    def adopt(self, step):
+        """Return the feature of the given step if the steps job is
+        still active, otherwise None. The job id of the step is updated
+        to the adopted job. Call :py:meth:`reconcile` first.
+
+        :param step: the :py:class:`jip.pipelines.PipelineTool`
+        """
+        from jip.cluster import Feature
+        record = self.live.get(step_identity(step))
+        if record is None:
+            return None
+        step.job.jobid = record["jobid"]
+        return Feature(record["jobid"], stdout=record["stdout"],
+                       stderr=record["stderr"], result=record["result"],
+                       index=record["index"])
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""The metrics module exposes the throughput of long running pipeline
+submitters in the Prometheus text format. Metrics are fed by a
+:py:class:`MetricsCollector` that is installed as the instrumentation
+collector, see :py:mod:`jip.instrumentation`, and exposed either through
+a text file that is picked up by the node exporters text file collector
+or through a local HTTP endpoint::
+
+    collector = instrumentation.install(MetricsCollector())
+    writer = TextFileWriter(collector.registry, "/var/lib/node/jip.prom")
+    writer.start()
+    # or
+    server = collector.registry.serve(9417)
+
+The collector provides the following metrics. Step counters and phase
+durations are labeled with the tool class:
+
+ * jip_steps_submitted_total      -- steps submitted to the cluster
+ * jip_steps_completed_total      -- steps that finished successfully
+ * jip_steps_failed_total         -- steps that failed
+ * jip_result_cache_hits_total    -- steps skipped because their outputs
+                                     exist
+ * jip_template_cache_hits_total  -- templates taken from the cache
+ * jip_template_cache_misses_total -- templates that had to be compiled
+ * jip_steps_queued               -- steps of queued jobs
+ * jip_steps_running              -- steps of running jobs
+ * jip_submission_latency_seconds -- histogram of the job submission time
+ * jip_poll_latency_seconds       -- histogram of the job state checks
+ * jip_queue_wait_seconds         -- histogram of the job queue wait
+ * jip_phase_duration_seconds     -- histogram of the other phases,
+                                     labeled with the phase
+"""
+import os
+import threading
+
+from jip import instrumentation
+
+# default histogram buckets in seconds, from template rendering to
+# queue waits of hours
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60,
+                   300, 900, 3600, 14400, float("inf"))
+
+
+class Metric(object):
+    """Base class of the metrics. Values are stored per label set.
+    Updates are thread safe.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        """Create a metric
+
+        :param name: the metric name
+        :param help: the help text
+        :param labels: the label names
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """Return the label values in label name order"""
+        if labels is None:
+            labels = {}
+        return tuple(labels.get(name) or "" for name in self.labels)
+
+    def samples(self):
+        """Yield tuples of the sample name, a list of label name and value
+        tuples and the sample value
+        """
+        with self._lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield self.name, zip(self.labels, key), value
+
+
+class Counter(Metric):
+    """A monotonically increasing counter"""
+    type = "counter"
+
+    def inc(self, value=1, labels=None):
+        """Increase the counter
+
+        :param value: the increment
+        :param labels: dictionary of the label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    """A value that can go up and down"""
+    type = "gauge"
+
+    def set(self, value, labels=None):
+        """Set the gauge
+
+        :param value: the value
+        :param labels: dictionary of the label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """Counts observations in cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """Create a histogram
+
+        :param name: the metric name
+        :param help: the help text
+        :param labels: the label names
+        :param buckets: the sorted upper bounds of the buckets. The last
+                        bound should be infinity
+        """
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=None):
+        """Add an observation
+
+        :param value: the observed value
+        :param labels: dictionary of the label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # bucket counts followed by the sum and the count
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            values = sorted((k, list(v)) for k, v in self.values.items())
+        for key, counts in values:
+            labels = zip(self.labels, key)
+            for bound, count in zip(self.buckets, counts):
+                yield (self.name + "_bucket",
+                       labels + [("le", _format(bound))], count)
+            yield self.name + "_sum", labels, counts[-2]
+            yield self.name + "_count", labels, counts[-1]
+
+
+class Registry(object):
+    """A set of metrics that are rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """Add a metric and return it
+
+        :param metric: the :py:class:`Metric`
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        """Create and register a :py:class:`Counter`"""
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        """Create and register a :py:class:`Gauge`"""
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """Create and register a :py:class:`Histogram`"""
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Return the metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                if labels:
+                    name = "%s{%s}" % (name, ",".join(
+                        '%s="%s"' % (k, _escape(v)) for k, v in labels))
+                lines.append("%s %s" % (name, _format(value)))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to the given file. The file is replaced
+        atomically, so readers never see partial files.
+
+        :param path: the target file
+        """
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'w') as target:
+            target.write(self.render())
+        os.rename(tmp, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve the metrics over HTTP from a daemon thread and return
+        the server. Call `shutdown()` on the server to stop it.
+
+        :param port: the port. If 0, a free port is chosen, see the
+                     `server_address` of the returned server
+        :param host: the address the server binds to
+        """
+        import BaseHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = registry.render()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+class TextFileWriter(threading.Thread):
+    """Daemon thread that writes the metrics of a registry to a file
+    in regular intervals
+    """
+
+    def __init__(self, registry, path, interval=60):
+        """Create the writer. Call start() to start writing.
+
+        :param registry: the :py:class:`Registry`
+        :param path: the target file
+        :param interval: the interval in seconds
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.registry.write(self.path)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        """Stop the writer and write the metrics a last time"""
+        self._stopped.set()
+        self.join()
+        self.registry.write(self.path)
+
+
+class MetricsCollector(object):
+    """Instrumentation collector that feeds the metrics of a registry.
+    See :py:mod:`jip.instrumentation`.
+    """
+
+    def __init__(self, registry=None):
+        """Create the collector and register its metrics
+
+        :param registry: the :py:class:`Registry`. A new registry is
+                         created if not specified
+        """
+        if registry is None:
+            registry = Registry()
+        self.registry = registry
+        self.events = {
+            instrumentation.EVENT_SUBMITTED: registry.counter(
+                "jip_steps_submitted_total", "Steps submitted to the cluster",
+                ["tool"]),
+            instrumentation.EVENT_COMPLETED: registry.counter(
+                "jip_steps_completed_total", "Steps that finished "
+                "successfully", ["tool"]),
+            instrumentation.EVENT_FAILED: registry.counter(
+                "jip_steps_failed_total", "Steps that failed", ["tool"]),
+            instrumentation.EVENT_CACHED: registry.counter(
+                "jip_result_cache_hits_total", "Steps skipped because their "
+                "outputs exist", ["tool"]),
+            instrumentation.EVENT_TEMPLATE_HIT: registry.counter(
+                "jip_template_cache_hits_total", "Templates taken from the "
+                "compiled template cache"),
+            instrumentation.EVENT_TEMPLATE_MISS: registry.counter(
+                "jip_template_cache_misses_total", "Templates that had to "
+                "be compiled"),
+        }
+        self.gauges = {
+            instrumentation.GAUGE_QUEUED: registry.gauge(
+                "jip_steps_queued", "Steps of queued jobs"),
+            instrumentation.GAUGE_RUNNING: registry.gauge(
+                "jip_steps_running", "Steps of running jobs"),
+        }
+        self.phases = {
+            instrumentation.PHASE_SUBMIT: registry.histogram(
+                "jip_submission_latency_seconds", "Time to submit a job",
+                ["tool"]),
+            instrumentation.PHASE_POLL: registry.histogram(
+                "jip_poll_latency_seconds", "Time to check the job states"),
+            instrumentation.PHASE_QUEUE: registry.histogram(
+                "jip_queue_wait_seconds", "Time jobs waited in the queue",
+                ["tool"]),
+        }
+        self.durations = registry.histogram(
+            "jip_phase_duration_seconds", "Duration of the tool execution "
+            "phases", ["phase", "tool"])
+
+    def record(self, phase, subject, seconds):
+        labels = {"phase": phase,
+                  "tool": instrumentation.subject_key(subject)}
+        self.phases.get(phase, self.durations).observe(seconds, labels)
+
+    def count(self, event, subject, value=1):
+        counter = self.events.get(event)
+        if counter is not None:
+            counter.inc(value, {"tool": instrumentation.subject_key(subject)})
+
+    def gauge(self, name, value):
+        gauge = self.gauges.get(name)
+        if gauge is not None:
+            gauge.set(value)
+
+
+def _format(value):
+    """Format a sample value"""
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+"""The pilot module implements pilot job execution of pipelines. Instead
+of submitting one cluster job per pipeline step, a small number of long
+running worker jobs is started. The workers pull ready pipeline steps from
+a task queue on a shared file system, execute them and report the results
+back through the same directory. The client side :py:class:`Pilot`
+schedules the steps, so thousands of steps share a handful of allocations.
+
+The queue directory has the following layout:
+
+ * tasks/   -- ready tasks. Workers claim a task by renaming it into
+               the running folder, which is atomic on a shared file system
+ * running/ -- claimed tasks, named <task>.<worker>. Tasks of workers
+               that exited are put back into the queue once. If the
+               worker of a requeued task exits again, the task fails
+ * done/    -- task results, written by the workers
+ * stop     -- created by the client once all tasks are done. Idle workers
+               exit when they find the file
+
+Workers are started with::
+
+    python -m jip.pilot <queue_directory> [<worker name>]
+
+If the pilot is created without a cluster, the workers are started as
+local sub-processes, which is useful for testing.
+"""
+import os
+import sys
+import time
+
+
+class Pilot(object):
+    """Client side scheduler for pilot job execution. The pilot starts
+    the workers, enqueues the pipeline steps as soon as all their
+    dependencies are finished and collects the results.
+
+    Linear chains of steps can be fused into single tasks, see
+    :py:meth:`jip.pipelines.Pipeline.get_linear_chains`.
+    """
+
+    def __init__(self, directory, workers=2, cluster=None, job=None,
+                 poll_interval=0.5, check_interval=60, fuse=False):
+        """Initialize the pilot
+
+        Parameter
+        ---------
+        directory -- the queue directory. If workers run on a cluster,
+                     this has to be on storage shared with the compute
+                     nodes
+        workers -- number of workers
+        cluster -- the :py:class:`jip.cluster.Cluster` used to submit the
+                   workers. If None, workers run as local sub-processes
+        job -- :py:class:`jip.tools.Job` used to submit the worker jobs
+        poll_interval -- interval in seconds in which the queue directory
+                         is checked for results
+        check_interval -- interval in seconds in which the cluster is
+                          checked for running workers
+        fuse -- run linear chains of steps as single tasks
+        """
+        self.directory = os.path.abspath(directory)
+        self.workers = workers
+        self.cluster = cluster
+        self.job = job
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self.fuse = fuse
+        self._processes = []
+        self._features = []
+        # the started workers by worker name, see _check_workers()
+        self._workers = {}
+        self._requeued = set([])
+
+    def run(self, pipeline):
+        """Execute all steps of the pipeline that are not done and
+        return a dictionary from the step names to the step results.
+        A PipelineException is raised if a step failed. The exceptions
+        `failures` attribute is a dictionary from the names of the failed
+        steps to the errors. Steps that depend on a failed step are not
+        executed.
+
+        Parameter
+        ---------
+        pipeline -- the :py:class:`jip.pipelines.Pipeline`
+        """
+        from jip.pipelines import PipelineException
+        units, unit_deps = self._units(pipeline)
+        for folder in ["tasks", "running", "done"]:
+            path = os.path.join(self.directory, folder)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            # remove leftovers of previous runs
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+        if os.path.exists(self._stop_file()):
+            os.remove(self._stop_file())
+        self._workers = {}
+        self._requeued = set([])
+
+        results = {}
+        failures = {}
+        waiting = dict((i, set(d)) for i, d in unit_deps.items())
+        dependents = {}
+        for i, deps in unit_deps.items():
+            for d in deps:
+                dependents.setdefault(d, []).append(i)
+        running = set([])
+
+        self._start_workers()
+        try:
+            next_check = time.time() + self.check_interval
+            while waiting or running:
+                for i in [u for u, deps in waiting.items() if not deps]:
+                    del waiting[i]
+                    self._enqueue(i, units[i])
+                    running.add(i)
+                finished = self._finished()
+                for i in finished:
+                    if i not in running:
+                        continue
+                    running.remove(i)
+                    unit_failed = False
+                    for step, result in zip(units[i], self._load(i, units)):
+                        if isinstance(result, Exception):
+                            failures[step._name] = result
+                            unit_failed = True
+                        else:
+                            results[step._name] = result
+                    for d in dependents.get(i, []):
+                        if unit_failed:
+                            self._skip(d, waiting, dependents, units,
+                                       failures)
+                        elif d in waiting:
+                            waiting[d].discard(i)
+                if not finished and running:
+                    if time.time() >= next_check:
+                        self._check_workers()
+                        next_check = time.time() + self.check_interval
+                    time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+
+        if len(failures) > 0:
+            e = PipelineException("Pilot execution failed for: %s" %
+                                  (", ".join(sorted(failures.keys()))))
+            e.failures = failures
+            raise e
+        return results
+
+    def stop(self, wait=True):
+        """Signal the workers to exit once the task queue is empty and,
+        if wait is True, wait for local workers to finish
+        """
+        if os.path.exists(self.directory):
+            open(self._stop_file(), 'w').close()
+        if wait:
+            for process in self._processes:
+                process.wait()
+        self._processes = []
+
+    def _units(self, pipeline):
+        """Split the steps that are not done into execution units and
+        return a tuple of the list of units, each a list of steps, and a
+        dictionary from the unit index to the indexes of the units it
+        depends on
+        """
+        steps = [s for s in pipeline.get_sorted_tools() if not s.is_done()]
+        units = []
+        unit_of = {}
+        if self.fuse:
+            for chain in pipeline.get_linear_chains(steps):
+                for step in chain:
+                    unit_of[step] = len(units)
+                units.append(chain)
+        for step in steps:
+            if step not in unit_of:
+                unit_of[step] = len(units)
+                units.append([step])
+        unit_deps = {}
+        for i, unit in enumerate(units):
+            deps = set([])
+            for step in unit:
+                for d in step.get_dependencies():
+                    if d in unit_of and unit_of[d] != i:
+                        deps.add(unit_of[d])
+            unit_deps[i] = deps
+        return units, unit_deps
+
+    def _skip(self, unit, waiting, dependents, units, failures):
+        """Remove the unit and all its descendants from the waiting
+        units and record them as failed
+        """
+        from jip.tools import ToolException
+        if unit not in waiting:
+            return
+        del waiting[unit]
+        for step in units[unit]:
+            failures[step._name] = ToolException(
+                "Step %s not executed, a dependency failed" % step._name)
+        for d in dependents.get(unit, []):
+            self._skip(d, waiting, dependents, units, failures)
+
+    def _enqueue(self, index, unit):
+        """Write the task for the given unit to the task queue"""
+        from jip.remote import _encode_payload, _ToolWrapper, _ToolChain
+        wrappers = [_ToolWrapper(s._tool, s.get_configuration())
+                    for s in unit]
+        payload = wrappers[0] if len(wrappers) == 1 else \
+            _ToolChain(wrappers)
+        name = "%d.task" % index
+        tmp = os.path.join(self.directory, name + ".tmp")
+        with open(tmp, 'wb') as task_file:
+            task_file.write(_encode_payload(payload))
+        os.rename(tmp, os.path.join(self.directory, "tasks", name))
+
+    def _finished(self):
+        """Return the indexes of all units with results"""
+        done = os.path.join(self.directory, "done")
+        return [int(f.split(".")[0]) for f in os.listdir(done)
+                if f.endswith(".result")]
+
+    def _load(self, index, units):
+        """Load and remove the results of the given unit and return
+        them as a list with one entry per step
+        """
+        from jip.remote import _decode_payload
+        path = os.path.join(self.directory, "done", "%d.result" % index)
+        with open(path, 'rb') as result_file:
+            result, info = _decode_payload(result_file.read())
+        os.remove(path)
+        if len(units[index]) == 1:
+            return [result]
+        if not isinstance(result, list):
+            # the task failed as a whole, fail all steps of the chain
+            return [result] * len(units[index])
+        return result
+
+    def _start_workers(self):
+        """Start the local worker processes or submit the worker jobs"""
+        if self.cluster is None:
+            import subprocess
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join(sys.path)
+            for i in range(self.workers):
+                name = "worker-%d" % i
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "jip.pilot", self.directory,
+                     name], env=env)
+                self._processes.append(process)
+                self._workers[name] = process
+        else:
+            from jip.tools import Job
+            job = self.job
+            if job is None:
+                job = Job()
+                job.name = "jip-pilot"
+            for i in range(self.workers):
+                name = "worker-%d" % i
+                script = "\npython -m jip.pilot %s %s\n" % (self.directory,
+                                                           name)
+                feature = self.cluster._submit_job(script, job, None)
+                self._features.append(feature)
+                self._workers[name] = feature
+
+    def _check_workers(self):
+        """Requeue the tasks of workers that exited and raise an
+        exception if no worker is alive
+        """
+        from jip.pipelines import PipelineException
+        if self.cluster is None:
+            alive = [n for n, p in self._workers.items()
+                     if p.poll() is None]
+        else:
+            jobs = self.cluster.list() or {}
+            alive = [n for n, f in self._workers.items()
+                     if str(f.jobid) in jobs]
+        self._requeue(alive)
+        if len(alive) == 0:
+            raise PipelineException("All pilot workers exited with tasks "
+                                    "left in %s" % self.directory)
+
+    def _requeue(self, alive):
+        """Put the claimed tasks of started workers that are not alive
+        back into the task queue. A task whose worker exits a second time
+        is failed instead, so a task that kills its worker is not
+        retried forever. Tasks of workers that were not started by this
+        pilot are left alone.
+
+        Parameter
+        ---------
+        alive -- names of the workers that are alive
+        """
+        from jip.remote import _write_result
+        from jip.tools import ToolException
+        running = os.path.join(self.directory, "running")
+        for name in os.listdir(running):
+            index, worker = name.split(".", 1)
+            if worker not in self._workers or worker in alive:
+                continue
+            path = os.path.join(running, name)
+            result = os.path.join(self.directory, "done",
+                                  "%s.result" % index)
+            if os.path.exists(result):
+                # the worker exited after writing the result
+                os.remove(path)
+            elif index in self._requeued:
+                _write_result(result, ToolException(
+                    "Pilot worker %s exited while running task %s" %
+                    (worker, index)), {"worker": worker})
+                os.remove(path)
+            else:
+                self._requeued.add(index)
+                os.rename(path, os.path.join(self.directory, "tasks",
+                                             "%s.task" % index))
+
+    def _stop_file(self):
+        return os.path.join(self.directory, "stop")
+
+
+def _claim(directory, worker):
+    """Claim the next task and return the path to the claimed task file
+    or None if no task is available
+    """
+    tasks = os.path.join(directory, "tasks")
+    for name in sorted(os.listdir(tasks)):
+        if not name.endswith(".task"):
+            continue
+        target = os.path.join(directory, "running",
+                              "%s.%s" % (name[:-5], worker))
+        try:
+            os.rename(os.path.join(tasks, name), target)
+            return target
+        except OSError:
+            # claimed by another worker
+            continue
+    return None
+
+
+def worker(directory, poll_interval=0.5, idle_timeout=None, name=None):
+    """Run a pilot worker that pulls tasks from the given queue
+    directory until the stop file is found and no task is left, or the
+    worker was idle for idle_timeout seconds. Returns the number of
+    executed tasks.
+
+    :param directory: the queue directory
+    :param poll_interval: interval in seconds in which the queue is checked
+    :param idle_timeout: optional idle time in seconds after which the
+                         worker exits
+    :param name: the worker name. Defaults to the host name and the
+                 process id
+    """
+    from jip.remote import _decode_payload, _write_result
+    from jip.tools import wait_listeners
+    if name is None:
+        name = "%s-%d" % (os.uname()[1], os.getpid())
+    executed = 0
+    idle_since = time.time()
+    while True:
+        task = _claim(directory, name)
+        if task is None:
+            if os.path.exists(os.path.join(directory, "stop")):
+                break
+            if idle_timeout is not None and \
+                    time.time() - idle_since > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+        start = time.time()
+        try:
+            with open(task, 'rb') as task_file:
+                payload = _decode_payload(task_file.read())
+            result = payload.run()
+        except Exception, e:
+            sys.stderr.write("Error while executing task %s: %s\n" %
+                             (task, str(e)))
+            result = e
+        info = {"host": os.uname()[1], "pid": os.getpid(), "worker": name,
+                "start": start, "end": time.time()}
+        index = os.path.basename(task).split(".")[0]
+        _write_result(os.path.join(directory, "done", "%s.result" % index),
+                      result, info)
+        os.remove(task)
+        executed += 1
+        idle_since = time.time()
+    # finish pending background listener calls before the worker exits
+    wait_listeners()
+    return executed
+
+
+if __name__ == "__main__":
+    worker(sys.argv[1], name=sys.argv[2] if len(sys.argv) > 2 else None)
@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 """Another tool pipeline implementation to create pipelines of tools.
 """
+import logging
+import math
+import os
+import time
 from functools import reduce
-from jip.tools import ValidationException
+from jip import instrumentation
+from jip.tools import ValidationException, _parse_minutes, \
+    wait_listeners, _GROUP_JOB_ATTRIBUTES
 
 
 class PipelineException(Exception):
@@ -65,6 +71,12 @@ class Pipeline(object):
     def __init__(self, name=None):
         self.tools = {}
         self.name = name
+        # the features of the submitted steps by step name
+        self.features = {}
+        # the resource usage of the executed steps by step name
+        self.resource_usage = {}
+        # the start and end times of the executed steps by step name
+        self.timings = {}
 
     def add(self, tool, name=None):
         """Add a tool to the pipeline. The method returns the tool
@@ -146,25 +158,651 @@ class Pipeline(object):
             tool = self.tools[tool]
         return tool.get_configuration()
 
-    def run(self):
-        """Get the pipeline tools in order and execute them"""
+    def run(self, trace=None):
+        """Get the pipeline tools in order and execute them
+
+        The resource usage of the executed steps is stored in the
+        `resource_usage` dictionary, see :py:meth:`get_resource_usage`,
+        and their start and end times in the `timings` dictionary, see
+        :py:func:`jip.analysis.analyze`.
+
+        If a trace is given, the timeline of the run is recorded. Steps
+        are queued when their last dependency finished. The trace file is
+        written even if a step fails. See :py:mod:`jip.trace`.
+
+        The method returns once all calls of background listeners
+        finished, see :py:class:`jip.tools.background`.
+
+        Parameter
+        ---------
+        trace - optional path to the trace file or a
+                :py:class:`jip.trace.Trace` that records the run
+        """
+        tracer = _tracer(trace)
         steps = self.get_sorted_tools()
-        for i, step in enumerate(steps):
-            if not step.is_done():
-                step.run()
+        start = time.time()
+        finished = {}
+        try:
+            for i, step in enumerate(steps):
+                if step.is_done():
+                    instrumentation.count(instrumentation.EVENT_CACHED, step)
+                    continue
+                queued = max([finished.get(d, start)
+                              for d in step.get_dependencies()] + [start])
+                started = time.time()
+                failed = True
+                try:
+                    step.run()
+                    failed = False
+                finally:
+                    finished[step] = time.time()
+                    instrumentation.count(instrumentation.EVENT_FAILED
+                                          if failed else
+                                          instrumentation.EVENT_COMPLETED,
+                                          step)
+                    self.timings[step._name] = (started, finished[step])
+                    # tools pickled by older versions have no usage
+                    usage = getattr(step._tool, "resource_usage", None)
+                    if usage is not None:
+                        self.resource_usage[step._name] = usage
+                    if tracer is not None:
+                        tracer.add(step, queued, started, finished[step],
+                                   worker="pid %d" % os.getpid(),
+                                   failed=failed)
+        finally:
+            wait_listeners()
+            if tracer is not None and tracer is not trace:
+                tracer.save(trace)
 
-    def submit(self, grid):
+    def submit(self, grid, hold=False, pack_time=None, pack_size=32,
+               pack_slots=1, fuse=False, max_jobs=None, journal=None,
+               check_interval=60, history=None):
         """Simple submission wrapper that sends this pipeline to the given
         cluster implementation and returns a list of jobs
 
+        If hold is True, all steps are submitted in held state and the
+        whole pipeline is released with a single batched release call once
+        all dependencies are wired. This avoids that upstream jobs finish
+        before their dependent jobs are submitted. If the submission fails,
+        the already submitted jobs stay on hold.
+
+        If pack_time is specified, independent steps whose job max_time is
+        set and not larger than pack_time minutes are packed into a
+        single cluster job. See :py:meth:`jip.cluster.Cluster.submit_packed`.
+
+        If fuse is True, maximal linear chains of steps with compatible job
+        settings are submitted as a single cluster job that runs the steps
+        back to back. See :py:meth:`get_linear_chains` and
+        :py:meth:`jip.cluster.Cluster.submit_chain`.
+
+        If max_jobs is specified, the pipeline is submitted in throttled
+        streaming mode. At most max_jobs jobs of the pipeline are queued or
+        running at any time, tracked through the clusters list of active
+        jobs, and further steps are submitted as earlier jobs drain. In this
+        mode the call blocks until all steps are submitted and the cluster
+        is checked at most once per check_interval. Dependencies on jobs
+        that left the queue are dropped if the job succeeded, as reported
+        by its result file or the job accounting, or if the outputs of the
+        step exist. If the state of the job is not known, the dependency is
+        passed on to the grid engine. Steps that depend on a failed job are
+        not submitted, together with all their descendants, and a
+        PipelineException is raised once all other steps are submitted.
+        The exceptions `skipped` attribute lists the names of the skipped
+        steps and its `features` attribute the features of the submitted
+        steps.
+
+        If a journal is given, every submission is recorded in the journal
+        and steps whose recorded jobs are still queued or running are
+        adopted instead of submitted again. This allows to restart an
+        interrupted submission. If the pipeline is submitted on hold,
+        adopted jobs that are still queued are released together with the
+        new jobs. See :py:class:`jip.journal.SubmissionJournal`.
+
+        If a history is given, the max_mem, max_time and threads of the
+        steps jobs are adjusted to the resources used by previous runs of
+        the same tools before the steps are grouped and submitted. See
+        :py:class:`jip.history.ResourceHistory`.
+
+        The returned list always contains one feature per submitted step.
+        The features are also stored in the `features` dictionary by step
+        name.
+
+        Parameter
+        ---------
+        grid - the cluster instance
+        hold - submit held and release the pipeline when all steps
+               are submitted
+        pack_time - maximum wall clock time in minutes of steps that are
+                    packed
+        pack_size - maximum number of steps packed into a single job
+        pack_slots - number of cpu slots requested by packed jobs
+        fuse - fuse linear chains into single jobs
+        max_jobs - maximum number of queued or running jobs
+        journal - :py:class:`jip.journal.SubmissionJournal` or the path
+                  to the journal file
+        check_interval - interval in seconds in which the cluster is
+                         checked for finished jobs in streaming mode
+        history - :py:class:`jip.history.ResourceHistory` used to adjust
+                  the steps resource requests
         """
-        steps = self.get_sorted_tools()
+        if isinstance(journal, basestring):
+            from jip.journal import SubmissionJournal
+            journal = SubmissionJournal(journal)
+        if journal is not None:
+            journal.reconcile(grid)
+        if max_jobs is not None:
+            if hold:
+                raise PipelineException("Throttled submission can not be "
+                                        "combined with hold")
+            return self._submit_throttled(grid, max_jobs, journal,
+                                          check_interval, pack_time,
+                                          pack_size, pack_slots, fuse,
+                                          history)
+        features = []
+        # jobs that are released after a submission on hold
+        held = []
+        try:
+            for kind, group in self._submission_groups(pack_time, pack_size,
+                                                       fuse, history):
+                adopted = self._adopt_group(group, journal)
+                if adopted is not None:
+                    features.extend(adopted)
+                    if adopted[0].jobid in journal.queued:
+                        held.extend(adopted)
+                    continue
+                submitted = self._submit_group(grid, kind, group, pack_slots,
+                                               hold=hold, journal=journal)
+                features.extend(submitted)
+                held.extend(submitted)
+        except Exception:
+            if hold and len(held) > 0:
+                self.log().error("Pipeline submission failed. The following"
+                                 " jobs are on hold: %s",
+                                 ",".join(_unique_jobids(held)))
+            raise
+        if hold and len(held) > 0:
+            grid.release(_unique_jobids(held))
+        return features
+
+    def collect(self, grid, check_interval=360, trace=None):
+        """Wait for the jobs of the submitted steps and yield tuples of
+        the step and its result in the order in which the jobs finish.
+        Once all jobs are collected, a ClusterException is raised if any
+        step failed. See :py:meth:`jip.cluster.Cluster.collect`.
+
+        The resource usage reported by the jobs is stored in the
+        `resource_usage` dictionary, see :py:meth:`get_resource_usage`,
+        and the start and end times of the steps in the `timings`
+        dictionary, see :py:func:`jip.analysis.analyze`.
+
+        If a trace is given, the timeline of the steps is recorded from
+        the submission times and the runtime information reported by the
+        jobs. The trace file is written once all jobs are collected. See
+        :py:mod:`jip.trace`.
+
+        Parameter
+        ---------
+        grid - the cluster instance
+        check_interval - interval in seconds in which the job states are
+                         checked
+        trace - optional path to the trace file or a
+                :py:class:`jip.trace.Trace` that records the run
+        """
+        tracer = _tracer(trace)
+        steps = dict((feature, self.tools[name])
+                     for name, feature in self.features.items())
+        try:
+            for feature, result in grid.collect(
+                    steps.keys(), check_interval=check_interval):
+                self._collected(steps[feature], feature, tracer)
+                yield steps[feature], result
+        except Exception, e:
+            for feature in getattr(e, "failures", {}):
+                self._collected(steps[feature], feature, tracer, failed=True)
+            raise
+        finally:
+            if tracer is not None and tracer is not trace:
+                tracer.save(trace)
+
+    def _collected(self, step, feature, tracer, failed=False):
+        """Record the timings, the resource usage and the trace of a
+        collected step
+        """
+        run = feature.get_run_info()
+        if run is not None:
+            self.timings[step._name] = (run["start"], run["end"])
+            if run.get("resource_usage") is not None:
+                self.resource_usage[step._name] = run["resource_usage"]
+        if tracer is not None:
+            tracer.add_feature(step, feature, failed=failed)
+
+    def get_resource_usage(self):
+        """Return the aggregated resource usage of the executed steps.
+        The returned dictionary contains the number of `steps` with
+        recorded usage, the sums of the `wall_time`, `user_time`,
+        `system_time`, block operations and context switches and the
+        maximum `max_rss` over all steps. The name of the step with the
+        largest `max_rss` is stored as `max_rss_step`. See
+        :py:func:`jip.tools._wait` for the recorded values.
+        """
+        total = {"steps": len(self.resource_usage), "max_rss": 0,
+                 "max_rss_step": None}
+        for name, usage in sorted(self.resource_usage.items()):
+            for key, value in usage.items():
+                if key == "max_rss":
+                    if value > total["max_rss"]:
+                        total["max_rss"] = value
+                        total["max_rss_step"] = name
+                else:
+                    total[key] = total.get(key, 0) + value
+        return total
+
+    def supervise(self, grid, max_retries=3, mem_factor=2.0,
+                  time_factor=2.0, check_interval=360):
+        """Wait for the submitted steps of the pipeline and resubmit steps
+        that failed because they exceeded their memory or time limit or
+        because of a node failure. Failures are classified using the job
+        accounting, see :py:meth:`jip.cluster.JobAccounting.classify`.
+
+        A failed step is resubmitted as a single job, together with all
+        its descendants that did not finish yet. The jobs of the
+        descendants are cancelled first. Memory failures multiply the
+        steps max_mem by mem_factor and time failures multiply max_time by
+        time_factor. If the limit is not set, the usage reported by the job
+        accounting is escalated, with the memory divided by the number of
+        threads, as max_mem is requested per cpu. Steps are retried at most
+        max_retries times.
+
+        Returns a dictionary from the step names to the step results.
+        If steps could not be completed, a PipelineException is raised.
+        The exceptions `failures` attribute is a dictionary from the
+        names of the failed steps to the errors.
+
+        Parameter
+        ---------
+        grid - the cluster instance the pipeline was submitted to
+        max_retries - maximum number of retries per step
+        mem_factor - factor applied to max_mem after memory failures
+        time_factor - factor applied to max_time after time failures
+        check_interval - interval in seconds in which the job states are
+                         checked
+        """
+        from jip.cluster import FAILURE_OOM, FAILURE_TIMEOUT
+        from jip.tools import ToolException
+        if len(self.features) == 0:
+            raise PipelineException("The pipeline was not submitted")
+        order = dict((s, i) for i, s in enumerate(self.get_sorted_tools()))
+        pending = dict(self.features)
+        results = {}
+        failures = {}
+        retries = {}
+        while pending:
+            started = instrumentation.start()
+            active = grid.list() or {}
+            instrumentation.stop(instrumentation.PHASE_POLL, None, started)
+            finished = [n for n, f in pending.items()
+                        if str(f.jobid) not in active]
+            if len(finished) == 0:
+                time.sleep(check_interval)
+                continue
+            failed = {}
+            for name in finished:
+                feature = pending.pop(name)
+                try:
+                    result = feature.load()
+                    if isinstance(result, Exception):
+                        raise result
+                    results[name] = result
+                    instrumentation.count(instrumentation.EVENT_COMPLETED,
+                                          self.tools[name])
+                except Exception, e:
+                    failed[name] = (feature, e)
+                    instrumentation.count(instrumentation.EVENT_FAILED,
+                                          self.tools[name])
+                feature.release(grid)
+            if len(failed) == 0:
+                continue
+
+            accounting = grid.accounting([f.jobid for f, e in
+                                          failed.values()])
+            redo = set([])
+            for step in sorted([self.tools[n] for n in failed],
+                               key=lambda s: order[s]):
+                if step in redo:
+                    continue
+                feature, error = failed[step._name]
+                job = accounting.get(str(feature.jobid))
+                reason = job.classify() if job is not None else None
+                descendants = self._descendants(step, results, failures)
+                if reason is None or \
+                        retries.get(step._name, 0) >= max_retries:
+                    failures[step._name] = error
+                    for d in descendants:
+                        failures.setdefault(d._name, ToolException(
+                            "Step %s not executed, dependency %s failed" %
+                            (d._name, step._name)))
+                        redo.add(d)
+                    self._cancel(grid, descendants, pending)
+                    continue
+                retries[step._name] = retries.get(step._name, 0) + 1
+                self.log().warn("Step %s failed with %s, retry %d of %d",
+                                step._name, reason, retries[step._name],
+                                max_retries)
+                if reason == FAILURE_OOM:
+                    # max_mem is requested per cpu, the observed usage is
+                    # the total of the job
+                    step.job.max_mem = _escalate(
+                        step.job.max_mem, mem_factor,
+                        job.max_rss / (1024.0 * 1024.0 *
+                                       (step.job.threads or 1))
+                        if job.max_rss else None)
+                elif reason == FAILURE_TIMEOUT:
+                    step.job.max_time = _escalate(
+                        _parse_minutes(step.job.max_time), time_factor,
+                        job.elapsed / 60.0 if job.elapsed else None)
+                self._cancel(grid, descendants, pending)
+                resubmit = [step] + descendants
+                redo.update(resubmit)
+                jobids = {}
+                for s in sorted(resubmit, key=lambda s: order[s]):
+                    deps = [str(d.job.jobid) for d in s.get_dependencies()
+                            if d in jobids or d._name in pending]
+                    pending[s._name] = self._submit_group(
+                        grid, "single", [s], 1, dependencies=deps)[0]
+                    jobids[s] = s.job.jobid
+                    failures.pop(s._name, None)
+
+        if len(failures) > 0:
+            e = PipelineException("Pipeline execution failed for: %s" %
+                                  (", ".join(sorted(failures.keys()))))
+            e.failures = failures
+            raise e
+        return results
+
+    def _descendants(self, step, results, failures):
+        """Return all steps that depend directly or indirectly on the
+        given step and neither have a result nor failed, in execution order
+        """
+        found = []
+        for candidate in self.get_sorted_tools():
+            if candidate._name in results or candidate._name in failures:
+                continue
+            deps = candidate.get_dependencies()
+            if step in deps or any(d in deps for d in found):
+                found.append(candidate)
+        return found
+
+    def _cancel(self, grid, steps, pending):
+        """Cancel the pending jobs of the given steps and remove them from
+        the pending features
+        """
+        features = [pending.pop(s._name) for s in steps if s._name in pending]
+        if len(features) == 0:
+            return
+        try:
+            grid.cancel(_unique_jobids(features))
+        except Exception, e:
+            self.log().warn("Unable to cancel jobs: %s", str(e))
+
+    def get_accounting(self, grid):
+        """Return a dictionary from the names of all submitted steps to
+        the :py:class:`jip.cluster.JobAccounting` of their jobs. The
+        accounting of all jobs is fetched with a single call to
+        :py:meth:`jip.cluster.Cluster.accounting`. Steps without job id or
+        accounting information are not included. Steps that were packed
+        or fused into one job share the accounting of the job.
+
+        Parameter
+        ---------
+        grid - the cluster instance
+        """
+        steps = [s for s in self.get_sorted_tools() if s.job.jobid is not None]
+        jobs = grid.accounting([s.job.jobid for s in steps])
+        return dict((s._name, jobs[str(s.job.jobid)]) for s in steps
+                    if str(s.job.jobid) in jobs)
+
+    def _submit_throttled(self, grid, max_jobs, journal, check_interval,
+                          pack_time, pack_size, pack_slots, fuse, history):
+        """Submit the pipeline keeping at most max_jobs jobs queued or
+        running. See :py:meth:`submit`.
+        """
+        active = set([])
         features = []
-        for i, step in enumerate(steps):
-            if not step.is_done():
-                features.append(grid.submit(step, step.get_configuration()))
+        skipped = set([])
+        # success of the dependencies that left the queue by step
+        finished = {}
+        polled = 0
+        for kind, group in self._submission_groups(pack_time, pack_size,
+                                                   fuse, history):
+            adopted = self._adopt_group(group, journal)
+            if adopted is not None:
+                features.extend(adopted)
+                active.add(str(adopted[0].jobid))
+                continue
+
+            # drop jobs that left the queue before they are used as
+            # dependencies, the grid engine rejects dependencies on jobs
+            # it does not know anymore. The queue is checked at most once
+            # per check_interval.
+            if time.time() - polled >= check_interval and \
+                    any(str(d.job.jobid) in active for step in group
+                        for d in step.get_dependencies() if d not in group):
+                active = self._active_jobs(grid, active)
+                polled = time.time()
+
+            # check the dependencies
+            deps = set([])
+            for step in group:
+                for d in step.get_dependencies():
+                    if d in skipped:
+                        deps = None
+                        break
+                    if d in group or d.job.jobid is None:
+                        continue
+                    if str(d.job.jobid) not in active and d not in finished:
+                        finished[d] = self._finished_state(grid, d)
+                    if str(d.job.jobid) in active or finished[d] is None:
+                        # let the grid engine resolve jobs of unknown state
+                        deps.add(str(d.job.jobid))
+                    elif not finished[d]:
+                        self.log().warn("Dependency %s of %s failed",
+                                        d._name, step._name)
+                        deps = None
+                        break
+                if deps is None:
+                    break
+            if deps is None:
+                self.log().warn("Skipping %s",
+                                ",".join(s._name for s in group))
+                skipped.update(group)
+                continue
+
+            # wait for a free slot
+            while len(active) >= max_jobs:
+                wait = polled + check_interval - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                active = self._active_jobs(grid, active)
+                polled = time.time()
+
+            submitted = self._submit_group(grid, kind, group, pack_slots,
+                                           dependencies=sorted(deps),
+                                           journal=journal)
+            features.extend(submitted)
+            active.add(str(submitted[0].jobid))
+        if len(skipped) > 0:
+            e = PipelineException("Steps not submitted because a "
+                                  "dependency failed: %s" % (", ".join(
+                                      sorted(s._name for s in skipped))))
+            e.skipped = sorted(s._name for s in skipped)
+            e.features = features
+            raise e
         return features
 
+    def _finished_state(self, grid, step):
+        """Return True if the job of a step that left the queue finished
+        successfully, False if it failed and None if this is not known.
+        The result file of the job is checked first, then the job
+        accounting and finally the outputs of the step.
+        """
+        from jip.cluster import ClusterException
+        feature = self.features.get(step._name)
+        if feature is not None and feature.result is not None and \
+                os.path.exists(feature.result):
+            try:
+                result = feature._load_result_file(feature.result)
+                if feature.index is not None and \
+                        not isinstance(result, Exception):
+                    result = result[feature.index]
+            except Exception:
+                return False
+            return not isinstance(result, Exception)
+        try:
+            job = grid.accounting([step.job.jobid]).get(str(step.job.jobid))
+        except ClusterException:
+            job = None
+        if job is not None and job.is_finished():
+            return job.state == "COMPLETED"
+        if step.is_done():
+            return True
+        return None
+
+    def _active_jobs(self, grid, jobids):
+        """Return the set of the given job ids that are still queued or
+        running on the cluster
+        """
+        started = instrumentation.start()
+        jobs = grid.list() or {}
+        instrumentation.stop(instrumentation.PHASE_POLL, None, started)
+        return set([j for j in jobids if j in jobs])
+
+    def _submit_group(self, grid, kind, group, pack_slots, hold=False,
+                      dependencies=None, journal=None):
+        """Submit a group of steps created by :py:meth:`_submission_groups`
+        and return the list of features. If a journal is given, the
+        submission is recorded.
+        """
+        if kind == "chain":
+            submitted = grid.submit_chain(group, hold=hold,
+                                          dependencies=dependencies)
+        elif kind == "pack":
+            submitted = grid.submit_packed(group, slots=pack_slots,
+                                           hold=hold,
+                                           dependencies=dependencies)
+        else:
+            submitted = [grid.submit(group[0], group[0].get_configuration(),
+                                     hold=hold, dependencies=dependencies)]
+        if journal is not None:
+            journal.record(group, submitted)
+        for step, feature in zip(group, submitted):
+            self.features[step._name] = feature
+        return submitted
+
+    def _adopt_group(self, group, journal):
+        """Adopt the job of a group of steps from the journal. Returns
+        the list of features if all steps of the group were submitted with
+        the same job and the job is still active, otherwise None.
+        """
+        if journal is None or len(journal.live) == 0:
+            return None
+        features = [journal.adopt(s) for s in group]
+        if None in features or len(_unique_jobids(features)) != 1:
+            return None
+        self.log().info("Adopting job %s for %s", features[0].jobid,
+                        ",".join(s._name for s in group))
+        for step, feature in zip(group, features):
+            self.features[step._name] = feature
+        return features
+
+    def _submission_groups(self, pack_time=None, pack_size=32, fuse=False,
+                           history=None):
+        """Yield the steps that are not done in submission order. Steps
+        are yielded as tuples of the group kind and the list of steps.
+        The kind is one of "single", "pack" or "chain". If pack_time is
+        set, independent steps with a max_time of at most pack_time
+        minutes are grouped in packs of at most pack_size steps. If fuse
+        is True, linear chains are grouped. If a resource history is
+        given, it is applied to the steps before they are grouped.
+        """
+        levels = []
+        for level in self._topological_sort():
+            levels.append([])
+            for step in level:
+                if step.is_done():
+                    instrumentation.count(instrumentation.EVENT_CACHED, step)
+                else:
+                    levels[-1].append(step)
+        if history is not None:
+            sizes = {}
+            for level in levels:
+                for step in level:
+                    history.apply(step, sizes)
+        chain_of = {}
+        if fuse:
+            todo = [s for level in levels for s in level]
+            for chain in self.get_linear_chains(todo):
+                for step in chain:
+                    chain_of[step] = chain
+        for level in levels:
+            short = []
+            for step in level:
+                if step in chain_of:
+                    # submit the chain with its first step
+                    if chain_of[step][0] is step:
+                        yield "chain", chain_of[step]
+                    continue
+                max_time = _parse_minutes(step.job.max_time)
+                if pack_time is not None and max_time is not None \
+                        and max_time <= pack_time:
+                    short.append(step)
+                else:
+                    yield "single", [step]
+            short.sort(key=lambda s: s._name)
+            for i in range(0, len(short), pack_size):
+                pack = short[i:i + pack_size]
+                yield "pack" if len(pack) > 1 else "single", pack
+
+    def get_linear_chains(self, steps=None):
+        """Return the maximal linear chains of steps as lists of steps in
+        execution order. Two steps are linked if the second step depends
+        only on the first, the first step is the only dependency of the
+        second and the job settings of both steps are compatible, i.e.
+        they would be submitted to the same queue with the same template,
+        header, working directory and extra parameters. Only chains of at
+        least two steps are returned.
+
+        Parameter
+        ---------
+        steps - optional list of steps in execution order. If specified,
+                only dependencies between these steps are considered.
+                Defaults to all steps
+        """
+        if steps is None:
+            steps = self.get_sorted_tools()
+        members = set(steps)
+        deps = {}
+        dependents = dict((s, []) for s in steps)
+        for step in steps:
+            deps[step] = [d for d in step.get_dependencies() if d in members]
+            for d in deps[step]:
+                dependents[d].append(step)
+
+        def linked(a, b):
+            return dependents[a] == [b] and deps[b] == [a] and \
+                _compatible_jobs(a.job, b.job)
+
+        chains = []
+        for step in steps:
+            if len(deps[step]) == 1 and linked(deps[step][0], step):
+                # not the head of a chain
+                continue
+            chain = [step]
+            while len(dependents[chain[-1]]) == 1 and \
+                    linked(chain[-1], dependents[chain[-1]][0]):
+                chain.append(dependents[chain[-1]][0])
+            if len(chain) > 1:
+                chains.append(chain)
+        return chains
 
     def get_sorted_tools(self):
         """Returns all tools in the pipeline in execution order. This does
@@ -243,10 +881,59 @@ class Pipeline(object):
         if len(cycles) > 0:
             raise CircularDependencyException(cycles[0])
 
+    def log(self):
+        """Get the pipeline logger"""
+        return logging.getLogger("%s.%s" % (self.__module__,
+                                            self.__class__.__name__))
+
     def __repr__(self):
         return self.name
 
 
+def _compatible_jobs(a, b):
+    """Returns true if the two jobs can be fused into a single job"""
+    for attr in _GROUP_JOB_ATTRIBUTES:
+        if getattr(a, attr) != getattr(b, attr):
+            return False
+    return True
+
+
+def _tracer(trace):
+    """Return the :py:class:`jip.trace.Trace` that records a run to the
+    given trace file or trace, or None if trace is None
+    """
+    if trace is None:
+        return None
+    from jip.trace import Trace
+    if isinstance(trace, Trace):
+        return trace
+    return Trace()
+
+
+def _escalate(value, factor, observed=None):
+    """Multiply the resource value by the given factor. If the value is
+    not set, the observed usage is escalated instead. Returns None if
+    neither is available.
+    """
+    if value is None:
+        value = observed
+    if value is None:
+        return None
+    return int(math.ceil(float(value) * factor))
+
+
+def _unique_jobids(features):
+    """Return the unique job ids of the given features, in order"""
+    jobids = []
+    seen = set([])
+    for feature in features:
+        jobid = str(feature.jobid)
+        if jobid not in seen:
+            seen.add(jobid)
+            jobids.append(jobid)
+    return jobids
+
+
 class PipelineTool(object):
     """ A pipeline tool is a wrapper around a given tool instance
     within a pipeline. The PipelineTool managed tool configuraiton and
@@ -329,6 +1016,7 @@ class PipelineTool(object):
 
     def get_configuration(self):
         """Return the fully resolved configuration for this tool"""
+        started = instrumentation.start()
         config = dict(self._tool._get_default_configuration())
         for name, value in self._kwargs.items():
             config[name] = value.get()
@@ -336,6 +1024,7 @@ class PipelineTool(object):
         # resolve
         config.update(self._tool._resolve(config))
         config["job"] = self._tool.job
+        instrumentation.stop(instrumentation.PHASE_RESOLVE, self, started)
         return config
 
     def get_raw_configuration(self):
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""The profiling module runs the `call()` method of tools in the python
+profiler and writes the statistics of every invocation to a `.pstats`
+file. Profiling is enabled per tool through the jobs `profile` setting::
+
+    tool.job.profile = True
+
+If profile is True, the statistics are written to the jobs log directory
+or to the current working directory if no log directory is set. If
+profile is a string, it is used as the target directory. Because the
+setting is part of the job, it also applies to tools that run on a
+cluster or in pilot workers. The remote bootstrap can enable profiling
+for all tools of a job with::
+
+    python -m jip.remote --profile <directory> <payload>
+
+The statistics files are named after the tool class, the host and the
+process id, so the files of all invocations of a tool class can be merged
+with :py:func:`merge`. Profiling is disabled by default and costs a single
+attribute check per tool run.
+"""
+import itertools
+import os
+
+from jip.instrumentation import subject_key
+
+# directory that the profiles of all tools are written to, see enable()
+directory = None
+
+# counter that makes the statistics file names unique within a process
+_counter = itertools.count()
+
+
+def enable(path):
+    """Profile all tools run by this process and write the statistics
+    to the given directory
+
+    :param path: the target directory
+    """
+    global directory
+    directory = path
+
+
+def disable():
+    """Stop profiling all tools. Tools whose job enables profiling are
+    still profiled.
+    """
+    global directory
+    directory = None
+
+
+def profile_call(tool, args, target=True):
+    """Run the call method of the given tool in the profiler, write the
+    statistics and return the result of the call. The statistics are
+    written even if the call fails.
+
+    :param tool: the :py:class:`jip.tools.Tool`
+    :param args: the tool configuration
+    :param target: the target directory or True to use the log directory
+                   of the tools job
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(tool.call, args)
+    finally:
+        profiler.dump_stats(stats_file(tool, target))
+
+
+def stats_file(tool, target=True):
+    """Return the path of a new statistics file of the given tool. The
+    target directory is created if it does not exist.
+
+    :param tool: the :py:class:`jip.tools.Tool`
+    :param target: the target directory or True to use the log directory
+                   of the tools job
+    """
+    if not isinstance(target, basestring):
+        target = tool.job.logdir or os.getcwd()
+    if not os.path.exists(target):
+        os.makedirs(target)
+    return os.path.join(target, "%s-%s-%d-%d.pstats" % (
+        subject_key(tool), os.uname()[1], os.getpid(), next(_counter)))
+
+
+def merge(path, output=None):
+    """Merge the statistics files in the given directory per tool class
+    and return a dictionary from the tool class names to the merged
+    :py:class:`pstats.Stats`. If an output directory is given, the merged
+    statistics are written to `<class name>.pstats` files in that
+    directory. Merged files are not picked up when merging again.
+
+    :param path: the directory that contains the statistics files
+    :param output: optional output directory
+    """
+    import pstats
+    files = {}
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".pstats") or "-" not in name:
+            continue
+        files.setdefault(name.split("-", 1)[0], []).append(
+            os.path.join(path, name))
+    merged = {}
+    for key, paths in files.items():
+        stats = pstats.Stats(paths[0])
+        for stats_path in paths[1:]:
+            stats.add(stats_path)
+        merged[key] = stats
+        if output is not None:
+            stats.dump_stats(os.path.join(output, "%s.pstats" % key))
+    return merged
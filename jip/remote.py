@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+"""The remote module is the bootstrap entry point that runs tools on the
+compute nodes of a cluster. Job scripts created by
+:py:class:`jip.cluster.Cluster` start it with::
+
+    python -m jip.remote [--result <result_file>] [--profile <directory>]
+                         [<payload_file>]
+
+The payload is loaded from the given file or, if no file is specified,
+from stdin. Payloads piped in on stdin might be base64 encoded. If a
+profile directory is given, all tools of the payload are run in the
+python profiler, see :py:mod:`jip.profiling`.
+
+The module is kept free of any heavy imports. Only the modules needed to
+decode the payload are loaded before the payload is un-pickled, which
+pulls in the tool implementation and its own imports. In particular,
+this module does not import :py:mod:`jip.cluster` or the mako template
+library.
+
+If a result file is specified, the result of the run is written to that
+file together with some runtime information, i.e. the bootstrap startup
+time, the execution host and the resource usage of interpreted tools.
+Otherwise the result is printed to stdout enclosed in the result separator
+lines.
+"""
+import os
+import sys
+import time
+import zlib
+import cPickle
+
+# result separator
+_SEP_RESULT = "-------------------RESULT-------------------"
+_SEP_RESULT_END = "-------------------END-RESULT-------------------"
+
+# payload header. Encoded payloads start with the magic string, followed
+# by a single digit format version and the compression flag
+_PAYLOAD_MAGIC = "JIP"
+_PAYLOAD_VERSION = 1
+_PAYLOAD_ZLIB = "z"
+_PAYLOAD_RAW = "-"
+
+# environment variable set by the job script to the time stamp
+# before the python interpreter is started
+_ENV_START = "JIP_BOOTSTRAP_START"
+
+
+def _encode_payload(obj, compress=True):
+    """Pickle the given object using the highest available pickle protocol
+    and return the binary payload string. The payload is prefixed with a
+    versioned header and zlib compressed unless compress is set to False.
+
+    :param obj: the object to encode
+    :param compress: compress the pickled data
+    """
+    data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+    flag = _PAYLOAD_RAW
+    if compress:
+        data = zlib.compress(data)
+        flag = _PAYLOAD_ZLIB
+    return "%s%d%s%s" % (_PAYLOAD_MAGIC, _PAYLOAD_VERSION, flag, data)
+
+
+def _decode_payload(data):
+    """Decode a payload string created by :py:func:`_encode_payload` and
+    return the un-pickled object. Strings without a payload header are
+    treated as plain pickles for backwards compatibility.
+
+    :param data: the payload string
+    """
+    if not data.startswith(_PAYLOAD_MAGIC):
+        return cPickle.loads(data)
+    header = len(_PAYLOAD_MAGIC)
+    version = int(data[header])
+    if version > _PAYLOAD_VERSION:
+        raise ValueError("Unsupported payload version %d" % version)
+    flag = data[header + 1]
+    data = data[header + 2:]
+    if flag == _PAYLOAD_ZLIB:
+        data = zlib.decompress(data)
+    return cPickle.loads(data)
+
+
+class _ToolWrapper(object):
+    """Internal class that wraps the tool and its arguments and is pickled
+    and send to the cluster. The instance is then un-pickled and runs the
+    tool when the job is executed on the cluster.
+    """
+
+    def __init__(self, tool, args):
+        """Initialize the wrapper with the tool and its arguments
+
+        :param tool: the tool instance
+        :param args: the tool arguments
+        """
+        self.tool = tool
+        self.args = args
+
+    def run(self):
+        """Run the tool and catch any exception raised by the tool
+        execution. If an exception is raised, it is logged and then
+        returned as results. This allows the :py:class:Feature to pick
+        up any exceptions raised in remote execution.
+        """
+        try:
+            result = self.tool.run(self.args)
+            return result
+        except Exception, e:
+            sys.stderr.write("Error while executing job: %s\n" % str(e))
+            return e
+
+
+def _run_wrapper(wrapper):
+    """Run a single wrapper and return a tuple of the result and the
+    runtime information of the run. This is used as the pool function
+    for packed tools. Pool processes exit without waiting for their
+    background listeners, so pending listener calls are finished before
+    the function returns.
+    """
+    from jip.tools import wait_listeners
+    start = time.time()
+    result = wrapper.run()
+    info = {"host": os.uname()[1], "pid": os.getpid(),
+            "start": start, "end": time.time(),
+            "resource_usage": getattr(wrapper.tool, "resource_usage", None)}
+    wait_listeners()
+    return result, info
+
+
+class _ToolPack(object):
+    """Internal class that wraps a list of independent tools that are
+    executed within a single cluster job. The tools are executed in
+    parallel in separate processes, using at most `slots` cpu slots.
+    Each tool occupies as many slots as its job requests threads. The
+    result is the list of the tool results, where failed tools
+    contribute their exception. The runtime information of the tools is
+    stored in the `steps` list.
+    """
+
+    def __init__(self, wrappers, slots=1):
+        """Initialize the pack
+
+        :param wrappers: list of :py:class:`_ToolWrapper` instances
+        :param slots: number of available cpu slots
+        """
+        self.wrappers = wrappers
+        self.slots = slots
+        self.steps = None
+
+    def run(self):
+        """Run all tools and return the list of results"""
+        threads = max([w.tool.job.threads or 1 for w in self.wrappers])
+        parallel = min(max(1, self.slots // threads), len(self.wrappers))
+        if parallel == 1:
+            runs = [_run_wrapper(w) for w in self.wrappers]
+        else:
+            from multiprocessing import Pool
+            pool = Pool(parallel)
+            try:
+                runs = pool.map(_run_wrapper, self.wrappers, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        self.steps = [info for result, info in runs]
+        return [result for result, info in runs]
+
+    def failed(self, result):
+        """Returns true if any of the tools failed"""
+        return any(isinstance(r, Exception) for r in result)
+
+
+class _ToolChain(object):
+    """Internal class that wraps a linear chain of tools that are
+    executed one after another within a single cluster job. The chain
+    stops at the first failing tool. The result is the list of the tool
+    results, where failed and skipped tools contribute an exception. The
+    runtime information of the tools is stored in the `steps` list and is
+    None for skipped tools.
+    """
+
+    def __init__(self, wrappers):
+        """Initialize the chain
+
+        :param wrappers: list of :py:class:`_ToolWrapper` instances in
+                         execution order
+        """
+        self.wrappers = wrappers
+        self.steps = None
+
+    def run(self):
+        """Run the tools in order and return the list of results"""
+        results = []
+        self.steps = []
+        failed = None
+        for wrapper in self.wrappers:
+            if failed is not None:
+                from jip.tools import ToolException
+                results.append(ToolException("Tool %s not executed, "
+                                             "upstream tool %s failed" %
+                                             (wrapper.tool.name, failed)))
+                self.steps.append(None)
+                continue
+            result, info = _run_wrapper(wrapper)
+            if isinstance(result, Exception):
+                failed = wrapper.tool.name
+            results.append(result)
+            self.steps.append(info)
+        return results
+
+    def failed(self, result):
+        """Returns true if any of the tools failed"""
+        return any(isinstance(r, Exception) for r in result)
+
+
+class _StepDriver(object):
+    """Internal class that runs a set of tools with dependencies inside
+    a single cluster allocation. Each tool is started as a separate job
+    step using the `srun` command as soon as all the tools it depends on
+    finished successfully. Tools that depend on a failed tool are not
+    executed. The result is the list of the tool results, where failed
+    and skipped tools contribute an exception. The runtime information
+    reported by the steps is stored in the `steps` list.
+
+    The tool payloads and results are stored in a folder in the given
+    work directory.
+    """
+
+    def __init__(self, wrappers, names, dependencies, workdir,
+                 srun="srun"):
+        """Initialize the driver
+
+        :param wrappers: list of :py:class:`_ToolWrapper` instances in
+                         execution order
+        :param names: list of step names
+        :param dependencies: list of lists of indexes of the tools
+                             each tool depends on
+        :param workdir: the work directory
+        :param srun: the srun command. If None, steps are started as
+                     plain sub-processes
+        """
+        self.wrappers = wrappers
+        self.names = names
+        self.dependencies = dependencies
+        self.workdir = workdir
+        self.srun = srun
+        self.steps = None
+
+    def _command(self, index, payload_file, result_file):
+        """Create the command that runs the step with the given index"""
+        job = self.wrappers[index].tool.job
+        cmd = []
+        if self.srun is not None:
+            cmd = [self.srun, "-n", "1", "-c", str(job.threads or 1),
+                   "--exclusive", "-J", self.names[index]]
+            if job.max_mem is not None:
+                cmd.append("--mem-per-cpu=%s" % job.max_mem)
+        from jip import profiling
+        cmd += [sys.executable, "-m", "jip.remote", "--result", result_file]
+        if profiling.directory is not None:
+            cmd += ["--profile", profiling.directory]
+        return cmd + [payload_file]
+
+    def run(self):
+        """Run all tools and return the list of results"""
+        import subprocess
+        from jip.tools import ToolException
+        jobid = os.getenv("SLURM_JOB_ID", str(os.getpid()))
+        folder = os.path.join(self.workdir, "jip-%s-steps" % jobid)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        results = [None] * len(self.wrappers)
+        self.steps = [None] * len(self.wrappers)
+        succeeded = set([])
+        failed = set([])
+        pending = range(len(self.wrappers))
+        running = {}
+        while pending or running:
+            for i in list(pending):
+                deps = self.dependencies[i]
+                if any(d in failed for d in deps):
+                    pending.remove(i)
+                    failed.add(i)
+                    results[i] = ToolException(
+                        "Tool %s not executed, a dependency failed" %
+                        (self.names[i]))
+                elif all(d in succeeded for d in deps):
+                    pending.remove(i)
+                    payload_file = os.path.join(folder, "%d.payload" % i)
+                    result_file = os.path.join(folder, "%d.result" % i)
+                    with open(payload_file, 'wb') as out:
+                        out.write(_encode_payload(self.wrappers[i]))
+                    process = subprocess.Popen(self._command(i, payload_file,
+                                                             result_file))
+                    running[process.pid] = (i, process, result_file)
+            if not running:
+                continue
+            pid, status = os.wait()
+            if pid not in running:
+                continue
+            i, process, result_file = running.pop(pid)
+            process.returncode = status
+            try:
+                with open(result_file, 'rb') as result_data:
+                    results[i], self.steps[i] = _decode_payload(
+                        result_data.read())
+            except IOError:
+                results[i] = ToolException("Step %s failed with status %d" %
+                                           (self.names[i], status))
+            if isinstance(results[i], Exception):
+                failed.add(i)
+            else:
+                succeeded.add(i)
+        return results
+
+    def failed(self, result):
+        """Returns true if any of the tools failed"""
+        return any(isinstance(r, Exception) for r in result)
+
+
+def _write_result(path, result, info):
+    """Write the encoded result and the runtime info to the given
+    result file. The data is written to a temporary file first and moved
+    in place, so readers never see partial results.
+    """
+    tmp = "%s.tmp" % path
+    with open(tmp, 'wb') as result_file:
+        result_file.write(_encode_payload((result, info)))
+    os.rename(tmp, path)
+
+
+def _print_result(result):
+    """Print the encoded result to stdout, enclosed in the
+    result separator lines
+    """
+    sys.stdout.write("%s\n%s\n%s\n" % (_SEP_RESULT,
+                                       _encode_payload(result).encode(
+                                           "base64"),
+                                       _SEP_RESULT_END))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    """Load the payload, run it and store the result. Returns the
+    exit code of the run, which is 1 if the run raised an exception.
+
+    :param argv: the command line arguments without the program name
+    """
+    start = time.time()
+    if argv is None:
+        argv = sys.argv[1:]
+    result_file = None
+    payload_file = None
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == "--result":
+            result_file = args.pop(0)
+        elif arg == "--profile":
+            from jip import profiling
+            profiling.enable(args.pop(0))
+        else:
+            payload_file = arg
+
+    # load the payload
+    if payload_file is not None:
+        with open(payload_file, 'rb') as source:
+            data = source.read()
+    else:
+        data = sys.stdin.read()
+        if not data.startswith(_PAYLOAD_MAGIC):
+            data = data.decode("base64")
+    payload = _decode_payload(data)
+    loaded = time.time()
+
+    info = {"host": os.uname()[1],
+            "pid": os.getpid(),
+            "start": loaded,
+            "load": loaded - start,
+            "startup": None}
+    if os.getenv(_ENV_START):
+        try:
+            info["startup"] = start - float(os.getenv(_ENV_START))
+        except ValueError:
+            pass
+    sys.stderr.write("jip.remote: startup %s, payload loaded in %.3fs\n" %
+                     ("%.3fs" % info["startup"]
+                      if info["startup"] is not None else "unknown",
+                      info["load"]))
+
+    result = payload.run()
+    info["end"] = time.time()
+    # finish the background listener calls before the process exits
+    from jip.tools import wait_listeners
+    wait_listeners()
+    if getattr(payload, "steps", None) is not None:
+        # runtime information of the tools of a group payload
+        info["steps"] = payload.steps
+    elif isinstance(payload, _ToolWrapper):
+        info["resource_usage"] = getattr(payload.tool, "resource_usage", None)
+    if result_file is not None:
+        _write_result(result_file, result, info)
+    else:
+        _print_result(result)
+    if hasattr(payload, "failed"):
+        failed = payload.failed(result)
+    else:
+        failed = isinstance(result, Exception)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    # register this module under its real name so that un-pickling
+    # payload classes defined here does not import the module again
+    sys.modules.setdefault("jip.remote", sys.modules[__name__])
+    sys.exit(main())
@@ -14,8 +14,16 @@ specified using the tools `job` attribute. An instance of
 :class:`jip.tools.Job` is associated with each tool instance.
 """
 
+import errno
+import inspect
 import signal
 import os
+import threading
+import time
+import weakref
+
+from jip import instrumentation
+from jip import profiling
 
 
 class ToolException(Exception):
@@ -120,6 +128,10 @@ class Job(object):
         jobid: string
             The job id. This is set after the job was submitted to a remote
             cluster
+        profile: boolean or string
+            If set, the tools call method runs in the python profiler and
+            the statistics are written to the log directory or, if profile
+            is a string, to the given directory. See :mod:`jip.profiling`
     """
 
     def __init__(self):
@@ -138,6 +150,235 @@ class Job(object):
         self.verbose = True
         self.logdir = None
         self.jobid = None
+        self.profile = None
+
+
+# job attributes that are shared by all tools of a job that runs
+# multiple tools, see jip.cluster.Cluster.submit_packed() and
+# jip.cluster.Cluster.submit_chain()
+_GROUP_JOB_ATTRIBUTES = ["template", "queue", "priority", "working_dir",
+                         "extra", "header", "verbose", "logdir"]
+
+
+def _parse_minutes(value):
+    """Convert a job time, either minutes or a [[hours:]minutes:]seconds
+    string, to minutes. Returns None if the value is None.
+    """
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        parts = [int(x or 0) for x in str(value).split(":")]
+        seconds = 0
+        for part in parts:
+            seconds = seconds * 60 + part
+        return (seconds + 59) // 60
+
+
+# compiled mako templates by template source, see _template()
+_templates = {}
+# maximum number of cached templates. The cache is cleared when it is full
+_TEMPLATE_CACHE_SIZE = 1024
+
+
+def _template(source):
+    """Return the compiled mako template for the given template source.
+    Compiled templates are cached, as compiling a template is much more
+    expensive than rendering it.
+
+    :param source: the template source
+    """
+    template = _templates.get(source)
+    if template is not None:
+        instrumentation.count(instrumentation.EVENT_TEMPLATE_HIT)
+        return template
+    from mako.template import Template
+    instrumentation.count(instrumentation.EVENT_TEMPLATE_MISS)
+    template = Template(source)
+    if len(_templates) >= _TEMPLATE_CACHE_SIZE:
+        _templates.clear()
+    _templates[source] = template
+    return template
+
+
+def _wait(process, started):
+    """Wait for the given sub-process to terminate and return a tuple of
+    the exit value and a dictionary with the resource usage of the process.
+    The exit value is negative if the process was terminated by a signal.
+    The resource usage contains the `wall_time` since the given start
+    time, the `user_time` and `system_time` in seconds, the `max_rss` in
+    kilobytes, the number of `block_input` and `block_output` operations
+    and the number of `voluntary_switches` and `involuntary_switches`.
+
+    :param process: the :py:class:`subprocess.Popen` instance
+    :param started: the time the process was started
+    """
+    while True:
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError, e:
+            # retry if a signal handler interrupted the call
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return process.returncode, {"wall_time": time.time() - started,
+                                "user_time": usage.ru_utime,
+                                "system_time": usage.ru_stime,
+                                "max_rss": usage.ru_maxrss,
+                                "block_input": usage.ru_inblock,
+                                "block_output": usage.ru_oublock,
+                                "voluntary_switches": usage.ru_nvcsw,
+                                "involuntary_switches": usage.ru_nivcsw}
+
+
+# listener call conventions, see _dispatch_mode()
+_CALL_NO_ARGS = 0
+_CALL_TOOL = 1
+_CALL_KWARGS = 2
+_CALL_ARGS = 3
+
+# call conventions of the listeners by listener
+_dispatch_modes = weakref.WeakKeyDictionary()
+
+# number of threads that run background listeners
+_LISTENER_THREADS = 4
+# the thread pool of the background listeners, created on first use
+_listener_pool = None
+# results of the submitted background listener calls
+_listener_calls = []
+_listener_lock = threading.Lock()
+
+
+def _dispatch_mode(listener):
+    """Return the call convention of the given listener. The listener
+    signature is inspected once and the result is cached for listeners
+    that can be weakly referenced. Methods are cached by their function,
+    as every attribute access creates a new method object.
+
+    :param listener: the listener function or callable
+    """
+    key = getattr(listener, "im_func", listener)
+    try:
+        return _dispatch_modes[key]
+    except KeyError:
+        pass
+    except TypeError:
+        # not hashable or can not be weakly referenced
+        return _inspect_listener(listener)
+    mode = _inspect_listener(listener)
+    _dispatch_modes[key] = mode
+    return mode
+
+
+def _inspect_listener(listener):
+    """Guess the call convention of the listener from its arguments"""
+    # make sure listener is a function or a callable
+    inspect_target = listener
+    if not inspect.isfunction(listener) and not inspect.ismethod(listener):
+        inspect_target = listener.__call__
+    argspec = inspect.getargspec(inspect_target)
+    args = argspec.args
+    if inspect.ismethod(inspect_target) and \
+            inspect_target.im_self is not None:
+        # the bound instance is passed implicitly
+        args = args[1:]
+    if len(args) == 0:
+        return _CALL_NO_ARGS
+    elif len(args) == 1:
+        return _CALL_TOOL
+    elif argspec.keywords is not None:
+        return _CALL_KWARGS
+    return _CALL_ARGS
+
+
+def _call_listener(listener, tool, args):
+    """Call the listener with the given tool and tool configuration"""
+    mode = _dispatch_mode(listener)
+    if mode == _CALL_NO_ARGS:
+        listener()
+    elif mode == _CALL_TOOL:
+        listener(tool)
+    elif mode == _CALL_KWARGS:
+        listener(tool, **args)
+    else:
+        listener(tool, args)
+
+
+def _call_background_listener(listener, tool, args):
+    """Call a background listener and log failures"""
+    try:
+        _call_listener(listener, tool, args)
+    except Exception, e:
+        tool.log.warn("Background listener call %s failed with"
+                      " exception: %s", listener, e)
+
+
+def wait_listeners(timeout=None):
+    """Block until all calls of background listeners finished. Returns
+    False if the timeout expired before all calls finished.
+
+    :param timeout: optional timeout in seconds
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with _listener_lock:
+        calls = list(_listener_calls)
+    for call in calls:
+        if deadline is None:
+            call.wait()
+        else:
+            call.wait(max(0, deadline - time.time()))
+        if not call.ready():
+            return False
+    with _listener_lock:
+        _listener_calls[:] = [c for c in _listener_calls if not c.ready()]
+    return True
+
+
+class background(object):
+    """Wrapper for listeners that are called asynchronously on a
+    background thread pool, off the critical path of the tool execution.
+    The listener receives a copy of the tool configuration. Use
+    :py:func:`wait_listeners` to wait for pending calls. For example:
+
+        >>> class MyTool(Tool):
+        ...     on_finish = [background(upload_logs)]
+
+    Note that background listeners might still run after the tool
+    finished and are not called if the process exits before.
+    """
+    def __init__(self, listener):
+        """Wrap the given listener
+
+        :param listener: the listener function or callable
+        """
+        self.listener = listener
+
+    def submit(self, tool, args):
+        """Submit a call of the listener to the thread pool
+
+        :param tool: the tool
+        :param args: the tool configuration
+        """
+        global _listener_pool
+        if args is not None:
+            args = dict(args)
+        with _listener_lock:
+            if _listener_pool is None:
+                from multiprocessing.pool import ThreadPool
+                _listener_pool = ThreadPool(_LISTENER_THREADS)
+            # forget finished calls
+            _listener_calls[:] = [c for c in _listener_calls
+                                  if not c.ready()]
+            _listener_calls.append(_listener_pool.apply_async(
+                _call_background_listener, (self.listener, tool, args)))
+
+    def __repr__(self):
+        return "background(%r)" % (self.listener,)
 
 
 class ToolMetaClass(type):
@@ -298,6 +539,8 @@ class Tool(object):
 
         # save signals
         self._received_signal = None
+        # resource usage of the last interpreter run, see call()
+        self.resource_usage = None
 
         # setup the process and check for the interpreter
         self.__process = None
@@ -393,7 +636,12 @@ class Tool(object):
             signal.signal(signal.SIGHUP, handler)
             signal.signal(signal.SIGTERM, handler)
             signal.signal(signal.SIGINT, handler)
-        return self.__execute(state, args)
+        self.resource_usage = None
+        started = instrumentation.start()
+        try:
+            return self.__execute(state, args)
+        finally:
+            instrumentation.stop(instrumentation.PHASE_EXECUTE, self, started)
 
     def __execute(self, state, args):
         """Internal method that does the actual execution of the
@@ -411,7 +659,13 @@ class Tool(object):
         self._on_start(args)
         # class the call method
         try:
-            result = self.call(args)
+            # jobs pickled by older versions have no profile setting
+            profile = getattr(self.job, "profile", None) or \
+                profiling.directory
+            if profile:
+                result = profiling.profile_call(self, args, profile)
+            else:
+                result = self.call(args)
             self._on_success(args)
             # successful call, do cleanup
             if "cleanup" not in state:
@@ -460,28 +714,16 @@ class Tool(object):
 
     def __call_listener(self, listener_list, args):
         """Call the listeners in the given listener list. If
-        the list is None, nothing is called.
+        the list is None, nothing is called. Listeners wrapped with
+        :py:class:`background` are submitted to the background thread pool.
         """
         if listener_list is not None:
-            import inspect
             for listener in listener_list:
                 try:
-                    # make sure listener is a function or a callable
-                    inspect_target = listener
-                    if not inspect.isfunction(listener):
-                        inspect_target = listener.__call__
-
-                    # gues the parameter arguments
-                    argspec = inspect.getargspec(inspect_target)
-                    if len(argspec.args) == 0:
-                        listener()
-                    elif len(argspec.args) == 1:
-                        listener(self)
+                    if isinstance(listener, background):
+                        listener.submit(self, args)
                     else:
-                        if argspec.keywords is not None:
-                            listener(self, **args)
-                        else:
-                            listener(self, args)
+                        _call_listener(listener, self, args)
                 except Exception, e:
                     self.log.warn("Listener call %s failed with"
                                   " exception: %s", listener, e)
@@ -490,14 +732,18 @@ class Tool(object):
         """Returns true if the tools has outputs defined and
         all outputs exist
         """
-        outs = self.returns(args)
-        if outs is None:
-            return False
-        for output in outs:
-            if output is not None and len(output) > 0:
-                if not os.path.exists(output):
-                    return False
-        return True
+        started = instrumentation.start()
+        try:
+            outs = self.returns(args)
+            if outs is None:
+                return False
+            for output in outs:
+                if output is not None and len(output) > 0:
+                    if not os.path.exists(output):
+                        return False
+            return True
+        finally:
+            instrumentation.stop(instrumentation.PHASE_IS_DONE, self, started)
 
     def validate(self, args, incoming=None):
         """Validate the interpreted tool options based on the `inputs`.
@@ -577,9 +823,7 @@ class Tool(object):
             args = {}
         if isinstance(r, basestring):
             # render template
-            from mako.template import Template
-            t = Template(r).render(tool=self, **args)
-            return t
+            return _template(r).render(tool=self, **args)
         if callable(r):
             # call function
             return r(args)
@@ -637,6 +881,9 @@ class Tool(object):
         with its arguments to run the script. All passed arguments
         are passed to the tools get_command() method to render the template.
 
+        The resource usage of the interpreter process is stored in the
+        tools `resource_usage` attribute, where listeners can pick it up.
+        See :py:func:`_wait` for the recorded values.
         """
         # write the template
         from tempfile import NamedTemporaryFile
@@ -655,11 +902,12 @@ class Tool(object):
                 stdout = open("/dev/null", "w")
                 stderr = open("/dev/null", "w")
 
+            started = time.time()
             self.__process = subprocess.Popen([self.__class__.interpreter,
                                                script_file.name], shell=False,
                                               stdout=stdout,
                                               stderr=stderr)
-            exit_value = self.__process.wait()
+            exit_value, self.resource_usage = _wait(self.__process, started)
         except Exception, e:
             # kill the process
             if self.__process is not None:
@@ -690,12 +938,14 @@ class Tool(object):
         representation of the command script.
         """
         import textwrap
-        from mako.template import Template
 
         if args is None:
             args = {}
+        started = instrumentation.start()
         args["job"] = self.job
-        rendered = Template(self.__class__.command).render(tool=self, **args)
+        rendered = _template(self.__class__.command).render(tool=self,
+                                                            **args)
+        instrumentation.stop(instrumentation.PHASE_RENDER, self, started)
         return textwrap.dedent(rendered)
 
     def add_arguments(self, parser):
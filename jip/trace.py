@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""The trace module writes timelines of pipeline runs in the Chrome
+trace event format. Trace files can be loaded into `chrome://tracing` or
+other trace viewers such as Perfetto.
+
+Each executed :py:class:`jip.pipelines.PipelineTool` is shown as a span
+on the host and worker that ran it. The time a step waited, either for
+its dependencies in a local run or in the cluster queue, is shown as an
+asynchronous span in the `queue` process and the dependencies between the
+steps are drawn as flow events. Traces are recorded with
+:py:meth:`jip.pipelines.Pipeline.run` and
+:py:meth:`jip.pipelines.Pipeline.collect`::
+
+    pipeline.run(trace="run.trace.json")
+
+    pipeline.submit(cluster)
+    for step, result in pipeline.collect(cluster, trace="run.trace.json"):
+        ...
+"""
+import json
+import os
+
+
+class Trace(object):
+    """Records the timings of pipeline steps and converts them into
+    trace events
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def add(self, step, queued, started, finished, host=None, worker=None,
+            jobid=None, failed=False):
+        """Record the execution of a pipeline step. Time stamps are in
+        seconds since the epoch.
+
+        :param step: the :py:class:`jip.pipelines.PipelineTool`
+        :param queued: the time the step was queued or None
+        :param started: the time the step started
+        :param finished: the time the step finished
+        :param host: the host that ran the step, defaults to the local host
+        :param worker: the name of the worker on the host, defaults to
+                       'local'
+        :param jobid: the job id if the step ran on a cluster
+        :param failed: True if the step failed
+        """
+        self.steps.append({"step": step,
+                           "queued": queued,
+                           "started": started,
+                           "finished": finished,
+                           "host": host or os.uname()[1],
+                           "worker": worker or "local",
+                           "jobid": jobid,
+                           "failed": failed})
+
+    def add_feature(self, step, feature, failed=False):
+        """Record the execution of a pipeline step that ran on a cluster.
+        The times are taken from the runtime information loaded with the
+        results of the feature. Returns False if the feature has no
+        runtime information.
+
+        :param step: the :py:class:`jip.pipelines.PipelineTool`
+        :param feature: the :py:class:`jip.cluster.Feature` of the step
+        :param failed: True if the step failed
+        """
+        run = feature.get_run_info()
+        if run is None:
+            return False
+        worker = "job %s" % feature.jobid
+        if run.get("pid") is not None:
+            worker = "%s pid %s" % (worker, run["pid"])
+        self.add(step, feature.submitted, run["start"], run["end"],
+                 host=run.get("host"), worker=worker, jobid=feature.jobid,
+                 failed=failed)
+        return True
+
+    def events(self):
+        """Return the list of trace events"""
+        if len(self.steps) == 0:
+            return []
+        origin = min(min(s["started"], s["queued"] or s["started"])
+                     for s in self.steps)
+
+        def ts(value):
+            return int((value - origin) * 1000000)
+
+        events = [_metadata("process_name", 0, 0, "queue")]
+        processes = {}
+        threads = {}
+        spans = {}
+        for i, record in enumerate(self.steps):
+            step = record["step"]
+            pid = processes.get(record["host"])
+            if pid is None:
+                pid = processes[record["host"]] = len(processes) + 1
+                events.append(_metadata("process_name", pid, 0,
+                                        record["host"]))
+            tid = threads.get((pid, record["worker"]))
+            if tid is None:
+                tid = threads[(pid, record["worker"])] = len(threads) + 1
+                events.append(_metadata("thread_name", pid, tid,
+                                        record["worker"]))
+            tool = step._tool.__class__
+            args = {"tool": "%s.%s" % (tool.__module__, tool.__name__),
+                    "host": record["host"],
+                    "worker": record["worker"],
+                    "failed": record["failed"]}
+            if record["jobid"] is not None:
+                args["jobid"] = str(record["jobid"])
+            if record["queued"] is not None and \
+                    record["queued"] < record["started"]:
+                events.append({"name": step._name, "cat": "queue",
+                               "ph": "b", "id": i, "pid": 0, "tid": 0,
+                               "ts": ts(record["queued"]), "args": args})
+                events.append({"name": step._name, "cat": "queue",
+                               "ph": "e", "id": i, "pid": 0, "tid": 0,
+                               "ts": ts(record["started"])})
+            start = ts(record["started"])
+            end = max(start + 1, ts(record["finished"]))
+            events.append({"name": step._name,
+                           "cat": "failed" if record["failed"] else "step",
+                           "ph": "X", "pid": pid, "tid": tid,
+                           "ts": start, "dur": end - start, "args": args})
+            spans[step] = (pid, tid, start, end)
+
+        flow = 0
+        for record in self.steps:
+            target = record["step"]
+            for source in target.get_dependencies():
+                if source not in spans:
+                    continue
+                flow += 1
+                pid, tid, start, end = spans[source]
+                events.append({"name": "dependency", "cat": "dependency",
+                               "ph": "s", "id": flow, "pid": pid, "tid": tid,
+                               "ts": end - 1})
+                pid, tid, start, end = spans[target]
+                events.append({"name": "dependency", "cat": "dependency",
+                               "ph": "f", "bp": "e", "id": flow, "pid": pid,
+                               "tid": tid, "ts": start})
+        return events
+
+    def save(self, path):
+        """Write the trace to the given file
+
+        :param path: the trace file
+        """
+        with open(path, 'w') as trace_file:
+            json.dump({"traceEvents": self.events(),
+                       "displayTimeUnit": "ms"}, trace_file)
+
+
+def _metadata(name, pid, tid, value):
+    """Create a metadata event that names a process or a thread"""
+    return {"name": name, "ph": "M", "pid": pid, "tid": tid,
+            "args": {"name": value}}
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Cluster stubs shared by the tests"""
+from jip.cluster import Cluster, Feature
+
+
+class StubCluster(Cluster):
+    """Cluster stub that accepts all submissions. Jobs leave the queue
+    right after the submission.
+
+    The keyword arguments of the submissions, together with the assigned
+    `jobid`, are recorded in `submitted`, the released job ids in
+    `released` and the number of list calls in `polls`.
+    """
+    def __init__(self, directory=None, result=None, info=None,
+                 accounting=None, offset=0):
+        """Create the stub
+
+        :param directory: if specified, every job writes a result file
+                          to this directory
+        :param result: the result written to the result files
+        :param info: optional function that returns the runtime
+                     information written to the result file of a job id
+        :param accounting: dictionary from the job ids to the
+                           :py:class:`jip.cluster.JobAccounting` of the
+                           jobs. If not specified, accounting is not
+                           implemented
+        :param offset: offset of the job ids
+        """
+        self.directory = directory
+        self.result = result
+        self.info = info
+        self.jobs = accounting
+        self.offset = offset
+        self.submitted = []
+        self.released = []
+        self.polls = 0
+
+    def list(self):
+        self.polls += 1
+        return {}
+
+    def _submit(self, script, **kwargs):
+        jobid = str(self.offset + len(self.submitted) + 1)
+        self.submitted.append(dict(kwargs, jobid=jobid))
+        if self.directory is None:
+            return Feature(jobid)
+        from jip.remote import _encode_payload
+        info = self.info(jobid) if self.info is not None else {}
+        path = self.directory.join("%s.result" % jobid)
+        path.write(_encode_payload((self.result, info)), mode="wb")
+        return Feature(jobid, result=str(path))
+
+    def release(self, jobids):
+        self.released.append(list(jobids))
+
+    def _accounting(self, jobids):
+        if self.jobs is None:
+            return Cluster._accounting(self, jobids)
+        return dict((j, self.jobs[j]) for j in jobids if j in self.jobs)
+
+
+def submissions(grid):
+    """Return tuples of the job id, the hold flag and the dependencies
+    of the jobs submitted to the given stub
+    """
+    return [(s["jobid"], s["hold"], s["dependencies"])
+            for s in grid.submitted]
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Test the critical path analysis"""
+from jip.tools import Tool
+from jip.pipelines import Pipeline
+from jip.analysis import analyze
+import pytest
+
+
+class Merge(Tool):
+    command = "cat ${left} ${right} > ${output}"
+    inputs = {"left": None, "right": None}
+    outputs = {"output": None}
+
+
+def _diamond():
+    p = Pipeline()
+    a = p.add(Merge(), "a")
+    a.output = "a.txt"
+    b = p.add(Merge(), "b")
+    b.left = a.output
+    b.output = "b.txt"
+    c = p.add(Merge(), "c")
+    c.left = a.output
+    c.output = "c.txt"
+    d = p.add(Merge(), "d")
+    d.left = b.output
+    d.right = c.output
+    return p
+
+
+def test_critical_path_slack_and_candidates():
+    timings = {"a": (100, 110), "b": (110, 112), "c": (110, 120),
+               "d": (120, 125)}
+    analysis = analyze(_diamond(), timings=timings)
+    assert analysis.critical_path == ["a", "c", "d"]
+    assert analysis.length == 25
+    assert analysis.makespan == 25
+    assert analysis.work == 27
+    assert analysis.slack == {"a": 0, "b": 8, "c": 0, "d": 0}
+    assert analysis.candidates == [("a", 10), ("c", 8), ("d", 5)]
+    assert analysis.achieved_parallelism == pytest.approx(1.08)
+    assert "a -> c -> d" in str(analysis)
+
+
+def test_analysis_of_local_run(tmpdir):
+    p = Pipeline()
+    first = p.add(Merge(), "first")
+    first.left = "/dev/null"
+    first.right = "/dev/null"
+    first.output = str(tmpdir.join("first.txt"))
+    second = p.add(Merge(), "second")
+    second.left = first.output
+    second.right = "/dev/null"
+    second.output = str(tmpdir.join("second.txt"))
+    p.run()
+    analysis = analyze(p)
+    assert analysis.critical_path == ["first", "second"]
+    assert analysis.slack["first"] == 0
+    assert analysis.achieved_parallelism <= 1.0
+    assert analyze(Pipeline()).critical_path == []
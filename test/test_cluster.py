@@ -2,6 +2,8 @@
 """Test parts of the cluster implementation"""
 from jip.tools import Tool
 from jip.cluster import Cluster
+from test.clusters import StubCluster, submissions
+import pytest
 
 
 class MyTool(Tool):
@@ -24,3 +26,572 @@ def test_saving_simple_tool():
     ex = Cluster()
     f = ex.dump(t, {})
     assert f is not None
+
+
+def test_payload_store_deduplicates_payloads(tmpdir):
+    import os
+    from jip.cluster import PayloadStore
+    store = PayloadStore(str(tmpdir))
+    a = store.put("JIP1-payload")
+    b = store.put("JIP1-payload")
+    c = store.put("JIP1-other")
+    assert a == b
+    assert a != c
+    assert open(a).read() == "JIP1-payload"
+    store.release(a)
+    assert os.path.exists(a)
+    store.release(b)
+    assert not os.path.exists(a)
+    assert os.path.exists(c)
+
+
+def test_payload_store_clean_keeps_referenced_files(tmpdir):
+    import os
+    from jip.cluster import PayloadStore
+    store = PayloadStore(str(tmpdir))
+    referenced = store.put("JIP1-payload")
+    orphan = PayloadStore(str(tmpdir)).put("JIP1-orphan")
+    assert store.clean() == 1
+    assert os.path.exists(referenced)
+    assert not os.path.exists(orphan)
+
+
+def test_dump_tool_references_stored_payload(tmpdir):
+    from jip.cluster import PayloadStore
+    ex = Cluster()
+    ex.payload_store = PayloadStore(str(tmpdir))
+    script, payload_file = ex._dump_tool(MyTool(), {})
+    assert payload_file.startswith(str(tmpdir))
+    assert "< %s" % payload_file in script
+    assert "__EOF__" not in script
+
+
+def test_failed_packed_submission_releases_all_payload_references(tmpdir):
+    import os
+    from jip.cluster import PayloadStore, ClusterException
+
+    class _FailingCluster(Cluster):
+        def _submit(self, script, **kwargs):
+            raise ClusterException("submission failed")
+
+    grid = _FailingCluster()
+    grid.payload_store = PayloadStore(str(tmpdir.join("store")))
+    with pytest.raises(ClusterException):
+        grid.submit_packed([MyTool() for i in range(3)],
+                           args=[{}, {}, {}])
+    assert grid.payload_store._references == {}
+    assert not any(files for root, dirs, files
+                   in os.walk(grid.payload_store.directory))
+
+
+def test_feature_loads_legacy_results():
+    from jip.cluster import Feature
+    assert Feature(1)._load_results("test_data/result_4.out") == 4
+    result = Feature(1)._load_results("test_data/result_exception.out")
+    assert str(result) == "Something went wrong!"
+
+
+def test_feature_loads_results_from_end_of_log(tmpdir):
+    from jip.cluster import Feature
+    from jip.remote import _encode_payload, _SEP_RESULT, _SEP_RESULT_END
+    log = tmpdir.join("job.out")
+    log.write("some output\n%s\ngarbage\n%s\nmore output\n%s\n%s%s\n" % (
+        _SEP_RESULT, _SEP_RESULT_END, _SEP_RESULT,
+        _encode_payload([1, 2]).encode("base64"), _SEP_RESULT_END))
+    assert Feature(1, stdout=str(log)).load() == [1, 2]
+
+
+def test_feature_loads_result_file(tmpdir):
+    from jip.cluster import Feature
+    from jip.remote import _encode_payload
+    result = tmpdir.join("job.result")
+    result.write(_encode_payload((5, {"host": "node"})), mode="wb")
+    feature = Feature(1, stdout=str(tmpdir.join("missing.out")),
+                      result=str(result))
+    assert feature.load() == 5
+    assert feature.info == {"host": "node"}
+
+
+def test_dump_renders_result_file():
+    script = Cluster().dump(MyTool(), {}, result_file="/logs/${JOB}.result")
+    assert 'python -m jip.remote --result "/logs/${JOB}.result"' in script
+
+
+class _ListCluster(Cluster):
+    """Cluster stub that replays a sequence of job lists"""
+    def __init__(self, states):
+        self.states = list(states)
+
+    def list(self):
+        if len(self.states) > 1:
+            return self.states.pop(0)
+        return self.states[0]
+
+
+def _result_feature(tmpdir, jobid, result):
+    from jip.cluster import Feature
+    from jip.remote import _encode_payload
+    path = tmpdir.join("%s.result" % jobid)
+    path.write(_encode_payload((result, {})), mode="wb")
+    return Feature(jobid, result=str(path))
+
+
+def test_collect_yields_results_in_completion_order(tmpdir):
+    features = [_result_feature(tmpdir, i, i * 10) for i in range(1, 4)]
+    cluster = _ListCluster([{"1": "Running", "2": "Queued"},
+                            {"1": "Running"},
+                            {}])
+    collected = [(f.jobid, r) for f, r in
+                 cluster.collect(features, check_interval=0.1)]
+    assert collected[0] == (3, 30)
+    assert collected[1] == (2, 20)
+    assert collected[2] == (1, 10)
+
+
+def test_collect_reports_aggregated_failures(tmpdir):
+    from jip.cluster import ClusterException, Feature
+    features = [_result_feature(tmpdir, 1, 10),
+                _result_feature(tmpdir, 2, ValueError("failed")),
+                Feature(3, stdout=str(tmpdir.join("missing.out")))]
+    results = []
+    with pytest.raises(ClusterException) as excinfo:
+        for feature, result in _ListCluster([{}]).collect(features,
+                                                          check_interval=0):
+            results.append(result)
+    assert results == [10]
+    assert sorted(f.jobid for f in excinfo.value.failures) == [2, 3]
+
+
+class _Touch(Tool):
+    command = "touch ${name}"
+    inputs = {"name": None}
+    outputs = {"file": "${name}"}
+
+
+def test_pipeline_hold_and_release_submission(tmpdir):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    grid = StubCluster()
+    features = p.submit(grid, hold=True)
+    assert [f.jobid for f in features] == ["1", "2"]
+    assert submissions(grid) == [("1", True, None), ("2", True, ["1"])]
+    assert grid.released == [["1", "2"]]
+
+
+def test_pipeline_packs_short_independent_steps(tmpdir):
+    from jip.pipelines import Pipeline
+    from jip.remote import _encode_payload
+    p = Pipeline()
+    steps = []
+    for name in ["a", "b", "c"]:
+        step = p.add(_Touch(), name)
+        step.name = str(tmpdir.join("%s.txt" % name))
+        step.job.max_time = 5
+        steps.append(step)
+    steps[2].job.max_time = "01:00:00"
+    merge = p.add(_Touch(), "merge")
+    merge.name = steps[0].file
+    grid = StubCluster()
+    features = p.submit(grid, pack_time=10, pack_slots=2)
+    assert len(features) == 4
+    assert len(grid.submitted) == 3
+    packed = [f for f in features if f.index is not None]
+    assert [f.index for f in packed] == [0, 1]
+    assert packed[0].jobid == packed[1].jobid
+    assert steps[0].job.jobid == steps[1].job.jobid
+    # the dependent step waits for the packed job
+    assert grid.submitted[-1]["dependencies"] == [steps[0].job.jobid]
+
+    # packed features load their own result
+    result = tmpdir.join("pack.result")
+    result.write(_encode_payload((["a", "b"], {})), mode="wb")
+    for f in packed:
+        f.result = str(result)
+    assert [f.load() for f in packed] == ["a", "b"]
+
+
+def test_pack_job_settings():
+    p = Cluster()
+    tools = [MyTool() for i in range(5)]
+    for t in tools:
+        t.job.max_time = 10
+        t.job.max_mem = 100
+    tools[0].job.max_mem = 500
+    job = p._pack_job(tools, 2)
+    assert job.threads == 2
+    assert job.max_time == 30
+    assert job.max_mem == 500
+    assert job.name == "Mytool+4"
+
+
+def test_pipeline_fuses_linear_chains(tmpdir):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    c = p.add(_Touch(), "c")
+    d = p.add(_Touch(), "d")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    c.name = b.file
+    d.name = b.file
+    a.job.max_time = 10
+    b.job.max_time = 20
+    grid = StubCluster()
+    features = p.submit(grid, fuse=True)
+    assert len(features) == 4
+    assert len(grid.submitted) == 3
+    assert a.job.jobid == b.job.jobid == "1"
+    assert [f.index for f in features[:2]] == [0, 1]
+    assert sorted(s["dependencies"] for s in grid.submitted[1:]) == \
+        [["1"], ["1"]]
+
+
+def test_chain_job_settings():
+    tools = [MyTool() for i in range(3)]
+    for i, t in enumerate(tools):
+        t.job.max_time = 10
+        t.job.threads = i + 1
+    job = Cluster()._chain_job(tools)
+    assert job.max_time == 30
+    assert job.threads == 3
+
+
+def test_slurm_allocation_sizing(tmpdir):
+    from jip.pipelines import Pipeline
+    from jip.cluster import Slurm, Feature
+
+    class _RecordingSlurm(Slurm):
+        def _submit(self, script, **kwargs):
+            self.submitted = kwargs
+            return Feature("1")
+
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    c = p.add(_Touch(), "c")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    c.name = a.file
+    a.job.max_time = 10
+    b.job.max_time = 20
+    c.job.max_time = 5
+    b.job.threads = 2
+    c.job.threads = 3
+    b.job.max_mem = 200
+    grid = _RecordingSlurm()
+    features = grid.submit_allocation(p)
+    assert [f.index for f in features] == [0, 1, 2]
+    assert a.job.jobid == c.job.jobid == "1"
+    # b and c run concurrently with 5 threads, tasks fit the largest step
+    assert grid.submitted["tasks"] == 2
+    assert grid.submitted["threads"] == 3
+    assert grid.submitted["max_time"] == 30
+    assert grid.submitted["max_mem"] == 200
+
+
+def test_peak_threads_covers_steps_of_different_levels():
+    from jip.cluster import _peak_threads
+    # a -> b and c -> d, b and c can overlap but are in different levels
+    assert _peak_threads([1, 4, 4, 1], [[], [0], [], [2]]) == 8
+    # a -> b -> c, nothing overlaps
+    assert _peak_threads([2, 3, 2], [[], [0], [1]]) == 3
+    # a -> (b, c)
+    assert _peak_threads([1, 2, 3], [[], [0], [0]]) == 5
+
+
+class _QueueCluster(StubCluster):
+    """Stub cluster where each list call finishes the oldest job,
+    unless drain is False
+    """
+    def __init__(self, queued=None, offset=0, drain=True):
+        StubCluster.__init__(self, offset=offset)
+        self.queued = list(queued or [])
+        self.drain = drain
+        self.peak = 0
+
+    def _submit(self, script, **kwargs):
+        feature = StubCluster._submit(self, script, **kwargs)
+        self.queued.append(feature.jobid)
+        self.peak = max(self.peak, len(self.queued))
+        return feature
+
+    def list(self):
+        jobs = dict((j, Cluster.STATE_QUEUED) for j in self.queued)
+        if self.drain:
+            self.queued = self.queued[1:]
+        return jobs
+
+
+def test_pipeline_throttled_submission(tmpdir):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    for name in ["a", "b", "c", "d"]:
+        step = p.add(_Touch(), name)
+        step.name = str(tmpdir.join("%s.txt" % name))
+    grid = _QueueCluster()
+    features = p.submit(grid, max_jobs=2, check_interval=0)
+    assert len(features) == 4
+    assert grid.peak == 2
+
+
+class _FinishingCluster(StubCluster):
+    """Stub cluster where jobs create the given outputs"""
+    def _submit(self, script, **kwargs):
+        feature = StubCluster._submit(self, script, **kwargs)
+        for output in self.outputs.pop(0):
+            open(output, "w").close()
+        return feature
+
+
+def test_pipeline_throttled_submission_drops_finished_dependencies(tmpdir):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    grid = _FinishingCluster()
+    grid.outputs = [[str(tmpdir.join("a.txt"))], []]
+    features = p.submit(grid, max_jobs=10, check_interval=0)
+    assert len(features) == 2
+    assert submissions(grid) == [("1", False, None), ("2", False, None)]
+
+
+class _Noop(Tool):
+    options = {"value": None}
+
+    def call(self, args):
+        pass
+
+
+def _accounting(states):
+    from jip.cluster import JobAccounting
+    return dict((j, JobAccounting(j, state=state))
+                for j, state in states.items())
+
+
+def _noop_chain(length):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    steps = [p.add(_Noop(), "s%d" % i) for i in range(length)]
+    for i in range(1, length):
+        steps[i].value = steps[i - 1].value
+    return p
+
+
+def test_pipeline_throttled_submission_keeps_unknown_dependencies():
+    grid = StubCluster()
+    features = _noop_chain(2).submit(grid, max_jobs=10, check_interval=0)
+    assert len(features) == 2
+    assert submissions(grid) == [("1", False, None), ("2", False, ["1"])]
+
+
+def test_pipeline_throttled_submission_uses_accounting():
+    grid = StubCluster(accounting=_accounting({"1": "COMPLETED"}))
+    features = _noop_chain(2).submit(grid, max_jobs=10, check_interval=0)
+    assert len(features) == 2
+    assert submissions(grid) == [("1", False, None), ("2", False, None)]
+
+
+def test_pipeline_throttled_submission_reports_skipped_steps():
+    from jip.pipelines import PipelineException
+    grid = StubCluster(accounting=_accounting({"1": "FAILED"}))
+    with pytest.raises(PipelineException) as e:
+        _noop_chain(3).submit(grid, max_jobs=10, check_interval=0)
+    assert e.value.skipped == ["s1", "s2"]
+    assert [f.jobid for f in e.value.features] == ["1"]
+    assert len(grid.submitted) == 1
+
+
+def test_pipeline_throttled_submission_checks_result_files(tmpdir):
+    from jip.pipelines import PipelineException
+    # the result file takes precedence over the accounting
+    grid = StubCluster(tmpdir, result=ValueError("failed"),
+                       accounting=_accounting({"1": "COMPLETED"}))
+    with pytest.raises(PipelineException) as e:
+        _noop_chain(2).submit(grid, max_jobs=10, check_interval=0)
+    assert e.value.skipped == ["s1"]
+
+
+def test_pipeline_throttled_submission_rate_limits_queue_checks():
+    grid = StubCluster(accounting={})
+    features = _noop_chain(5).submit(grid, max_jobs=10,
+                                     check_interval=3600)
+    assert len(features) == 5
+    assert grid.polls == 1
+
+
+def _journal_pipeline(tmpdir):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    return p
+
+
+def test_pipeline_submission_journal_adopts_active_jobs(tmpdir):
+    from jip.journal import SubmissionJournal
+    journal = str(tmpdir.join("journal"))
+    grid = _QueueCluster()
+    first = _journal_pipeline(tmpdir).submit(grid, journal=journal)
+    assert [f.jobid for f in first] == ["1", "2"]
+    assert len(SubmissionJournal(journal).records) == 2
+
+    # job 1 is still queued, job 2 left the queue
+    grid = _QueueCluster(queued=["1"], offset=10, drain=False)
+    features = _journal_pipeline(tmpdir).submit(grid, journal=journal,
+                                                max_jobs=10)
+    assert [f.jobid for f in features] == ["1", "11"]
+    assert submissions(grid) == [("11", False, ["1"])]
+    records = SubmissionJournal(journal).records.values()
+    assert sorted(r["jobid"] for r in records) == ["1", "11"]
+
+
+def test_submission_journal_identity_depends_on_configuration(tmpdir):
+    from jip.journal import step_identity
+    a = _journal_pipeline(tmpdir).get("a")
+    other = _journal_pipeline(tmpdir.join("other")).get("a")
+    assert step_identity(a) == step_identity(_journal_pipeline(tmpdir).get("a"))
+    assert step_identity(a) != step_identity(other)
+
+
+def _fake_command(tmpdir, name, output):
+    """Create an executable that prints the given output"""
+    command = tmpdir.join(name)
+    command.write("#!/bin/sh\ncat <<'EOF'\n%sEOF\n" % output)
+    command.chmod(0755)
+    return str(command)
+
+
+def test_slurm_accounting_merges_job_steps(tmpdir):
+    from jip.cluster import Slurm
+    sacct = _fake_command(tmpdir, "sacct", "\n".join([
+        "12|COMPLETED|0:0|00:10:00|00:20:00||2013-04-02T10:00:00|"
+        "2013-04-02T10:10:00",
+        "12.batch|COMPLETED|0:0|00:10:00|00:20:00|2048K||",
+        "12.0|COMPLETED|0:0|00:09:00|00:19:00|1G||",
+        "13|OUT_OF_MEMORY|0:125|1-00:00:01|01:00.500|||",
+        "14|RUNNING|0:0|00:01:00||||", ""]))
+    grid = Slurm(sacct=sacct)
+    jobs = grid.accounting([12, 13, 14])
+    assert jobs["12"].state == "COMPLETED"
+    assert jobs["12"].elapsed == 600
+    assert jobs["12"].cpu_time == 1200
+    assert jobs["12"].max_rss == 1024 ** 3
+    assert jobs["13"].state == "OUT_OF_MEMORY"
+    assert jobs["13"].elapsed == 86401
+    assert jobs["13"].cpu_time == 60.5
+    # finished jobs are cached, running jobs are queried again
+    assert sorted(grid._accounting_cache.keys()) == ["12", "13"]
+
+
+def test_sungrid_accounting(tmpdir):
+    from jip.cluster import SunGrid
+    qacct = _fake_command(tmpdir, "qacct", "\n".join([
+        "==============================================================",
+        "qname        all.q",
+        "failed       0",
+        "exit_status  137",
+        "ru_wallclock 61s",
+        "cpu          30.500s",
+        "maxvmem      1.500G", ""]))
+    job = SunGrid(qacct=qacct).accounting(["7"])["7"]
+    assert job.state == "FAILED"
+    assert job.signal == 9
+    assert job.elapsed == 61
+    assert job.cpu_time == 30.5
+    assert job.max_rss == int(1.5 * 1024 ** 3)
+
+
+def test_sungrid_packed_submission_converts_minutes(tmpdir):
+    from jip.cluster import SunGrid
+    args = tmpdir.join("args")
+    qsub = tmpdir.join("qsub")
+    qsub.write("#!/bin/sh\necho \"$@\" > %s\ncat > /dev/null\n"
+               "echo 'Your job 5 (\"pack\") has been submitted'\n" % args)
+    qsub.chmod(0755)
+    tools = [MyTool() for i in range(3)]
+    for t in tools:
+        t.job.max_time = 10
+        t.job.logdir = str(tmpdir)
+    grid = SunGrid(qsub=str(qsub))
+    features = grid.submit_packed(tools, args=[{}, {}, {}], slots=2)
+    assert [f.jobid for f in features] == ["5", "5", "5"]
+    # two waves of 10 minutes
+    assert "-l h_rt=1200" in args.read()
+
+
+class _RetryCluster(StubCluster):
+    """Stub cluster where the first job fails with the given state"""
+    def __init__(self, state, max_rss=None):
+        from jip.cluster import JobAccounting
+        StubCluster.__init__(self, accounting={"1": JobAccounting(
+            "1", state=state, max_rss=max_rss)})
+        self.cancelled = []
+        self.rounds = [["2"], []]
+
+    def _submit(self, script, **kwargs):
+        feature = StubCluster._submit(self, script, **kwargs)
+        jobid = feature.jobid
+        feature.load = lambda: ValueError("failed") if jobid == "1" \
+            else jobid
+        return feature
+
+    def list(self):
+        return dict((j, Cluster.STATE_QUEUED) for j in self.rounds.pop(0))
+
+    def cancel(self, jobids):
+        self.cancelled.append(list(jobids))
+
+
+def _retry_pipeline(tmpdir):
+    from jip.pipelines import Pipeline
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    a.job.max_mem = 100
+    return p
+
+
+def test_pipeline_supervise_retries_out_of_memory_steps(tmpdir):
+    p = _retry_pipeline(tmpdir)
+    grid = _RetryCluster("OUT_OF_MEMORY")
+    p.submit(grid)
+    results = p.supervise(grid, check_interval=0)
+    assert results == {"a": "3", "b": "4"}
+    assert grid.cancelled == [["2"]]
+    assert grid.submitted[2]["max_mem"] == 200
+    assert grid.submitted[3]["dependencies"] == ["3"]
+
+
+def test_pipeline_supervise_escalates_observed_memory_per_cpu(tmpdir):
+    p = _retry_pipeline(tmpdir)
+    p.get("a").job.max_mem = None
+    p.get("a").job.threads = 4
+    grid = _RetryCluster("OUT_OF_MEMORY", max_rss=800 * 1024 * 1024)
+    p.submit(grid)
+    p.supervise(grid, check_interval=0)
+    # 1600 MB in total, requested per cpu
+    assert grid.submitted[2]["max_mem"] == 400
+    assert grid.submitted[2]["threads"] == 4
+
+
+def test_pipeline_supervise_does_not_retry_unclassified_failures(tmpdir):
+    from jip.pipelines import PipelineException
+    p = _retry_pipeline(tmpdir)
+    grid = _RetryCluster("FAILED")
+    p.submit(grid)
+    with pytest.raises(PipelineException) as excinfo:
+        p.supervise(grid, check_interval=0)
+    assert sorted(excinfo.value.failures.keys()) == ["a", "b"]
+    assert grid.cancelled == [["2"]]
+    assert len(grid.submitted) == 2
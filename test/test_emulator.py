@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Test the local grid engine emulator"""
+from jip.tools import Tool
+from jip.cluster import Slurm, SunGrid
+from jip.pipelines import Pipeline
+from jip.emulator import install
+
+
+class Add(Tool):
+    name = "add"
+
+    def call(self, args):
+        return args["a"] + args["b"]
+
+
+class _Touch(Tool):
+    command = "touch ${name}"
+    inputs = {"name": None}
+    outputs = {"file": "${name}"}
+
+
+def _slurm(tmpdir):
+    commands = install(str(tmpdir.join("bin")))
+    return Slurm(sbatch=commands["sbatch"], squeue=commands["squeue"],
+                 scontrol=commands["scontrol"], sacct=commands["sacct"],
+                 scancel=commands["scancel"])
+
+
+def test_emulated_slurm_runs_jobs_and_reports_accounting(tmpdir):
+    slurm = _slurm(tmpdir)
+    tool = Add()
+    tool.job.logdir = str(tmpdir)
+    feature = slurm.submit(tool, {"a": 1, "b": 3})
+    assert feature.get(slurm, check_interval=0.1) == 4
+    accounting = feature.get_accounting(slurm)
+    assert accounting.state == "COMPLETED"
+    assert accounting.max_rss > 0
+
+
+def test_emulated_slurm_accepts_time_strings(tmpdir):
+    slurm = _slurm(tmpdir)
+    tool = Add()
+    tool.job.logdir = str(tmpdir)
+    tool.job.max_time = "00:10:00"
+    feature = slurm.submit(tool, {"a": 1, "b": 2})
+    assert feature.get(slurm, check_interval=0.1) == 3
+
+
+def test_emulated_slurm_pipeline_with_hold_and_failed_dependency(tmpdir):
+    slurm = _slurm(tmpdir)
+    p = Pipeline()
+    a = p.add(_Touch(), "a")
+    b = p.add(_Touch(), "b")
+    c = p.add(_Touch(), "c")
+    a.name = str(tmpdir.join("a.txt"))
+    b.name = a.file
+    c.name = str(tmpdir.join("missing", "c.txt"))
+    d = p.add(_Touch(), "d")
+    d.name = c.file
+    for step in [a, b, c, d]:
+        step.job.logdir = str(tmpdir)
+    features = p.submit(slurm, hold=True)
+    for feature in features:
+        feature.wait(slurm, check_interval=0.1)
+    jobs = p.get_accounting(slurm)
+    assert jobs["b"].state == "COMPLETED"
+    assert jobs["c"].state == "FAILED"
+    assert jobs["d"].state == "CANCELLED"
+
+
+def test_emulated_sungrid_hold_and_release(tmpdir, monkeypatch):
+    monkeypatch.setenv("USER", "jip")
+    commands = install(str(tmpdir.join("bin")))
+    sge = SunGrid(qsub=commands["qsub"], qstat=commands["qstat"],
+                  qrls=commands["qrls"], qacct=commands["qacct"],
+                  qdel=commands["qdel"])
+    tool = Add()
+    tool.job.logdir = str(tmpdir)
+    tool.job.name = "add"
+    feature = sge.submit(tool, {"a": 1, "b": 5}, hold=True)
+    assert sge.list() == {feature.jobid: "Queued"}
+    sge.release([feature.jobid])
+    assert feature.get(sge, check_interval=0.1) == 6
+    assert sge.accounting([feature.jobid])[feature.jobid].state == \
+        "COMPLETED"
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Test the resource history"""
+from jip.tools import Tool
+from jip.cluster import JobAccounting
+from jip.pipelines import Pipeline
+from jip.history import ResourceHistory
+from test.clusters import StubCluster
+
+
+class Count(Tool):
+    command = "wc -l ${input} > ${output}"
+    inputs = {"input": None}
+    outputs = {"output": None}
+
+
+def _pipeline(tmpdir, lines=10):
+    input_file = tmpdir.join("input.txt")
+    input_file.write("x\n" * lines)
+    p = Pipeline()
+    step = p.add(Count(), "count")
+    step.input = str(input_file)
+    step.output = str(tmpdir.join("count.txt"))
+    step.job.threads = 8
+    return p, step
+
+
+def test_history_adjusts_resources_of_submitted_steps(tmpdir):
+    path = str(tmpdir.join("history.json"))
+    p, step = _pipeline(tmpdir)
+    step.job.jobid = "1"
+    grid = StubCluster(accounting={"1": JobAccounting(
+        "1", state="COMPLETED", elapsed=600, cpu_time=1200,
+        max_rss=1000 * 1024 * 1024)})
+    history = ResourceHistory(path, headroom=1.5)
+    history.update(p, grid)
+    history.save()
+
+    p, step = _pipeline(tmpdir)
+    p.submit(grid, history=ResourceHistory(path, headroom=1.5))
+    assert grid.submitted[0]["max_time"] == 15
+    # 1500 MB in total, requested per cpu
+    assert grid.submitted[0]["max_mem"] == 750
+    assert grid.submitted[0]["threads"] == 2
+
+
+def test_history_is_keyed_by_input_size_band(tmpdir):
+    history = ResourceHistory(str(tmpdir.join("history.json")))
+    small = _pipeline(tmpdir.mkdir("small"), lines=10)[1]
+    large = _pipeline(tmpdir.mkdir("large"), lines=10000)[1]
+    assert history.key(small) != history.key(large)
+    assert history.estimate(small) is None
+
+
+def _chain(tmpdir):
+    input_file = tmpdir.join("input.txt")
+    input_file.write("x\n" * 10)
+    p = Pipeline()
+    a = p.add(Count(), "a")
+    a.input = str(input_file)
+    a.output = str(tmpdir.join("a.txt"))
+    b = p.add(Count(), "b")
+    b.input = a.output
+    b.output = str(tmpdir.join("b.txt"))
+    b.job.threads = 4
+    return p, a, b
+
+
+def test_history_applies_to_steps_reading_upstream_outputs(tmpdir):
+    path = str(tmpdir.join("history.json"))
+    p, a, b = _chain(tmpdir)
+    a.job.jobid = "1"
+    b.job.jobid = "2"
+    # after the run, the upstream outputs exist
+    tmpdir.join("a.txt").write("1\n" * 1000)
+    tmpdir.join("b.txt").write("1\n")
+    grid = StubCluster(accounting={
+        "1": JobAccounting("1", state="COMPLETED", elapsed=60,
+                           cpu_time=60, max_rss=100 * 1024 * 1024),
+        "2": JobAccounting("2", state="COMPLETED", elapsed=1200,
+                           cpu_time=2400, max_rss=400 * 1024 * 1024)})
+    history = ResourceHistory(path, headroom=1.0)
+    history.update(p, grid)
+    history.save()
+
+    tmpdir.join("a.txt").remove()
+    tmpdir.join("b.txt").remove()
+    p, a, b = _chain(tmpdir)
+    p.submit(grid, history=ResourceHistory(path, headroom=1.0))
+    assert len(grid.submitted) == 2
+    assert grid.submitted[1]["max_time"] == 20
+    assert grid.submitted[1]["threads"] == 2
+    assert grid.submitted[1]["max_mem"] == 200
+
+
+def test_history_estimates_submit_to_sungrid(tmpdir):
+    from jip.cluster import SunGrid
+    path = str(tmpdir.join("history.json"))
+    p, step = _pipeline(tmpdir)
+    step.job.jobid = "1"
+    history = ResourceHistory(path, headroom=1.5)
+    history.update(p, StubCluster(accounting={"1": JobAccounting(
+        "1", state="COMPLETED", elapsed=600, cpu_time=600,
+        max_rss=1000 * 1024 * 1024)}))
+
+    args = tmpdir.join("args")
+    qsub = tmpdir.join("qsub")
+    qsub.write("#!/bin/sh\necho \"$@\" > %s\ncat > /dev/null\n"
+               "echo 'Your job 5 (\"count\") has been submitted'\n" % args)
+    qsub.chmod(0755)
+    p, step = _pipeline(tmpdir)
+    step.job.logdir = str(tmpdir)
+    p.submit(SunGrid(qsub=str(qsub)), history=history)
+    assert "-l h_rt=900" in args.read()
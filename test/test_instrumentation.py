@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Test the instrumentation hooks"""
+from jip import instrumentation
+from jip.tools import Tool
+from jip.pipelines import Pipeline
+from test.clusters import StubCluster
+import pytest
+
+
+class Copy(Tool):
+    command = "cp ${input} ${output}"
+    inputs = {"input": None}
+    outputs = {"output": None}
+
+
+@pytest.fixture
+def collector(request):
+    collector = instrumentation.install()
+    request.addfinalizer(instrumentation.uninstall)
+    return collector
+
+
+def test_no_collector_installed_by_default():
+    assert instrumentation.get_collector() is None
+    assert instrumentation.start() is None
+    instrumentation.stop(instrumentation.PHASE_RENDER, Copy(), None)
+
+
+def test_collector_aggregates_local_run_per_tool_class(tmpdir, collector):
+    source = tmpdir.join("a.txt")
+    source.write("a")
+    p = Pipeline()
+    first = p.add(Copy(), "first")
+    first.input = str(source)
+    first.output = str(tmpdir.join("b.txt"))
+    second = p.add(Copy(), "second")
+    second.input = first.output
+    second.output = str(tmpdir.join("c.txt"))
+    p.run()
+
+    timings = collector.summary()["test.test_instrumentation.Copy"]
+    for phase in [instrumentation.PHASE_RESOLVE, instrumentation.PHASE_RENDER,
+                  instrumentation.PHASE_IS_DONE,
+                  instrumentation.PHASE_EXECUTE]:
+        assert timings[phase]["count"] >= 2
+        assert timings[phase]["max"] >= timings[phase]["mean"] >= 0
+    assert timings[instrumentation.PHASE_RENDER]["count"] == 2
+    assert timings[instrumentation.PHASE_EXECUTE]["count"] == 2
+
+
+def test_collector_records_submission_and_job_timings(tmpdir, collector):
+    from jip.remote import _encode_payload
+    cluster = StubCluster()
+    tool = Copy()
+    feature = cluster.submit(tool, {"input": "a", "output": "b"})
+    assert feature.tool is tool
+    assert feature.submitted is not None
+
+    path = tmpdir.join("job.result")
+    started = feature.submitted + 10
+    path.write(_encode_payload((1, {"start": started, "load": 0.5,
+                                    "startup": 0.5,
+                                    "end": started + 20})), mode="wb")
+    feature.result = str(path)
+    assert feature.load() == 1
+
+    timings = collector.summary()["test.test_instrumentation.Copy"]
+    assert timings[instrumentation.PHASE_SUBMIT]["count"] == 1
+    assert timings[instrumentation.PHASE_LOAD]["count"] == 1
+    assert timings[instrumentation.PHASE_QUEUE]["total"] == \
+        pytest.approx(9.0)
+    assert timings[instrumentation.PHASE_EXECUTE]["total"] == \
+        pytest.approx(20.0)
+
+
+class Other(Tool):
+    def call(self, args):
+        return None
+
+
+def test_group_submission_is_attributed_to_all_tool_classes(collector):
+    cluster = StubCluster()
+    cluster.submit_packed([Copy(), Other()], args=[{}, {}])
+    assert collector.summary().keys() == [
+        "test.test_instrumentation.Copy+test.test_instrumentation.Other"]
+
+
+class _RecordOnly(object):
+    """Collector that only records timings"""
+    def __init__(self):
+        self.phases = []
+
+    def record(self, phase, subject, seconds):
+        self.phases.append(phase)
+
+
+def test_collectors_without_counts_and_gauges(request):
+    collector = instrumentation.install(_RecordOnly())
+    request.addfinalizer(instrumentation.uninstall)
+    tool = Copy()
+    tool.get_command({"input": "a.txt", "output": "b.txt"})
+    StubCluster().submit(tool, {"input": "a.txt", "output": "b.txt"})
+    instrumentation.gauge(instrumentation.GAUGE_RUNNING, 1)
+    assert instrumentation.PHASE_RENDER in collector.phases
+    assert instrumentation.PHASE_SUBMIT in collector.phases
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Test the metrics exporter"""
+from jip import instrumentation
+from jip.metrics import Registry, MetricsCollector
+from jip.tools import Tool
+from jip.pipelines import Pipeline
+from test.clusters import StubCluster
+import pytest
+
+
+class Touch(Tool):
+    command = "touch ${output}"
+    outputs = {"output": None}
+
+
+@pytest.fixture
+def collector(request):
+    collector = instrumentation.install(MetricsCollector())
+    request.addfinalizer(instrumentation.uninstall)
+    return collector
+
+
+def test_registry_renders_text_format():
+    registry = Registry()
+    registry.counter("jobs_total", "Jobs", ["tool"]).inc(2, {"tool": 'a"b'})
+    histogram = registry.histogram("latency_seconds", "Latency",
+                                   buckets=(0.1, 1, float("inf")))
+    histogram.observe(0.5)
+    histogram.observe(5)
+    text = registry.render()
+    assert '# TYPE jobs_total counter\njobs_total{tool="a\\"b"} 2\n' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0\n' in text
+    assert 'latency_seconds_bucket{le="1"} 1\n' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2\n' in text
+    assert "latency_seconds_sum 5.5\n" in text
+    assert "latency_seconds_count 2\n" in text
+
+
+def test_local_run_metrics(tmpdir, collector):
+    p = Pipeline()
+    done = p.add(Touch(), "done")
+    done.output = str(tmpdir.join("done.txt"))
+    tmpdir.join("done.txt").write("")
+    todo = p.add(Touch(), "todo")
+    todo.output = str(tmpdir.join("todo.txt"))
+    p.run()
+    text = collector.registry.render()
+    tool = 'tool="test.test_metrics.Touch"'
+    assert 'jip_result_cache_hits_total{%s} 1\n' % tool in text
+    assert 'jip_steps_completed_total{%s} 1\n' % tool in text
+    assert 'jip_phase_duration_seconds_count{phase="execute",%s} 1\n' % \
+        tool in text
+
+
+def test_cluster_metrics_are_served_over_http(tmpdir, collector):
+    import urllib2
+    grid = StubCluster(tmpdir)
+    features = [grid.submit(Touch(), {"output": "x"}) for i in range(3)]
+    assert len(list(grid.collect(features, check_interval=0))) == 3
+    server = collector.registry.serve(0)
+    try:
+        text = urllib2.urlopen("http://127.0.0.1:%d/metrics" %
+                               server.server_address[1]).read()
+    finally:
+        server.shutdown()
+    assert 'jip_steps_submitted_total{tool="test.test_metrics.Touch"} 3\n' \
+        in text
+    assert 'jip_submission_latency_seconds_count{' \
+        'tool="test.test_metrics.Touch"} 3\n' in text
+    assert "jip_poll_latency_seconds_count 1\n" in text
+    assert "jip_steps_running 0\n" in text
+
+    collector.registry.write(str(tmpdir.join("jip.prom")))
+    assert tmpdir.join("jip.prom").read() == collector.registry.render()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Test pilot job execution with local workers"""
+import os
+import time
+from jip.tools import Tool, background
+from jip.pipelines import Pipeline, PipelineException
+from jip.pilot import Pilot
+import pytest
+
+
+class Append(Tool):
+    """Copy the input file, if any, and append the text"""
+    inputs = {"input": None, "text": None}
+    outputs = {"output": None}
+
+    def call(self, args):
+        content = ""
+        if args["input"] is not None:
+            content = open(args["input"]).read()
+        with open(args["output"], "w") as out:
+            out.write(content + args["text"])
+        return content + args["text"]
+
+
+class Crash(Tool):
+    """Kill the worker on the first call"""
+    inputs = {"marker": None}
+
+    def call(self, args):
+        if not os.path.exists(args["marker"]):
+            open(args["marker"], "w").close()
+            os._exit(1)
+        return "done"
+
+
+# tool names passed to the slow background listener
+_listened = []
+
+
+def _slow_listener(tool):
+    time.sleep(0.2)
+    _listened.append(tool.name)
+
+
+class Listened(Append):
+    name = "listened"
+    on_finish = [background(_slow_listener)]
+
+
+def _pipeline(tmpdir):
+    p = Pipeline()
+    a = p.add(Append(), "a")
+    b = p.add(Append(), "b")
+    c = p.add(Append(), "c")
+    d = p.add(Append(), "d")
+    a.text = "a"
+    a.output = str(tmpdir.join("a.txt"))
+    b.input = a.output
+    b.text = "b"
+    b.output = str(tmpdir.join("b.txt"))
+    c.input = b.output
+    c.text = "c"
+    c.output = str(tmpdir.join("c.txt"))
+    d.input = a.output
+    d.text = "d"
+    d.output = str(tmpdir.join("d.txt"))
+    return p
+
+
+def test_pilot_runs_pipeline_with_local_workers(tmpdir):
+    pilot = Pilot(str(tmpdir.join("queue")), workers=2, poll_interval=0.05)
+    results = pilot.run(_pipeline(tmpdir))
+    assert results == {"a": "a", "b": "ab", "c": "abc", "d": "ad"}
+    assert os.path.exists(str(tmpdir.join("queue", "stop")))
+
+
+def test_pilot_runs_fused_chains(tmpdir):
+    p = _pipeline(tmpdir)
+    pilot = Pilot(str(tmpdir.join("queue")), workers=1, poll_interval=0.05,
+                  fuse=True)
+    units, deps = pilot._units(p)
+    assert sorted(len(u) for u in units) == [1, 1, 2]
+    assert pilot.run(p)["c"] == "abc"
+
+
+def test_pilot_skips_dependents_of_failed_steps(tmpdir):
+    p = _pipeline(tmpdir)
+    p.get("b").text = None
+    pilot = Pilot(str(tmpdir.join("queue")), workers=2, poll_interval=0.05)
+    with pytest.raises(PipelineException) as excinfo:
+        pilot.run(p)
+    assert sorted(excinfo.value.failures.keys()) == ["b", "c"]
+    assert "not executed" in str(excinfo.value.failures["c"])
+
+
+def test_pilot_requeues_tasks_of_exited_workers(tmpdir):
+    p = Pipeline()
+    p.add(Crash(), "crash").marker = str(tmpdir.join("marker"))
+    pilot = Pilot(str(tmpdir.join("queue")), workers=2, poll_interval=0.05,
+                  check_interval=0.1)
+    assert pilot.run(p) == {"crash": "done"}
+
+
+def test_pilot_fails_all_steps_of_failed_chain_tasks(tmpdir):
+    from jip.remote import _write_result
+    p = _pipeline(tmpdir)
+    pilot = Pilot(str(tmpdir.join("queue")), fuse=True)
+    units, deps = pilot._units(p)
+    chain = [i for i, u in enumerate(units) if len(u) == 2][0]
+    tmpdir.join("queue", "done").ensure(dir=True)
+    _write_result(str(tmpdir.join("queue", "done", "%d.result" % chain)),
+                  ValueError("failed", "twice"), {})
+    results = pilot._load(chain, units)
+    assert len(results) == 2
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_worker_waits_for_background_listeners(tmpdir):
+    from jip.pilot import worker
+    from jip.remote import _encode_payload, _ToolWrapper
+    for folder in ["tasks", "running", "done"]:
+        tmpdir.mkdir(folder)
+    tmpdir.join("tasks", "0.task").write(_encode_payload(_ToolWrapper(
+        Listened(), {"input": None, "text": "a",
+                     "output": str(tmpdir.join("a.txt"))})), mode="wb")
+    tmpdir.join("stop").write("")
+    del _listened[:]
+    assert worker(str(tmpdir), poll_interval=0.01) == 1
+    assert _listened == ["listened"]
+
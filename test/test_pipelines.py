@@ -134,5 +134,60 @@ def test_pipeline_circular_dependencies_complex_loop():
     print excinfo.value.circle == [a, b, c, d]
 
 
+def _chain_pipeline():
+    p = Pipeline()
+    a = p.add(Touch(), "a")
+    b = p.add(Touch(), "b")
+    c = p.add(Touch(), "c")
+    a.name = "a.txt"
+    b.name = a.file
+    c.name = b.file
+    return p, a, b, c
+
+
+def test_pipeline_linear_chains():
+    p, a, b, c = _chain_pipeline()
+    assert p.get_linear_chains() == [[a, b, c]]
+
+
+def test_pipeline_linear_chains_break_on_fan_out():
+    p, a, b, c = _chain_pipeline()
+    d = p.add(Touch(), "d")
+    d.name = b.file
+    assert p.get_linear_chains() == [[a, b]]
+
+
+def test_pipeline_linear_chains_break_on_incompatible_jobs():
+    p, a, b, c = _chain_pipeline()
+    c.job.queue = "long"
+    assert p.get_linear_chains() == [[a, b]]
+
+
+def test_escalated_time_limits_submit_to_sungrid():
+    from jip.cluster import SunGrid
+    from jip.pipelines import _escalate
+    from jip.tools import _parse_minutes
+    minutes = _escalate(_parse_minutes("0:10:00"), 1.5)
+    assert minutes == 15
+    assert SunGrid()._parse_time(minutes) == 900
+
+
+def test_pipeline_run_aggregates_resource_usage(tmpdir):
+    p = Pipeline()
+    a = p.add(Touch(), "a")
+    a.name = str(tmpdir.join("a.txt"))
+    b = p.add(Touch(), "b")
+    b.name = str(tmpdir.join("b.txt"))
+    p.run()
+    assert sorted(p.resource_usage.keys()) == ["a", "b"]
+    usage = p.get_resource_usage()
+    assert usage["steps"] == 2
+    assert usage["max_rss_step"] in ["a", "b"]
+    assert usage["max_rss"] == max(u["max_rss"]
+                                   for u in p.resource_usage.values())
+    assert usage["user_time"] == pytest.approx(
+        sum(u["user_time"] for u in p.resource_usage.values()))
+
+
 if __name__ == "__main__":
     test_pipeline_circular_dependencies_complex_loop()
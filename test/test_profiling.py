@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Test the profiling of tool invocations"""
+import os
+from jip.tools import Tool
+from jip import profiling
+from jip.remote import _encode_payload, _ToolWrapper, main
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+class Fib(Tool):
+    name = "fib"
+
+    def call(self, args):
+        return fib(args["n"])
+
+
+def test_tools_are_not_profiled_by_default(tmpdir):
+    t = Fib()
+    t.job.logdir = str(tmpdir)
+    assert t.run({"n": 5}) == 5
+    assert tmpdir.listdir() == []
+
+
+def test_jobs_without_profile_setting_run(tmpdir):
+    # jobs pickled before the profile setting existed
+    t = Fib()
+    t.job.logdir = str(tmpdir)
+    del t.job.profile
+    assert t.run({"n": 5}) == 5
+    assert tmpdir.listdir() == []
+
+
+def test_profiles_are_written_to_log_directory_and_merged(tmpdir):
+    t = Fib()
+    t.job.logdir = str(tmpdir.join("logs"))
+    t.job.profile = True
+    assert t.run({"n": 10}) == 55
+    assert t.run({"n": 5}) == 5
+    files = os.listdir(t.job.logdir)
+    assert len(files) == 2
+    assert all(f.startswith("test.test_profiling.Fib-") for f in files)
+
+    merged = profiling.merge(t.job.logdir, output=str(tmpdir))
+    assert merged.keys() == ["test.test_profiling.Fib"]
+    calls = [v[1] for k, v in merged.values()[0].stats.items()
+             if k[2] == "fib"]
+    assert calls == [177 + 15]
+    assert tmpdir.join("test.test_profiling.Fib.pstats").check()
+
+
+def test_remote_bootstrap_profiles_payload(tmpdir):
+    payload = tmpdir.join("payload")
+    payload.write(_encode_payload(_ToolWrapper(Fib(), {"n": 3})), mode="wb")
+    target = tmpdir.join("profiles")
+    try:
+        assert main(["--profile", str(target), "--result",
+                     str(tmpdir.join("result")), str(payload)]) == 0
+    finally:
+        profiling.disable()
+    assert len(target.listdir()) == 1
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Test the remote bootstrap module"""
+import time
+from jip.tools import Tool, background
+from jip.remote import _encode_payload, _decode_payload, _ToolWrapper, main
+import pytest
+
+
+class AddTool(Tool):
+    name = "add"
+
+    def call(self, args):
+        return args["a"] + args["b"]
+
+
+# tool names passed to the slow background listener
+_listened = []
+
+
+def _slow_listener(tool):
+    time.sleep(0.2)
+    _listened.append(tool.name)
+
+
+class ListenedTool(AddTool):
+    on_finish = [background(_slow_listener)]
+
+
+def test_payload_encoding_round_trip():
+    data = {"a": range(100), "b": "x" * 1000}
+    payload = _encode_payload(data)
+    assert payload.startswith("JIP1z")
+    assert len(payload) < len(repr(data))
+    assert _decode_payload(payload) == data
+    assert _decode_payload(_encode_payload(data, compress=False)) == data
+
+
+def test_payload_decoding_legacy_pickle():
+    import cPickle
+    assert _decode_payload(cPickle.dumps([1, 2])) == [1, 2]
+
+
+def test_payload_decoding_unsupported_version():
+    with pytest.raises(ValueError):
+        _decode_payload("JIP9z")
+
+
+def test_remote_main_writes_result_file(tmpdir):
+    payload = tmpdir.join("payload")
+    payload.write(_encode_payload(_ToolWrapper(AddTool(), {"a": 1, "b": 2})),
+                  mode="wb")
+    result_file = tmpdir.join("result")
+    assert main(["--result", str(result_file), str(payload)]) == 0
+    result, info = _decode_payload(result_file.read(mode="rb"))
+    assert result == 3
+    assert info["host"] is not None
+    assert info["end"] >= info["start"]
+
+
+def test_remote_main_returns_failure_on_exception(tmpdir):
+    payload = tmpdir.join("payload")
+    payload.write(_encode_payload(_ToolWrapper(AddTool(), {"a": 1})),
+                  mode="wb")
+    result_file = tmpdir.join("result")
+    assert main(["--result", str(result_file), str(payload)]) == 1
+    result, info = _decode_payload(result_file.read(mode="rb"))
+    assert isinstance(result, Exception)
+
+
+def test_remote_bootstrap_does_not_import_cluster():
+    import subprocess
+    import sys
+    code = "import sys, jip.remote; print 'jip.cluster' in sys.modules, " \
+           "'mako' in sys.modules"
+    out = subprocess.check_output([sys.executable, "-c", code])
+    assert out.strip() == "False False"
+
+
+def test_tool_pack_runs_tools_in_parallel():
+    from jip.remote import _ToolPack
+    pack = _ToolPack([_ToolWrapper(AddTool(), {"a": i, "b": 1})
+                      for i in range(4)] +
+                     [_ToolWrapper(AddTool(), {"a": 1})], slots=2)
+    result = pack.run()
+    assert result[:4] == [1, 2, 3, 4]
+    assert isinstance(result[4], Exception)
+    assert pack.failed(result)
+    assert not pack.failed(result[:4])
+
+
+def test_tool_chain_stops_at_first_failure():
+    from jip.remote import _ToolChain
+    chain = _ToolChain([_ToolWrapper(AddTool(), {"a": 1, "b": 1}),
+                        _ToolWrapper(AddTool(), {"a": 1}),
+                        _ToolWrapper(AddTool(), {"a": 2, "b": 2})])
+    result = chain.run()
+    assert result[0] == 2
+    assert isinstance(result[1], Exception)
+    assert "not executed" in str(result[2])
+    assert chain.failed(result)
+
+
+def test_remote_main_reports_runtime_of_group_tools(tmpdir):
+    from jip.remote import _ToolChain
+    payload = tmpdir.join("payload")
+    payload.write(_encode_payload(_ToolChain(
+        [_ToolWrapper(AddTool(), {"a": 1}),
+         _ToolWrapper(AddTool(), {"a": 1, "b": 1})])), mode="wb")
+    result_file = tmpdir.join("result")
+    assert main(["--result", str(result_file), str(payload)]) == 1
+    result, info = _decode_payload(result_file.read(mode="rb"))
+    assert len(info["steps"]) == 2
+    assert info["steps"][0]["end"] >= info["steps"][0]["start"]
+    assert info["steps"][1] is None
+
+
+def test_step_driver_runs_steps_after_dependencies(tmpdir):
+    from jip.remote import _StepDriver
+    wrappers = [_ToolWrapper(AddTool(), {"a": 1, "b": 2}),
+                _ToolWrapper(AddTool(), {"a": 1}),
+                _ToolWrapper(AddTool(), {"a": 3, "b": 4}),
+                _ToolWrapper(AddTool(), {"a": 5, "b": 6})]
+    driver = _StepDriver(wrappers, ["a", "b", "c", "d"],
+                         [[], [0], [1], [0]], str(tmpdir), srun=None)
+    results = driver.run()
+    assert results[0] == 3
+    assert isinstance(results[1], Exception)
+    assert "not executed" in str(results[2])
+    assert results[3] == 11
+    assert driver.failed(results)
+
+
+def test_step_driver_srun_command():
+    from jip.remote import _StepDriver
+    tool = AddTool()
+    tool.job.threads = 4
+    tool.job.max_mem = 1000
+    driver = _StepDriver([_ToolWrapper(tool, {})], ["a"], [[]], "/tmp")
+    cmd = driver._command(0, "p", "r")
+    assert cmd[:9] == ["srun", "-n", "1", "-c", "4", "--exclusive",
+                       "-J", "a", "--mem-per-cpu=1000"]
+    assert cmd[-5:] == ["-m", "jip.remote", "--result", "r", "p"]
+
+
+def test_run_wrapper_waits_for_background_listeners():
+    from jip.remote import _run_wrapper
+    del _listened[:]
+    result, info = _run_wrapper(_ToolWrapper(ListenedTool(),
+                                             {"a": 1, "b": 2}))
+    assert result == 3
+    assert _listened == ["add"]
+
@@ -3,6 +3,7 @@
 and its implementation
 """
 
+import pytest
 from jip.tools import Tool, ToolException
 
 
@@ -154,3 +155,135 @@ def test_paramter_defs_and_file_cleanup():
                 for x in args]
     t = FastQC()
 
+
+def test_interpreter_run_records_resource_usage():
+    usage = []
+
+    class Busy(Tool):
+        name = "busy"
+        command = "x=0; while [ $x -lt 20000 ]; do x=$((x+1)); done"
+        on_success = [lambda tool, args: usage.append(tool.resource_usage)]
+
+    t = Busy()
+    t.run({})
+    assert usage == [t.resource_usage]
+    assert t.resource_usage["user_time"] > 0
+    assert t.resource_usage["max_rss"] > 0
+    assert t.resource_usage["wall_time"] >= t.resource_usage["user_time"]
+
+
+def test_interpreter_run_reports_exit_value():
+    class Fail(Tool):
+        name = "fail"
+        command = "exit 3"
+
+    t = Fail()
+    with pytest.raises(ToolException) as excinfo:
+        t.run({})
+    assert "terminated with 3" in str(excinfo.value)
+    assert t.resource_usage is not None
+
+
+def test_listener_signatures_are_inspected_once():
+    from jip.tools import _dispatch_modes, _CALL_ARGS, _CALL_NO_ARGS
+    calls = []
+
+    def listener(tool, args):
+        calls.append(args)
+
+    class MyTool(Tool):
+        name = "Mytool"
+        on_start = [listener]
+
+        def call(self, args):
+            pass
+
+    t = MyTool()
+    t.run({"a": 1})
+    assert _dispatch_modes[listener] == _CALL_ARGS
+    _dispatch_modes[listener] = _CALL_NO_ARGS
+    # the cached mode is used, so the listener call fails
+    t.run({"a": 2})
+    del _dispatch_modes[listener]
+    t.run({"a": 3})
+    assert calls == [{"a": 1}, {"a": 3}]
+
+
+def test_method_listeners_are_cached_by_function():
+    from jip.tools import _dispatch_modes, _CALL_ARGS
+
+    class Recorder(object):
+        def __init__(self):
+            self.calls = []
+
+        def listener(self, tool, args):
+            self.calls.append(args)
+
+    recorder = Recorder()
+
+    class MyTool(Tool):
+        name = "Mytool"
+        on_start = [recorder.listener]
+
+        def call(self, args):
+            pass
+
+    MyTool().run({"a": 1})
+    assert recorder.calls == [{"a": 1}]
+    assert _dispatch_modes[Recorder.listener.im_func] == _CALL_ARGS
+
+
+def test_method_listeners_without_args():
+    class Recorder(object):
+        def __init__(self):
+            self.calls = []
+
+        def on_tool(self, tool):
+            self.calls.append(("tool", tool.name))
+
+        def on_nothing(self):
+            self.calls.append(("nothing",))
+
+        def __call__(self, tool):
+            self.calls.append(("call", tool.name))
+
+    recorder = Recorder()
+
+    class MyTool(Tool):
+        name = "Mytool"
+        on_start = [recorder.on_tool, recorder.on_nothing, recorder]
+
+        def call(self, args):
+            pass
+
+    MyTool().run({})
+    assert recorder.calls == [("tool", "Mytool"), ("nothing",),
+                              ("call", "Mytool")]
+
+
+def test_background_listeners():
+    import threading
+    from jip.tools import background, wait_listeners
+    threads = []
+    release = threading.Event()
+
+    def slow(tool, args):
+        release.wait()
+        threads.append(threading.current_thread())
+
+    def failing(tool):
+        raise ValueError("ignored")
+
+    class MyTool(Tool):
+        name = "Mytool"
+        on_finish = [background(slow), background(failing)]
+
+        def call(self, args):
+            return 1
+
+    assert MyTool().run({}) == 1
+    assert not wait_listeners(timeout=0.01)
+    release.set()
+    assert wait_listeners(timeout=5)
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
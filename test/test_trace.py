@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Test the trace export of pipeline runs"""
+import json
+from jip.tools import Tool
+from jip.pipelines import Pipeline
+from test.clusters import StubCluster
+
+
+class Copy(Tool):
+    command = "cp ${input} ${output}"
+    inputs = {"input": None}
+    outputs = {"output": None}
+
+
+def _pipeline(tmpdir):
+    source = tmpdir.join("a.txt")
+    source.write("a")
+    p = Pipeline()
+    first = p.add(Copy(), "first")
+    first.input = str(source)
+    first.output = str(tmpdir.join("b.txt"))
+    second = p.add(Copy(), "second")
+    second.input = first.output
+    second.output = str(tmpdir.join("c.txt"))
+    return p
+
+
+def _events(path, phase):
+    return [e for e in json.load(open(str(path)))["traceEvents"]
+            if e["ph"] == phase]
+
+
+def test_local_run_trace(tmpdir):
+    p = _pipeline(tmpdir)
+    trace = tmpdir.join("run.json")
+    p.run(trace=str(trace))
+    spans = _events(trace, "X")
+    assert [s["name"] for s in spans] == ["first", "second"]
+    assert spans[1]["ts"] >= spans[0]["ts"] + spans[0]["dur"]
+    assert spans[0]["args"]["tool"] == "test.test_trace.Copy"
+    start, finish = _events(trace, "s"), _events(trace, "f")
+    assert len(start) == len(finish) == 1
+    assert start[0]["ts"] < finish[0]["ts"] == spans[1]["ts"]
+
+
+def _runtime(jobid):
+    """Runtime information of the stub jobs, started 10 seconds apart"""
+    start = 1000.0 + 10 * int(jobid)
+    return {"host": "node%s" % jobid, "pid": 1, "start": start,
+            "end": start + 5}
+
+
+def test_collect_trace_uses_job_runtime_information(tmpdir):
+    p = _pipeline(tmpdir)
+    grid = StubCluster(tmpdir, info=_runtime)
+    p.submit(grid)
+    trace = tmpdir.join("cluster.json")
+    steps = [step._name for step, result in
+             p.collect(grid, check_interval=0, trace=str(trace))]
+    assert sorted(steps) == ["first", "second"]
+    spans = dict((s["name"], s) for s in _events(trace, "X"))
+    assert spans["first"]["args"]["host"] == "node1"
+    assert spans["second"]["args"]["jobid"] == "2"
+    assert spans["second"]["ts"] - spans["first"]["ts"] == 10000000
+    assert spans["first"]["dur"] == 5000000
+    assert len(_events(trace, "f")) == 1